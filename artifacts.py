@@ -0,0 +1,75 @@
+# artifacts.py
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+import fsio
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class Artifact:
+    """
+    الملفات المحلية لتغريدة واحدة، مشتركة بين كل الطلبات المتزامنة عليها.
+    كل خطوة (yt-dlp، تنزيل رابط، تجهيز فيديو، رفع للقناة) تُنفذ مرة واحدة عبر once
+    وتبقى نتيجتها متاحة للمستهلكين اللاحقين ما دام المجلد حيًا.
+    """
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self.refs = 0
+        self._steps: Dict[Hashable, asyncio.Task] = {}
+
+    async def once(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """نتيجة الخطوة key (أو استثناؤها)؛ أول مستدعٍ ينفذها والبقية ينتظرون."""
+        task = self._steps.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._steps[key] = task
+            metrics.inc("artifact_steps_total", result="run")
+        else:
+            metrics.inc("artifact_steps_total", result="shared")
+        # shield: إلغاء أحد المستهلكين لا يلغي الخطوة على البقية
+        return await asyncio.shield(task)
+
+    async def _discard(self):
+        # خطوات لم تكتمل بعد خروج آخر مستهلك: تُلغى وتُنتظر قبل حذف ملفاتها
+        pending = [task for task in self._steps.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._steps.values(), return_exceptions=True)
+        self._steps.clear()
+        # الحذف في الخلفية: آخر مستهلك لا ينتظر rmtree
+        fsio.remove_later(self.dir)
+
+class ArtifactRegistry:
+    """
+    سجل الملفات الجارية حسب tweet_id مع عدّاد مراجع:
+    الطلبات المتزامنة على نفس التغريدة (من محادثات مختلفة) تشترك في تنزيل واحد ثم يرفع كل منها لمحادثته،
+    والمجلد يُحذف عند خروج آخر مستهلك.
+    """
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self._artifacts: Dict[str, Artifact] = {}
+
+    def __len__(self) -> int:
+        return len(self._artifacts)
+
+    @asynccontextmanager
+    async def use(self, tweet_id: str) -> AsyncIterator[Artifact]:
+        artifact = self._artifacts.get(tweet_id)
+        if artifact is None:
+            # لاحقة فريدة: جيل جديد لا يصطدم بمجلد سابق ما زال يُحذف
+            artifact = Artifact(self.base_dir / f"{tweet_id}-{uuid.uuid4().hex[:8]}")
+            self._artifacts[tweet_id] = artifact
+        artifact.refs += 1
+        try:
+            yield artifact
+        finally:
+            artifact.refs -= 1
+            if artifact.refs == 0:
+                if self._artifacts.get(tweet_id) is artifact:
+                    del self._artifacts[tweet_id]
+                await artifact._discard()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# bench/fake_ytdlp.py
+"""
+بديل لأمر yt-dlp يُستخدم مع YTDLP_MODE=subprocess و YTDLP_BIN.
+يسأل bench/fakes.py (BENCH_FAKES_URL) عن حجم فيديو التغريدة، وينتظر زمن الاستخراج المحاكى،
+ثم يكتب ملفًا بالحجم المطلوب في مسار -o. الأخطاء تُطبع على stderr بنفس صيغة yt-dlp.
+"""
+import json
+import os
+import re
+import sys
+import urllib.error
+import urllib.request
+
+def main() -> int:
+    args = sys.argv[1:]
+    output = args[args.index("-o") + 1] if "-o" in args else None
+    match = re.search(r"/status/(\d+)", args[-1] if args else "")
+    if not output or not match:
+        print("ERROR: bad arguments", file=sys.stderr)
+        return 2
+
+    base = os.environ.get("BENCH_FAKES_URL", "http://127.0.0.1:8089")
+    try:
+        with urllib.request.urlopen(f"{base}/_ytdlp/{match.group(1)}", timeout=300) as response:
+            size = json.load(response)["size"]
+    except urllib.error.HTTPError as e:
+        print(json.load(e).get("error", "ERROR: fake yt-dlp failed"), file=sys.stderr)
+        return 1
+
+    block = b"\0" * (1024 * 1024)
+    with open(output, "wb") as f:
+        while size > 0:
+            f.write(block[:size])
+            size -= len(block)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+# bench/fakes.py
+"""
+بدائل محلية لكل الخدمات الخارجية في خادم aiohttp واحد:
+- Telegram Bot API:   /bot<token>/<method>
+- api.vxtwitter.com:  /i/status/<tweet_id>
+- twimg (CDN):        /media/<name>?size=<bytes>
+- yt-dlp الوهمي:      /_ytdlp/<tweet_id> (يستدعيه bench/fake_ytdlp.py)
+- تحكم الاختبار:      POST /_catalog و GET /_stats و POST /_updates (تحديثات لـ getUpdates)
+
+يُشغَّل كعملية مستقلة (python -m bench.fakes ...) حتى لا يدخل في قياس ذاكرة البوت.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+# الطرق التي تحمل وسائط: أول استدعاء منها لكل رسالة مستخدم = time-to-first-media
+MEDIA_METHODS = {"sendPhoto", "sendVideo", "sendAnimation", "sendDocument", "sendMediaGroup", "copyMessage"}
+CHUNK = 64 * 1024
+
+class FakeUpstreams:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        # tweet_id -> {"kind": "photo"|"video"|"text", "count": n, "size": bytes}
+        self.catalog: Dict[str, dict] = {}
+        self.first_media: Dict[str, float] = {}
+        self.calls: Counter = Counter()
+        self.bytes_uploaded = 0
+        self.bytes_served = 0
+        self._message_ids = itertools.count(10_000_000)
+        self._file_ids = itertools.count(1)
+        self._session: Optional[ClientSession] = None
+        # تحديثات تُسلَّم عبر getUpdates (لتشغيل main.py الحقيقي بنمط polling)
+        self._updates: List[dict] = []
+        self._updates_arrived: Optional[asyncio.Event] = None
+        self.base_url = f"http://{args.host}:{args.port}"
+
+    # --- Helpers ---
+    def _failed(self, rate: float) -> bool:
+        return rate > 0 and random.random() < rate
+
+    @staticmethod
+    async def _sleep_ms(ms: float):
+        if ms > 0:
+            # تذبذب ±25% حتى لا تتزامن كل الطلبات
+            await asyncio.sleep(ms / 1000 * random.uniform(0.75, 1.25))
+
+    @staticmethod
+    async def _throttle(size: int, mbps: float):
+        if mbps > 0:
+            await asyncio.sleep(size * 8 / (mbps * 1_000_000))
+
+    def _file(self, **extra) -> dict:
+        n = next(self._file_ids)
+        return {"file_id": f"BENCH{n}", "file_unique_id": f"U{n}", **extra}
+
+    # --- Control ---
+    async def handle_catalog(self, request: web.Request) -> web.Response:
+        self.catalog.update(await request.json())
+        return web.json_response({"ok": True, "tweets": len(self.catalog)})
+
+    async def handle_updates(self, request: web.Request) -> web.Response:
+        self._updates.extend(await request.json())
+        if self._updates_arrived is not None:
+            self._updates_arrived.set()
+        return web.json_response({"ok": True, "pending": len(self._updates)})
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            # long polling مختصر: حتى ثانية واحدة بانتظار تحديث جديد
+            self._updates_arrived = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._updates_arrived.wait(), min(float(params.get("timeout") or 0), 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "first_media": self.first_media,
+            "calls": dict(self.calls),
+            "bytes_uploaded": self.bytes_uploaded,
+            "bytes_served": self.bytes_served,
+        })
+
+    # --- vxtwitter ---
+    def _media_url(self, tweet_id: str, index: int, ext: str, size: int) -> str:
+        return f"{self.base_url}/media/{tweet_id}_{index}.{ext}?size={size}"
+
+    async def handle_vxtwitter(self, request: web.Request) -> web.Response:
+        self.calls["vxtwitter"] += 1
+        await self._sleep_ms(self.args.vx_latency_ms)
+        if self._failed(self.args.vx_fail_rate):
+            return web.json_response({"error": "upstream"}, status=500)
+        tweet_id = request.match_info["tweet_id"]
+        entry = self.catalog.get(tweet_id)
+        if entry is None:
+            return web.json_response({"error": "not found"}, status=404)
+        media = []
+        if entry["kind"] == "photo":
+            media = [{"type": "image", "url": self._media_url(tweet_id, i, "jpg", entry["size"]),
+                      "thumbnail_url": self._media_url(tweet_id, i, "jpg", 8 * 1024)}
+                     for i in range(entry["count"])]
+        elif entry["kind"] == "video":
+            duration_ms = 30_000
+            url = self._media_url(tweet_id, 0, "mp4", entry["size"])
+            media = [{"type": "video", "url": url, "duration_millis": duration_ms,
+                      "thumbnail_url": self._media_url(tweet_id, 0, "jpg", 8 * 1024),
+                      "variants": [{"url": url, "content_type": "video/mp4",
+                                    "bitrate": int(entry["size"] * 8 / (duration_ms / 1000))}]}]
+        return web.json_response({
+            "id": tweet_id, "text": f"bench tweet {tweet_id}",
+            "user_name": "Bench", "user_screen_name": "bench",
+            "tweetURL": f"https://x.com/bench/status/{tweet_id}",
+            "media_extended": media,
+        })
+
+    # --- CDN ---
+    async def handle_media(self, request: web.Request) -> web.StreamResponse:
+        self.calls["cdn"] += 1
+        await self._sleep_ms(self.args.cdn_latency_ms)
+        if self._failed(self.args.cdn_fail_rate):
+            return web.Response(status=503)
+        total = int(request.query.get("size", 0))
+        content_type = "video/mp4" if request.match_info["name"].endswith(".mp4") else "image/jpeg"
+        headers = {"Content-Type": content_type, "Accept-Ranges": "bytes"}
+        # Range: bytes=start-end كما في twimg (الحد للسرعة cdn_mbps لكل اتصال)
+        start, end, status = 0, total - 1, 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match and int(match.group(1)) < total:
+            start, status = int(match.group(1)), 206
+            end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        size = end - start + 1
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = size
+        await response.prepare(request)
+        chunk = b"\0" * CHUNK
+        sent = 0
+        while sent < size:
+            piece = chunk[:min(CHUNK, size - sent)]
+            await response.write(piece)
+            await self._throttle(len(piece), self.args.cdn_mbps)
+            sent += len(piece)
+        self.bytes_served += sent
+        await response.write_eof()
+        return response
+
+    # --- yt-dlp ---
+    async def handle_ytdlp(self, request: web.Request) -> web.Response:
+        self.calls["ytdlp"] += 1
+        await self._sleep_ms(self.args.ytdlp_latency_ms)
+        if self._failed(self.args.ytdlp_fail_rate):
+            return web.json_response({"error": "ERROR: Unable to download JSON metadata"}, status=500)
+        entry = self.catalog.get(request.match_info["tweet_id"])
+        if not entry or entry["kind"] != "video":
+            return web.json_response({"error": "ERROR: [twitter] No video could be found in this tweet"}, status=404)
+        return web.json_response({"size": entry["size"]})
+
+    # --- Telegram Bot API ---
+    async def _read_params(self, request: web.Request) -> tuple[dict, int]:
+        """قراءة الحقول وعدّ بايتات الملفات المرفوعة بدون الاحتفاظ بها."""
+        params, uploaded = {}, 0
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    while chunk := await part.read_chunk(CHUNK):
+                        uploaded += len(chunk)
+                else:
+                    params[part.name] = await part.text()
+        else:
+            params = dict(await request.post())
+        return params, uploaded
+
+    async def _fetch_url(self, url: str) -> bool:
+        """تيليجرام يجلب الروابط بنفسه؛ نحاكي ذلك (ويفشل إن فشل الـ CDN)."""
+        if not url.startswith("http"):
+            return True
+        try:
+            async with self._session.get(url) as response:
+                if response.status != 200:
+                    return False
+                async for _ in response.content.iter_chunked(CHUNK):
+                    pass
+            return True
+        except Exception:
+            return False
+
+    def _message(self, params: dict, **content) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "supergroup", "title": "bench"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bench_bot"}, **content}
+
+    @staticmethod
+    def _reply_key(params: dict) -> Optional[str]:
+        reply_to = params.get("reply_to_message_id")
+        if not reply_to and params.get("reply_parameters"):
+            reply_to = json.loads(params["reply_parameters"]).get("message_id")
+        if not reply_to:
+            return None
+        return f"{params.get('chat_id')}:{reply_to}"
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body)
+
+    async def handle_bot_api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[f"tg.{method}"] += 1
+        params, uploaded = await self._read_params(request)
+        self.bytes_uploaded += uploaded
+        await self._sleep_ms(self.args.tg_latency_ms)
+        await self._throttle(uploaded, self.args.tg_upload_mbps)
+        if self._failed(self.args.tg_flood_rate):
+            return self._error(429, "Too Many Requests: retry after 1", retry_after=1)
+
+        if method in ("sendPhoto", "sendVideo", "sendAnimation", "sendDocument"):
+            field = method[4:].lower()
+            if not await self._fetch_url(params.get(field, "")):
+                return self._error(400, "Bad Request: failed to get HTTP URL content")
+            content = {
+                "photo": {"photo": [self._file(width=1280, height=720)]},
+                "video": {"video": self._file(width=1280, height=720, duration=30)},
+                "animation": {"animation": self._file(width=480, height=480, duration=5)},
+                "document": {"document": self._file()},
+            }[field]
+            result = self._message(params, **content)
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            for item in media:
+                if not await self._fetch_url(item.get("media", "")):
+                    return self._error(400, "Bad Request: failed to get HTTP URL content")
+            result = [self._message(params, photo=[self._file(width=1280, height=720)]) for _ in media]
+        elif method == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "editMessageCaption"):
+            result = self._message(params, text=params.get("text", ""))
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench_bot", "username": "bench_bot"}
+        else:
+            # deleteMessage, setMessageReaction, sendChatAction...
+            result = True
+
+        if method in MEDIA_METHODS:
+            key = self._reply_key(params)
+            if key and key not in self.first_media:
+                self.first_media[key] = time.time()
+        return web.json_response({"ok": True, "result": result})
+
+    # --- App ---
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/_catalog", self.handle_catalog)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_post("/_updates", self.handle_updates)
+        app.router.add_get("/i/status/{tweet_id}", self.handle_vxtwitter)
+        app.router.add_get("/media/{name}", self.handle_media)
+        app.router.add_get("/_ytdlp/{tweet_id}", self.handle_ytdlp)
+        app.router.add_post("/bot{token}/{method}", self.handle_bot_api)
+
+        async def session_ctx(_app):
+            self._session = ClientSession()
+            yield
+            await self._session.close()
+
+        app.cleanup_ctx.append(session_ctx)
+        return app
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """خيارات الخدمات الوهمية (مشتركة مع bench/loadtest.py)."""
+    group = parser.add_argument_group("fake upstreams")
+    group.add_argument("--tg-latency-ms", type=float, default=40)
+    group.add_argument("--tg-upload-mbps", type=float, default=200)
+    group.add_argument("--tg-flood-rate", type=float, default=0.0, help="نسبة ردود 429")
+    group.add_argument("--vx-latency-ms", type=float, default=150)
+    group.add_argument("--vx-fail-rate", type=float, default=0.0)
+    group.add_argument("--cdn-latency-ms", type=float, default=30)
+    group.add_argument("--cdn-mbps", type=float, default=400)
+    group.add_argument("--cdn-fail-rate", type=float, default=0.0)
+    group.add_argument("--ytdlp-latency-ms", type=float, default=1500)
+    group.add_argument("--ytdlp-fail-rate", type=float, default=0.0)
+
+def fake_arguments(args: argparse.Namespace) -> list:
+    """إعادة بناء خيارات الخدمات الوهمية لتمريرها لعملية فرعية."""
+    names = ("tg_latency_ms", "tg_upload_mbps", "tg_flood_rate", "vx_latency_ms", "vx_fail_rate",
+             "cdn_latency_ms", "cdn_mbps", "cdn_fail_rate", "ytdlp_latency_ms", "ytdlp_fail_rate")
+    return [item for name in names for item in (f"--{name.replace('_', '-')}", str(getattr(args, name)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram/vxtwitter/twimg/yt-dlp upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(FakeUpstreams(args).app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# bench/loadtest.py
+"""
+اختبار حمل شامل: تحديثات مصطنعة تمر عبر Dispatcher الحقيقي (نفس راوترات main.py)،
+وكل الخدمات الخارجية (Bot API، vxtwitter، twimg، yt-dlp) تحاكيها bench/fakes.py محليًا.
+MongoDB حقيقي (MONGO_DB، افتراضيًا mongodb://127.0.0.1:27017) بقاعدة مؤقتة xbot_bench_<scenario>.
+
+    python -m bench.loadtest                                  # كل السيناريوهات
+    python -m bench.loadtest --scenario viral_duplicates --scale 2 --vx-latency-ms 400
+
+كل سيناريو يعمل في عملية مستقلة (كاش نظيف وقياس ذاكرة مستقل)، والنتيجة:
+updates/s، و p50/p99 للزمن من وصول الرسالة حتى أول وسائط، وذروة RSS لعملية البوت.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from bench import fakes
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+
+# (التأخير منذ البداية بالثواني، chat_id، user_id، tweet_ids)
+Event = Tuple[float, int, int, List[str]]
+
+# --- Scenarios ---
+class Catalog:
+    """تغريدات السيناريو كما ستعيدها الخدمات الوهمية."""
+    def __init__(self, args: argparse.Namespace, rng: random.Random):
+        self.args = args
+        self.rng = rng
+        self.tweets: Dict[str, dict] = {}
+        self._ids = itertools.count(1_800_000_000_000_000_000)
+
+    def add(self, kind: str, count: int = 1, size: int = 0) -> str:
+        tweet_id = str(next(self._ids))
+        self.tweets[tweet_id] = {"kind": kind, "count": count, "size": size}
+        return tweet_id
+
+    def photo(self) -> str:
+        return self.add("photo", self.rng.randint(1, 4), self.args.photo_kb * 1024)
+
+    def video(self, low_mb: float, high_mb: float) -> str:
+        return self.add("video", 1, int(self.rng.uniform(low_mb, high_mb) * 1024 * 1024))
+
+    def mixed(self) -> str:
+        roll = self.rng.random()
+        if roll < 0.7:
+            return self.photo()
+        if roll < 0.9:
+            return self.video(*self.args.small_video_mb)
+        return self.add("text")
+
+def _group(index: int) -> int:
+    return -1_001_000_000_000 - index
+
+def bursty_groups(args: argparse.Namespace, catalog: Catalog, rng: random.Random) -> List[Event]:
+    """مجموعات ترسل دفعات متلاحقة من الرسائل (1-3 روابط لكل رسالة) في نفس الوقت تقريبًا."""
+    events = []
+    for chat in range(20 * args.scale):
+        burst_at = rng.uniform(0, 5)
+        for _ in range(8):
+            tweet_ids = [catalog.mixed() for _ in range(rng.randint(1, 3))]
+            events.append((burst_at + rng.uniform(0, 0.5), _group(chat), 10_000 + chat, tweet_ids))
+    return events
+
+def viral_duplicates(args: argparse.Namespace, catalog: Catalog, rng: random.Random) -> List[Event]:
+    """نفس التغريدات القليلة تصل من محادثات كثيرة في ثوانٍ (كاش البيانات/file_id ودمج الطلبات)."""
+    viral = [catalog.photo() for _ in range(3)] + [catalog.video(*args.small_video_mb) for _ in range(2)]
+    chats = 100 * args.scale
+    return [(rng.uniform(0, 4), _group(rng.randrange(chats)), 20_000 + i, [rng.choice(viral)])
+            for i in range(200 * args.scale)]
+
+def large_videos(args: argparse.Namespace, catalog: Catalog, rng: random.Random) -> List[Event]:
+    """فيديوهات كبيرة (فوق حد الجلب بالرابط) تمر عبر yt-dlp والرفع."""
+    return [(rng.uniform(0, 2), _group(chat), 30_000 + chat, [catalog.video(*args.large_video_mb)])
+            for chat in range(10 * args.scale) for _ in range(2)]
+
+def link_batches(args: argparse.Namespace, catalog: Catalog, rng: random.Random) -> List[Event]:
+    """
+    رسائل طويلة (8 روابط) في محادثات خاصة تخلط الفيديو الكبير بالصور
+    (التجهيز المسبق داخل الرسالة، MESSAGE_LOOKAHEAD؛ الخاص حتى لا يطغى حد المجموعات على النتيجة).
+    """
+    events = []
+    for user in range(40_000, 40_000 + args.scale):
+        tweet_ids = [catalog.video(*args.large_video_mb) if rng.random() < 0.5 else catalog.photo() for _ in range(8)]
+        events.append((rng.uniform(0, 1), user, user, tweet_ids))
+    return events
+
+def batch_fairness(args: argparse.Namespace, catalog: Catalog, rng: random.Random) -> List[Event]:
+    """
+    محادثات ترسل رسالة بثمانية فيديوهات (كلها تمر عبر yt-dlp) ومحادثات أخرى ترسل فيديو واحدًا بعدها بقليل:
+    ttfm للرسائل ذات الرابط الواحد يقيس هل يزاحم التجهيز المسبق للدفعات الروابط الحالية لغيرها.
+    """
+    events = []
+    for user in range(50_000, 50_000 + 2 * args.scale):
+        events.append((rng.uniform(0, 0.2), user, user, [catalog.video(*args.small_video_mb) for _ in range(8)]))
+    for user in range(51_000, 51_000 + 8 * args.scale):
+        events.append((rng.uniform(1, 4), user, user, [catalog.video(*args.small_video_mb)]))
+    return events
+
+SCENARIOS = {
+    "bursty_groups": bursty_groups,
+    "viral_duplicates": viral_duplicates,
+    "large_videos": large_videos,
+    "link_batches": link_batches,
+    "batch_fairness": batch_fairness,
+}
+
+# --- Helpers ---
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _mb_range(text: str) -> Tuple[float, float]:
+    low, high = (float(x) for x in text.split(","))
+    return low, high
+
+def _configure_env(args: argparse.Namespace, scenario: str, base_url: str, output_dir: str):
+    """إعداد البيئة قبل استيراد config: كل الخدمات الخارجية تشير إلى الخادم الوهمي."""
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCH",
+        "ADMIN_ID": "1",
+        "ID": "1",
+        "HASH": "bench",
+        "PYRO_SESSION_STRING": "bench",
+        "CHANNEL_IDtwiter": "-1001",
+        "MONGO_DB_NAME": f"xbot_bench_{scenario}",
+        "OUTPUT_DIR": output_dir,
+        "TELEGRAM_API_BASE": base_url,
+        "VXTWITTER_API_BASE": base_url,
+        "BENCH_FAKES_URL": base_url,
+        "YTDLP_MODE": "subprocess",
+        "YTDLP_BIN": f"{shlex.quote(sys.executable)} {shlex.quote(str(BENCH_DIR / 'fake_ytdlp.py'))}",
+        "METRICS_PORT": "0",
+    })
+    os.environ.setdefault("MONGO_DB", "mongodb://127.0.0.1:27017")
+
+async def _wait_for_fakes(base_url: str, process: subprocess.Popen):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            if process.poll() is not None:
+                raise RuntimeError("fake upstreams exited early")
+            try:
+                async with session.get(f"{base_url}/_stats"):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("fake upstreams did not start")
+
+def _update(update_id: int, chat_id: int, user_id: int, message_id: int, tweet_ids: List[str]) -> dict:
+    text, entities = "", []
+    for tweet_id in tweet_ids:
+        url = f"https://x.com/bench/status/{tweet_id}"
+        text += "شوف " if not text else " و "
+        entities.append({"type": "url", "offset": len(text), "length": len(url)})
+        text += url
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"group {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "text": text, "entities": entities,
+        },
+    }
+
+# --- Single scenario (child process) ---
+async def run_scenario(args: argparse.Namespace) -> dict:
+    scenario = args.run_one
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    fakes_process = subprocess.Popen(
+        [sys.executable, "-m", "bench.fakes", "--port", str(port), *fakes.fake_arguments(args)],
+        cwd=ROOT_DIR,
+    )
+    output_dir = tempfile.mkdtemp(prefix="xbot-bench-")
+    _configure_env(args, scenario, base_url, output_dir)
+    try:
+        await _wait_for_fakes(base_url, fakes_process)
+        return await _drive(args, scenario, base_url)
+    finally:
+        fakes_process.terminate()
+        fakes_process.wait()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+async def _drive(args: argparse.Namespace, scenario: str, base_url: str) -> dict:
+    # الاستيراد بعد _configure_env لأن config يقرأ البيئة عند الاستيراد
+    import config
+    import db
+    import main
+    import metrics
+    from aiogram.types import Update
+    from handlers import twitter
+
+    rng = random.Random(args.seed)
+    catalog = Catalog(args, rng)
+    events = sorted(SCENARIOS[scenario](args, catalog, rng), key=lambda event: event[0])
+
+    db.init_db()
+    await db.client.drop_database(config.MONGO_DB_NAME)
+    await db.ensure_indexes()
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/_catalog", json=catalog.tweets) as response:
+            response.raise_for_status()
+
+    bot = main.create_bot()
+    dp = main.create_dispatcher()
+    lag_monitor = asyncio.create_task(metrics.monitor_loop_lag(config.LOOP_LAG_INTERVAL or 0.25))
+    if config.QUEUE_BACKEND == "mongo":
+        twitter.scheduler.start(bot)
+    fed_at: Dict[str, float] = {}
+    single_link = set()
+    errors = 0
+    message_ids = itertools.count(1)
+
+    async def feed(update: dict):
+        nonlocal errors
+        message = update["message"]
+        key = f"{message['chat']['id']}:{message['message_id']}"
+        fed_at[key] = time.time()
+        if len(message.get("entities") or []) == 1:
+            single_link.add(key)
+        try:
+            await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+        except Exception:
+            errors += 1
+
+    start = time.monotonic()
+    feeders = []
+    for update_id, (delay, chat_id, user_id, tweet_ids) in enumerate(events, 1):
+        wait = start + delay - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        feeders.append(asyncio.create_task(feed(_update(update_id, chat_id, user_id, next(message_ids), tweet_ids))))
+    await asyncio.gather(*feeders)
+
+    # انتظار تفريغ الطابور (مهام حذف رسائل التقدم المؤجلة لا تُحتسب)
+    deadline = time.monotonic() + args.timeout
+    while (twitter.scheduler.pending or twitter.scheduler.active) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - start
+    timed_out = bool(twitter.scheduler.pending or twitter.scheduler.active)
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/_stats") as response:
+            stats = await response.json()
+
+    lag_monitor.cancel()
+    for task in list(twitter._background_tasks):
+        task.cancel()
+    await twitter.scheduler.stop()
+    await twitter._close_session()
+    await bot.session.close()
+    await db.client.drop_database(config.MONGO_DB_NAME)
+
+    ttfm = [stats["first_media"][key] - fed for key, fed in fed_at.items() if key in stats["first_media"]]
+    ttfm_single = [stats["first_media"][key] - fed_at[key] for key in single_link if key in stats["first_media"]]
+    _, lag_p99, lag_max = metrics.loop_lag_summary() or (None, None, None)
+    return {
+        "scenario": scenario,
+        "updates": len(events),
+        "tweets": sum(len(event[3]) for event in events),
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_s": round(len(events) / elapsed, 2),
+        "ttfm_p50_s": _percentile(ttfm, 0.5),
+        "ttfm_p99_s": _percentile(ttfm, 0.99),
+        # رسائل برابط واحد (في batch_fairness: المحادثات التي تصل خلف الدفعات)
+        "ttfm_single_p50_s": _percentile(ttfm_single, 0.5),
+        "ttfm_single_p99_s": _percentile(ttfm_single, 0.99),
+        "without_media": len(fed_at) - len(ttfm),
+        "handler_errors": errors,
+        # تصنيف المهام قبل الجدولة (الخفيفة تتقدم على الفيديو في FairScheduler)
+        "light_jobs": int(metrics.counter_value("jobs_submitted_total", kind="light")),
+        "heavy_jobs": int(metrics.counter_value("jobs_submitted_total", kind="heavy")),
+        "timed_out": timed_out,
+        # ru_maxrss بالكيلوبايت على لينكس
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "loop_lag_p99_ms": round(lag_p99 * 1000, 1) if lag_p99 is not None else None,
+        "loop_lag_max_ms": round(lag_max * 1000, 1) if lag_max is not None else None,
+        "upstream_calls": stats["calls"],
+        "stages": {stage: {"count": count, "p50": p50, "p95": p95, "mean": round(mean, 3)}
+                   for stage, count, p50, p95, mean in metrics.stage_summary()},
+    }
+
+# --- Orchestration (parent process) ---
+def _child_arguments(args: argparse.Namespace, scenario: str) -> list:
+    return [
+        sys.executable, "-m", "bench.loadtest", "--run-one", scenario,
+        "--scale", str(args.scale), "--seed", str(args.seed), "--timeout", str(args.timeout),
+        "--photo-kb", str(args.photo_kb),
+        "--small-video-mb", ",".join(map(str, args.small_video_mb)),
+        "--large-video-mb", ",".join(map(str, args.large_video_mb)),
+        *fakes.fake_arguments(args),
+    ]
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+def _format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}ms"
+
+def _print_report(results: List[dict]):
+    header = (f"{'scenario':<30}{'updates':>8}{'upd/s':>8}{'ttfm p50':>10}{'ttfm p99':>10}{'1-link p99':>12}{'no media':>10}"
+              f"{'peak RSS':>11}{'lag p99':>10}{'elapsed':>9}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        flag = " (timeout)" if r["timed_out"] else ""
+        print(f"{r['scenario']:<30}{r['updates']:>8}{r['updates_per_s']:>8}"
+              f"{_format_seconds(r['ttfm_p50_s']):>10}{_format_seconds(r['ttfm_p99_s']):>10}"
+              f"{_format_seconds(r['ttfm_single_p99_s']):>12}{r['without_media']:>10}{r['peak_rss_mb']:>9}MB{_format_ms(r['loop_lag_p99_ms']):>10}{r['elapsed_s']:>8}s{flag}")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end load test against local fake upstreams")
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "all"], default="all")
+    parser.add_argument("--scale", type=int, default=1, help="مضاعف عدد المحادثات والرسائل")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=600, help="أقصى انتظار لتفريغ الطابور")
+    parser.add_argument("--photo-kb", type=int, default=250)
+    parser.add_argument("--small-video-mb", type=_mb_range, default=(2.0, 8.0), help="min,max")
+    parser.add_argument("--large-video-mb", type=_mb_range, default=(25.0, 45.0), help="min,max")
+    parser.add_argument("--json", action="store_true", help="طباعة النتائج كـ JSON")
+    parser.add_argument("--compare-lookahead", action="store_true",
+                        help="تشغيل كل سيناريو مرة ثانية مع MESSAGE_LOOKAHEAD=0 للمقارنة")
+    parser.add_argument("--run-one", choices=SCENARIOS, help=argparse.SUPPRESS)
+    fakes.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.run_one:
+        result = asyncio.run(run_scenario(args))
+        # السطر الأخير من المخرجات هو النتيجة (سجلات البوت قبله)
+        print(json.dumps(result), flush=True)
+        return
+
+    results = []
+    lookaheads = [None, "0"] if args.compare_lookahead else [None]
+    for scenario in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+        for lookahead in lookaheads:
+            env = {**os.environ, "MESSAGE_LOOKAHEAD": lookahead} if lookahead is not None else None
+            completed = subprocess.run(_child_arguments(args, scenario), cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True, env=env)
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                print(f"{scenario}: failed (exit {completed.returncode})", file=sys.stderr)
+                continue
+            result = json.loads(lines[-1])
+            if lookahead is not None:
+                result["scenario"] += f" (lookahead={lookahead})"
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        _print_report(results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# bench/sendlimits.py
+"""
+فحص سلوك ratelimit.SendScheduler / SendRateLimiter تحت الضغط بدون شبكة (make_request وهمي):
+- stale_under_saturation: الحد العام ممتلئ بوسائط جاهزة من محادثات كثيرة؛ تعديل التقدم يجب أن يُسقط
+  بعد edit_max_wait تقريبًا لا بعد تفريغ الطابور.
+- plain_edit_not_dropped: EditMessageText خارج progress_edit (تعديل يراه المستخدم) يُرسل دائمًا ويعيد النتيجة.
+- final_supersedes_progress: التعديل النهائي يلغي تعديل التقدم المنتظر لنفس الرسالة.
+
+    python -m bench.sendlimits
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from aiogram.methods import EditMessageText, SendPhoto
+
+from ratelimit import EDIT_DROPPED, SendRateLimiter, SendScheduler, progress_edit
+
+async def _fake_request(bot, method):
+    return f"sent:{type(method).__name__}"
+
+async def stale_under_saturation(args: argparse.Namespace) -> dict:
+    scheduler = SendScheduler(args.global_rate, 20, 1, 3, args.edit_max_wait)
+    limiter = SendRateLimiter(scheduler)
+    media = [asyncio.create_task(limiter(_fake_request, None, SendPhoto(chat_id=chat_id, photo="x")))
+             for chat_id in range(1, args.chats + 1)]
+    await asyncio.sleep(0)
+    start = time.monotonic()
+    with progress_edit():
+        result = await limiter(_fake_request, None, EditMessageText(chat_id=args.chats + 1, message_id=1, text="p"))
+    waited = time.monotonic() - start
+    for task in media:
+        task.cancel()
+    await asyncio.gather(*media, return_exceptions=True)
+    return {"ok": result is EDIT_DROPPED and waited < args.edit_max_wait + 0.25, "waited": round(waited, 3)}
+
+async def plain_edit_not_dropped(args: argparse.Namespace) -> dict:
+    scheduler = SendScheduler(args.global_rate, 20, 1, 1, args.edit_max_wait)
+    limiter = SendRateLimiter(scheduler)
+    # burst 1: التوكن الأول يذهب للوسائط، والتعديل ينتظر التوكن التالي (> edit_max_wait)
+    await limiter(_fake_request, None, SendPhoto(chat_id=1, photo="x"))
+    start = time.monotonic()
+    result = await limiter(_fake_request, None, EditMessageText(chat_id=1, message_id=1, text="t"))
+    return {"ok": result == "sent:EditMessageText", "waited": round(time.monotonic() - start, 3)}
+
+async def final_supersedes_progress(args: argparse.Namespace) -> dict:
+    scheduler = SendScheduler(args.global_rate, 20, 1, 1, 5)
+    limiter = SendRateLimiter(scheduler)
+    await limiter(_fake_request, None, SendPhoto(chat_id=1, photo="x"))
+    with progress_edit():
+        pending = asyncio.create_task(limiter(_fake_request, None, EditMessageText(chat_id=1, message_id=1, text="p")))
+    await asyncio.sleep(0.05)
+    final = await limiter(_fake_request, None, EditMessageText(chat_id=1, message_id=1, text="done"))
+    return {"ok": await pending is EDIT_DROPPED and final == "sent:EditMessageText"}
+
+CHECKS = {
+    "stale_under_saturation": stale_under_saturation,
+    "plain_edit_not_dropped": plain_edit_not_dropped,
+    "final_supersedes_progress": final_supersedes_progress,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Send scheduler checks (progress edits under load)")
+    parser.add_argument("--global-rate", type=float, default=5)
+    parser.add_argument("--chats", type=int, default=60, help="محادثات خاصة لكل منها وسائط جاهزة")
+    parser.add_argument("--edit-max-wait", type=float, default=0.5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {name: asyncio.run(check(args)) for name, check in CHECKS.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            details = "  ".join(f"{k} {v}" for k, v in result.items() if k != "ok")
+            print(f"{name:<28}{'ok' if result['ok'] else 'FAIL':>6}  {details}")
+    sys.exit(0 if all(result["ok"] for result in results.values()) else 1)
+
+if __name__ == "__main__":
+    main()
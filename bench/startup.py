@@ -0,0 +1,109 @@
+# bench/startup.py
+"""
+قياس زمن بدء التشغيل: يُشغَّل main.py الحقيقي (polling) مقابل bench/fakes.py، ويُقرأ من سجلاته:
+- imports: انتهاء استيراد الوحدات (بداية main)
+- ready: بدء استقبال التحديثات (start_polling)
+- first_update: اكتمال معالجة أول تحديث (/start ينتظر في getUpdates قبل الإطلاق)
+كل الأزمنة منذ إطلاق العملية. MongoDB حقيقي كما في bench/loadtest.py.
+
+    python -m bench.startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench import fakes
+from bench.loadtest import ROOT_DIR, _configure_env, _free_port, _wait_for_fakes
+
+STAGES = ("imports", "ready", "first_update")
+_STARTUP_RE = re.compile(r"Startup: (\w+) after ([\d.]+)s")
+
+def _start_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": 10_000 + update_id, "type": "private", "first_name": "bench"},
+            "from": {"id": 10_000 + update_id, "is_bot": False, "first_name": "bench"},
+            "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+def _run_once(env: dict, timeout: float) -> dict:
+    """تشغيل البوت حتى first_update ثم إيقافه بـ SIGTERM؛ يعيد {stage: seconds}."""
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    timings, deadline = {}, time.monotonic() + timeout
+    try:
+        for line in process.stdout:
+            match = _STARTUP_RE.search(line)
+            if match:
+                timings[match.group(1)] = float(match.group(2))
+            if "first_update" in timings or time.monotonic() > deadline:
+                break
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return timings
+
+async def _enqueue(base_url: str, update: dict):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base_url}/_updates", json=[update]) as response:
+            response.raise_for_status()
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time from process launch to polling and first update")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120, help="أقصى انتظار لكل تشغيل")
+    parser.add_argument("--json", action="store_true")
+    fakes.add_arguments(parser)
+    args = parser.parse_args()
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    fakes_process = subprocess.Popen([sys.executable, "-m", "bench.fakes", "--port", str(port), *fakes.fake_arguments(args)],
+                                     cwd=ROOT_DIR)
+    output_dir = tempfile.mkdtemp(prefix="xbot-startup-")
+    _configure_env(args, "startup", base_url, output_dir)
+    env = {**os.environ, "BOT_MODE": "polling", "DROP_PENDING_UPDATES": "false"}
+    runs = []
+    try:
+        asyncio.run(_wait_for_fakes(base_url, fakes_process))
+        for run in range(1, args.runs + 1):
+            asyncio.run(_enqueue(base_url, _start_update(run)))
+            timings = _run_once(env, args.timeout)
+            runs.append(timings)
+            if not args.json:
+                print(f"run {run}: " + "  ".join(f"{stage} {timings[stage]:.2f}s" if stage in timings else f"{stage} -"
+                                                   for stage in STAGES), flush=True)
+    finally:
+        fakes_process.terminate()
+        fakes_process.wait()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    summary = {stage: {"median": statistics.median(values), "min": min(values)}
+               for stage in STAGES if (values := [r[stage] for r in runs if stage in r])}
+    if args.json:
+        print(json.dumps({"runs": runs, "summary": summary}, indent=2))
+        return
+    print(f"{'stage':<14}{'median':>9}{'min':>9}")
+    for stage, values in summary.items():
+        print(f"{stage:<14}{values['median']:>8.2f}s{values['min']:>8.2f}s")
+
+if __name__ == "__main__":
+    main()
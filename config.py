@@ -9,27 +9,184 @@ load_dotenv(dotenv_path=env_path)
 # --- Bot & Admin ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID_STR = os.getenv("ADMIN_ID")
-if not BOT_TOKEN or not ADMIN_ID_STR:
-    raise ValueError("BOT_TOKEN and ADMIN_ID environment variables are required!")
-ADMIN_ID = int(ADMIN_ID_STR)
+ADMIN_ID = int(ADMIN_ID_STR) if ADMIN_ID_STR else None
 
 # --- Pyrogram ---
 API_ID = os.getenv("ID")
 API_HASH = os.getenv("HASH")
 PYRO_SESSION_STRING = os.getenv("PYRO_SESSION_STRING")
 CHANNEL_ID_STR = os.getenv("CHANNEL_IDtwiter")
-if not all([API_ID, API_HASH, PYRO_SESSION_STRING, CHANNEL_ID_STR]):
-    raise ValueError("Pyrogram configuration is incomplete!")
-CHANNEL_ID = int(CHANNEL_ID_STR)
+CHANNEL_ID = int(CHANNEL_ID_STR) if CHANNEL_ID_STR else None
 
 # --- Database ---
 MONGO_DB_URL = os.getenv("MONGO_DB")
-if not MONGO_DB_URL:
-    raise ValueError("MONGO_DB environment variable is required!")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "xDownloaderBot")
+
+# --- Upstream endpoints (قابلة للتغيير لخادم Bot API محلي أو لبدائل وهمية في bench/) ---
+# فارغ = https://api.telegram.org
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "")
+VXTWITTER_API_BASE = os.getenv("VXTWITTER_API_BASE", "https://api.vxtwitter.com").rstrip("/")
+# أمر yt-dlp في وضع subprocess (يقبل أمرًا مع وسائط، مثل "python bench/fake_ytdlp.py")
+YTDLP_BIN = os.getenv("YTDLP_BIN", "yt-dlp")
 
 # --- Bot Paths & Constants ---
+# يُنشأ في main.startup (لا عند الاستيراد)
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "/content/downloads"))
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 X_COOKIES_PATH = os.getenv("X_COOKIES")
 X_COOKIES = Path(X_COOKIES_PATH) if X_COOKIES_PATH and Path(X_COOKIES_PATH).is_file() else None
 MAX_FILE_SIZE = 50 * 1024 * 1024
+
+# --- Media cache (Telegram file_id per tweet) ---
+MEDIA_CACHE_TTL = int(os.getenv("MEDIA_CACHE_TTL", 7 * 24 * 3600))
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", 2048))
+
+# --- Large uploads (Pyrogram) ---
+PYRO_MAX_CONCURRENT_UPLOADS = int(os.getenv("PYRO_MAX_CONCURRENT_UPLOADS", 2))
+
+# --- Scheduling & concurrency ---
+WORKERS = int(os.getenv("WORKERS", 16))
+# أقصى انتظار لبيانات vxtwitter قبل جدولة المهمة (خفيفة: صور/نص فقط، أو ثقيلة)؛ 0 يكتفي بالكاش
+CLASSIFY_TIMEOUT = float(os.getenv("CLASSIFY_TIMEOUT", 1.5))
+YTDLP_CONCURRENCY = int(os.getenv("YTDLP_CONCURRENCY", 2))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 4))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+# تغريدات الرسالة التالية التي تُجهز مسبقًا (بيانات + yt-dlp) أثناء رفع الحالية؛ 0 يعطل
+MESSAGE_LOOKAHEAD = int(os.getenv("MESSAGE_LOOKAHEAD", 2))
+# مقاعد yt-dlp المتاحة للتجهيز المسبق (تُستخدم فقط إن كان هناك مقعد خامل، ويبقى مقعد واحد على الأقل للعمل الفعلي)
+PREFETCH_YTDLP_SLOTS = int(os.getenv("PREFETCH_YTDLP_SLOTS", 1))
+
+# --- HTTP (twimg / vxtwitter) ---
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+# لكل مضيف (video.twimg.com، pbs.twimg.com...): يكفي DOWNLOAD_CONCURRENCY × DOWNLOAD_CONNECTIONS مع هامش للـ relay
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", 32))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 30))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+# الملفات الأكبر من جزء واحد تُنزل بعدة طلبات Range متوازية إن دعمها الخادم؛ 1 يعطل
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", 4))
+DOWNLOAD_PART_SIZE = int(os.getenv("DOWNLOAD_PART_SIZE", 8 * 1024 * 1024))
+
+# --- Disk I/O ---
+# خيوط مخصصة لعمليات القرص (mkdir/stat/كتابة/حذف) خارج حلقة الأحداث
+IO_THREADS = int(os.getenv("IO_THREADS", 4))
+# حجم دفعة الكتابة: القطع من الشبكة تُجمع في الذاكرة حتى هذا الحد
+IO_WRITE_BUFFER = int(os.getenv("IO_WRITE_BUFFER", 1024 * 1024))
+
+# --- yt-dlp ---
+# inprocess: واجهة yt_dlp داخل مجموعة خيوط دافئة؛ subprocess: أمر yt-dlp لكل رابط (السلوك القديم)
+YTDLP_MODE = os.getenv("YTDLP_MODE", "inprocess").lower()
+# fit: أفضل نسخة تناسب حد الإرسال المباشر؛ best: أفضل جودة دائمًا
+FORMAT_MODE = os.getenv("FORMAT_MODE", "fit").lower()
+# هامش أمان لأن الأحجام تقديرية (bitrate × المدة)
+DIRECT_SEND_BUDGET = int(MAX_FILE_SIZE * float(os.getenv("DIRECT_SEND_BUDGET_RATIO", 0.95)))
+
+# --- Relay (twimg -> Telegram بدون قرص) ---
+RELAY_MODE = os.getenv("RELAY_MODE", "true").lower() in ("1", "true", "yes")
+# العناصر حتى هذا الحجم تُخزن في الذاكرة (BufferedInputFile)، والأكبر تُمرر كبث
+RELAY_BUFFER_MAX = int(os.getenv("RELAY_BUFFER_MAX", 10 * 1024 * 1024))
+
+# --- URL pass-through (تيليجرام يجلب الوسائط من twimg بنفسه) ---
+URL_PASSTHROUGH = os.getenv("URL_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+# حد تيليجرام لجلب الملفات غير الصور عبر رابط HTTP
+URL_VIDEO_MAX = int(os.getenv("URL_VIDEO_MAX", 20 * 1024 * 1024))
+
+# --- Tweet metadata cache (vxtwitter) ---
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", 4096))
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 600))
+METADATA_NEGATIVE_TTL = int(os.getenv("METADATA_NEGATIVE_TTL", 60))
+# مدة تذكر أن تغريدة بلا فيديو (نتيجة yt-dlp سلبية)
+NO_VIDEO_CACHE_TTL = int(os.getenv("NO_VIDEO_CACHE_TTL", 3600))
+
+# --- Link extraction ---
+TCO_CACHE_SIZE = int(os.getenv("TCO_CACHE_SIZE", 10000))
+
+# --- User settings cache ---
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", 10000))
+SETTINGS_CACHE_TTL = int(os.getenv("SETTINGS_CACHE_TTL", 300))
+
+# --- Per-chat state (داخل العملية) ---
+# المحادثات الخاملة تُزاح بعد CHAT_STATE_TTL ثانية، أو الأقدم عند تجاوز CHAT_STATE_MAX
+CHAT_STATE_MAX = int(os.getenv("CHAT_STATE_MAX", 10000))
+CHAT_STATE_TTL = int(os.getenv("CHAT_STATE_TTL", 3600))
+# إبطال الكاش عبر change stream (يتطلب replica set) عند تشغيل أكثر من نسخة
+SETTINGS_CHANGE_STREAM = os.getenv("SETTINGS_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+
+# --- Metrics (Prometheus) ---
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 لتعطيل نقطة /metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9102))
+# فترة قياس تأخر حلقة الأحداث (event loop lag)؛ 0 يعطل
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.25))
+
+# --- Update delivery (polling / webhook) ---
+# polling: getUpdates (الافتراضي)؛ webhook: خادم aiohttp يستقبل التحديثات من تيليجرام؛
+# worker: عقدة تعالج طابور Mongo فقط (QUEUE_BACKEND=mongo) بدون استقبال تحديثات
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # العنوان العام مثل https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# أقصى اتصالات متزامنة يفتحها تيليجرام نحو الـ webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# أقصى عدد تحديثات تُعالج في نفس الوقت داخل البوت
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 64))
+# في webhook يحتفظ تيليجرام بالتحديثات أثناء إعادة التشغيل، فلا نحذفها افتراضيًا
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "true" if BOT_MODE == "polling" else "false").lower() in ("1", "true", "yes")
+# مهلة إنهاء العمل الجاري عند الإيقاف (ثوانٍ)
+SHUTDOWN_GRACE = float(os.getenv("SHUTDOWN_GRACE", 30))
+
+# --- Job queue ---
+# memory: طابور داخل العملية (FairScheduler)؛ mongo: طابور مشترك في MongoDB لعدة عمليات/خوادم
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "memory").lower()
+# مدة حجز المهمة؛ تُجدد بنبضات كل ثلث المدة، وتعود للطابور إن توقف العامل
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 60))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_CLAIM_BATCH = int(os.getenv("JOB_CLAIM_BATCH", 50))
+
+# --- Inline mode (@bot <رابط>) ---
+# مهلة بناء النتائج (تيليجرام يُسقط الاستعلام إن تأخر الرد)
+INLINE_TIMEOUT = float(os.getenv("INLINE_TIMEOUT", 6))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", 2048))
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", 300))
+# أقصى عدد تغريدات تُعرض من استعلام واحد
+INLINE_MAX_TWEETS = int(os.getenv("INLINE_MAX_TWEETS", 5))
+
+# --- Write-behind & usage analytics ---
+# كتابات المستخدمين وأحداث الاستخدام تُجمع وتُرسل bulk_write عند بلوغ هذا العدد أو كل INTERVAL ثانية
+WRITE_BEHIND_MAX_OPS = int(os.getenv("WRITE_BEHIND_MAX_OPS", 500))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", 2.0))
+# مدة الاحتفاظ بأحداث الاستخدام الخام (العدادات المجمعة لا تنتهي)
+USAGE_EVENTS_TTL_DAYS = int(os.getenv("USAGE_EVENTS_TTL_DAYS", 90))
+
+# --- Telegram send rate (كل الإرسالات عبر مجدول واحد) ---
+# حدود تيليجرام: ~30 رسالة/ثانية للبوت، ~20 رسالة/دقيقة لكل مجموعة، ~1/ثانية لكل محادثة خاصة
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", 20))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+# تعديل التقدم الذي لا يجد دورًا خلال هذه المدة يُسقط (لا يؤخر الوسائط)
+SEND_EDIT_MAX_WAIT = float(os.getenv("SEND_EDIT_MAX_WAIT", 1.0))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# --- Video preparation (ffmpeg/ffprobe بعد التنزيل) ---
+# faststart بدون إعادة ترميز + الأبعاد والمدة وصورة مصغرة، لتشغيل الفيديو قبل اكتمال تنزيله عند المستخدم
+VIDEO_PREP = os.getenv("VIDEO_PREP", "true").lower() in ("1", "true", "yes")
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", 2))
+VIDEO_PREP_TIMEOUT = float(os.getenv("VIDEO_PREP_TIMEOUT", 60))
+
+def validate():
+    """التحقق من الإعدادات المطلوبة؛ يُستدعى عند تشغيل البوت (الاستيراد وحده لا يفشل، مثلًا في bench/)."""
+    if not BOT_TOKEN or not ADMIN_ID_STR:
+        raise ValueError("BOT_TOKEN and ADMIN_ID environment variables are required!")
+    if not all([API_ID, API_HASH, PYRO_SESSION_STRING, CHANNEL_ID_STR]):
+        raise ValueError("Pyrogram configuration is incomplete!")
+    if not MONGO_DB_URL:
+        raise ValueError("MONGO_DB environment variable is required!")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL is required when BOT_MODE=webhook!")
+    if BOT_MODE == "worker" and QUEUE_BACKEND != "mongo":
+        raise ValueError("BOT_MODE=worker requires QUEUE_BACKEND=mongo!")
+
@@ -1,56 +1,338 @@
 8# db.py
-import motor.motor_asyncio
-from datetime import datetime
-from typing import Dict, Any
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Dict, Any, List, Optional
 import config
+from utils import TTLCache, track_state
+
+logger = logging.getLogger(__name__)
 
 # --- Database Setup ---
-client = motor.motor_asyncio.AsyncIOMotorClient(config.MONGO_DB_URL)
-db = client.xDownloaderBot
-users_collection = db.users
+# عميل Motor يُنشأ في init_db (من main.startup داخل حلقة الأحداث) لا عند الاستيراد
+client = None
+db = None
+
+def init_db():
+    """إنشاء عميل MongoDB (آمن للاستدعاء المتكرر)."""
+    global client, db
+    if client is None:
+        import motor.motor_asyncio
+        client = motor.motor_asyncio.AsyncIOMotorClient(config.MONGO_DB_URL)
+        db = client[config.MONGO_DB_NAME]
+    return db
+
+class _Collection:
+    """وكيل لمجموعة MongoDB: يُستورد في الوحدات الأخرى كاسم ثابت، ويُحل للعميل عند أول استخدام."""
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(init_db()[self._name], attr)
+
+users_collection = _Collection("users")
+media_cache_collection = _Collection("media_cache")
+# طابور المهام المشترك بين العمليات (QUEUE_BACKEND=mongo) وأقفال المحادثات
+jobs_collection = _Collection("jobs")
+job_locks_collection = _Collection("job_locks")
+# أحداث الاستخدام (حدث لكل تغريدة) وعدادات مجمعة مسبقًا: {_id: "global"} و {_id: "day:YYYY-MM-DD"}
+usage_events_collection = _Collection("usage_events")
+stats_collection = _Collection("stats")
+
+# كاش داخل العملية أمام مجموعة media_cache
+_media_cache = TTLCache(config.MEDIA_CACHE_SIZE, config.MEDIA_CACHE_TTL)
+track_state("media_cache", lambda: _media_cache)
+
+def close_db():
+    """إغلاق اتصال MongoDB عند إيقاف البوت."""
+    global client, db
+    if client is not None:
+        client.close()
+        client = db = None
+
+async def ensure_indexes():
+    """إنشاء الفهارس المطلوبة (TTL لكاش الوسائط، وطابور المهام عند تفعيله)."""
+    await media_cache_collection.create_index("expire_at", expireAfterSeconds=0)
+    if config.QUEUE_BACKEND == "mongo":
+        # اختيار المهام القابلة للحجز، ثم أقدم مهمة في المحادثة
+        await jobs_collection.create_index([("status", 1), ("light", -1), ("_id", 1)])
+        await jobs_collection.create_index([("chat_id", 1), ("_id", 1)])
+        # المهام الفاشلة تبقى للفحص ثم تُحذف تلقائيًا
+        await jobs_collection.create_index("expire_at", expireAfterSeconds=0)
+    # أحداث الاستخدام: تحليلات لكل مستخدم، وتُحذف تلقائيًا بعد USAGE_EVENTS_TTL_DAYS
+    await usage_events_collection.create_index([("user_id", 1), ("ts", -1)])
+    await usage_events_collection.create_index("ts", expireAfterSeconds=config.USAGE_EVENTS_TTL_DAYS * 86400)
+    await _seed_users_total()
+
+async def _seed_users_total():
+    """عدّ المستخدمين مرة واحدة فقط عند أول تشغيل بعد إضافة العدادات؛ بعدها يُحدَّث العداد مع كل upsert."""
+    if await stats_collection.find_one({"_id": "global", "users_total": {"$exists": True}}, {"_id": 1}):
+        return
+    count = await users_collection.count_documents({})
+    try:
+        await stats_collection.update_one(
+            {"_id": "global", "users_total": {"$exists": False}},
+            {"$inc": {"users_total": count}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # عملية أخرى سبقتنا للتهيئة
+        pass
+
+# --- Write-behind buffer ---
+class WriteBehind:
+    """
+    تجميع الكتابات غير الحرجة في الذاكرة وإرسالها دفعات عبر bulk_write:
+    - upsert المستخدمين (آخر بيانات لكل مستخدم فقط، فتكرار /start لا يضاعف الكتابات).
+    - أحداث الاستخدام (usage_events).
+    - زيادات العدادات المجمعة ($inc واحد لكل مستند عداد في كل دفعة).
+    الإرسال عند بلوغ max_ops عملية أو كل interval ثانية، وعند الإيقاف.
+    """
+    def __init__(self, max_ops: int, interval: float):
+        self.max_ops = max_ops
+        self.interval = interval
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._events: List[Dict[str, Any]] = []
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._users) + len(self._events) + len(self._counters)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """إيقاف المؤقت مع إرسال ما تبقى في الذاكرة."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("Final write-behind flush failed: %s", e)
+
+    def add_user(self, user_id: int, fields: Dict[str, Any]):
+        self._users[user_id] = fields
+        self._maybe_flush()
+
+    def has_pending_user(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def add_event(self, event: Dict[str, Any]):
+        self._events.append(event)
+        self._maybe_flush()
+
+    def incr(self, **fields: int):
+        """زيادة العدادات الكلية وعدادات اليوم."""
+        day = f"day:{datetime.utcnow():%Y-%m-%d}"
+        for name, value in fields.items():
+            if value:
+                self._counters["global"][name] += value
+                self._counters[day][name] += value
+
+    def _maybe_flush(self):
+        if len(self) >= self.max_ops and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            users, self._users = self._users, {}
+            events, self._events = self._events, []
+            if users:
+                await self._flush_users(users)
+            if events:
+                try:
+                    await usage_events_collection.bulk_write([InsertOne(e) for e in events], ordered=False)
+                except Exception as e:
+                    # التحليلات ليست حرجة: نعيدها مرة واحدة إن كان هناك متسع، وإلا تُهمل
+                    logger.warning("Flushing %d usage events failed: %s", len(events), e)
+                    if len(self._events) + len(events) <= self.max_ops * 10:
+                        self._events[:0] = events
+            counters, self._counters = self._counters, defaultdict(lambda: defaultdict(int))
+            if counters:
+                ops = [UpdateOne({"_id": doc_id}, {"$inc": dict(fields)}, upsert=True)
+                       for doc_id, fields in counters.items()]
+                try:
+                    await stats_collection.bulk_write(ops, ordered=False)
+                except Exception as e:
+                    # زيادات $inc لا تُعاد بأمان بعد فشل جزئي: نسجلها ونكمل
+                    logger.warning("Flushing stats counters failed: %s", e)
+
+    async def _flush_users(self, users: Dict[int, Dict[str, Any]]):
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne(
+                {"_id": user_id},
+                {"$set": fields, "$setOnInsert": {"join_date": now, "settings": dict(DEFAULT_SETTINGS)}},
+                upsert=True
+            )
+            for user_id, fields in users.items()
+        ]
+        try:
+            result = await users_collection.bulk_write(ops, ordered=False)
+            inserted = result.upserted_count
+        except BulkWriteError as e:
+            inserted = e.details.get("nUpserted", 0)
+            logger.warning("Flushing %d user upserts partially failed: %s", len(users), e.details.get("writeErrors"))
+            self._requeue_users(users)
+        except Exception as e:
+            logger.warning("Flushing %d user upserts failed: %s", len(users), e)
+            self._requeue_users(users)
+            return
+        # مستخدمون جدد فعلًا (وليس تحديث بيانات): تحديث العداد بدل count_documents
+        if inserted:
+            self._counters["global"]["users_total"] += inserted
+            self.incr(new_users=inserted)
+
+    def _requeue_users(self, users: Dict[int, Dict[str, Any]]):
+        # upsert بـ $set آمن للإعادة؛ البيانات الأحدث التي وصلت أثناء الإرسال لها الأولوية
+        for user_id, fields in users.items():
+            self._users.setdefault(user_id, fields)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Write-behind flush failed: %s", e)
+
+write_behind = WriteBehind(config.WRITE_BEHIND_MAX_OPS, config.WRITE_BEHIND_INTERVAL)
 
 # --- User Management ---
+DEFAULT_SETTINGS = {"send_text": True, "delete_original": False}
+
+# كاش إعدادات المستخدمين (write-through)؛ الـ TTL يحد من القِدم عند تشغيل أكثر من عملية
+_settings_cache = TTLCache(config.SETTINGS_CACHE_SIZE, config.SETTINGS_CACHE_TTL)
+track_state("settings_cache", lambda: _settings_cache)
+
 async def add_user(user_id: int, first_name: str, username: str | None):
-    """إضافة مستخدم جديد أو تحديث بياناته مع إعدادات افتراضية"""
-    default_settings = {
-        "send_text": True,
-        "delete_original": False
-    }
-    user_doc = {
+    """إضافة مستخدم جديد أو تحديث بياناته مع إعدادات افتراضية (يُكتب دفعة واحدة عبر write_behind)"""
+    write_behind.add_user(user_id, {
         "first_name": first_name,
         "username": username,
-    }
-    await users_collection.update_one(
-        {"_id": user_id},
-        {
-            "$set": user_doc,
-            "$setOnInsert": {
-                "join_date": datetime.utcnow(),
-                "settings": default_settings
-            }
-        },
-        upsert=True
-    )
+    })
 
 async def get_users_count() -> int:
-    return await users_collection.count_documents({})
+    """عدد المستخدمين من العداد المجمع (O(1))؛ قد يتأخر حتى WRITE_BEHIND_INTERVAL."""
+    doc = await stats_collection.find_one({"_id": "global"}, {"users_total": 1})
+    return int((doc or {}).get("users_total", 0))
+
+# --- Usage Analytics ---
+def record_usage(user_id: Optional[int], chat_id: int, tweet_id: str, paths: List[str], items: int, nbytes: int):
+    """تسجيل حدث استخدام لتغريدة واحدة مع تحديث العدادات المجمعة (بدون انتظار MongoDB)."""
+    write_behind.add_event({
+        "ts": datetime.utcnow(),
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "tweet_id": tweet_id,
+        "paths": paths,
+        "items": items,
+        "bytes": nbytes,
+    })
+    cache_hit = "file_id" in paths
+    write_behind.incr(
+        tweets_requested=1,
+        tweets_served=int(items > 0),
+        media_items=items,
+        bytes_moved=nbytes,
+        cache_hits=int(cache_hit),
+        cache_misses=int(not cache_hit),
+    )
+
+async def get_usage_stats() -> Dict[str, Dict[str, Any]]:
+    """العدادات الكلية وعدادات اليوم (قراءتان بالمفتاح، مستقلتان عن حجم البيانات)."""
+    day = f"day:{datetime.utcnow():%Y-%m-%d}"
+    docs = {doc["_id"]: doc async for doc in stats_collection.find({"_id": {"$in": ["global", day]}})}
+    return {"total": docs.get("global", {}), "today": docs.get(day, {})}
 
 # --- Settings Management ---
 async def get_user_settings(user_id: int) -> Dict[str, Any]:
-    """الحصول على إعدادات المستخدم. إذا لم توجد، يتم إرجاع الإعدادات الافتراضية."""
-    user = await users_collection.find_one({"_id": user_id})
-    # Handle both new users (with settings) and legacy users (without)
-    if user and "settings" in user:
-        # Ensure all default keys exist
-        defaults = {"send_text": True, "delete_original": False}
-        user['settings'].update({k: v for k, v in defaults.items() if k not in user['settings']})
-        return user["settings"]
-    
-    return {"send_text": True, "delete_original": False}
-
-async def update_user_setting(user_id: int, setting: str, value: bool):
-    """تحديث إعداد محدد للمستخدم"""
-    await users_collection.update_one(
+    """الحصول على إعدادات المستخدم (من الكاش أولًا). إذا لم توجد، يتم إرجاع الإعدادات الافتراضية."""
+    settings = _settings_cache.get(user_id)
+    if settings is None:
+        user = await users_collection.find_one({"_id": user_id}, {"settings": 1, "_id": 0})
+        # Handle both new users (with settings) and legacy users (without); ensure all default keys exist
+        settings = {**DEFAULT_SETTINGS, **((user or {}).get("settings") or {})}
+        _settings_cache.set(user_id, settings)
+    return dict(settings)
+
+async def update_user_setting(user_id: int, setting: str, value: bool) -> Dict[str, Any]:
+    """تحديث إعداد محدد للمستخدم وإرجاع الإعدادات الجديدة (مع تحديث الكاش)."""
+    if write_behind.has_pending_user(user_id):
+        # مستخدم جديد لم يُكتب بعد: نكتبه أولًا حتى لا يضيع الإعداد
+        await write_behind.flush()
+    user = await users_collection.find_one_and_update(
         {"_id": user_id},
-        {"$set": {f"settings.{setting}": value}}
+        {"$set": {f"settings.{setting}": value}},
+        projection={"settings": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        # مستخدم غير مسجل (لم يرسل /start): لا يوجد مستند ليُحدّث
+        return await get_user_settings(user_id)
+    settings = {**DEFAULT_SETTINGS, **(user.get("settings") or {})}
+    _settings_cache.set(user_id, settings)
+    return dict(settings)
+
+async def watch_settings_changes():
+    """
+    (اختياري، عند تشغيل أكثر من عملية) إبطال كاش الإعدادات عبر change stream.
+    يتطلب MongoDB بنمط replica set؛ وإلا يُكتفى بـ SETTINGS_CACHE_TTL.
+    """
+    pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+    try:
+        async with users_collection.watch(pipeline) as stream:
+            async for change in stream:
+                _settings_cache.pop(change["documentKey"]["_id"])
+    except Exception as e:
+        logger.warning("Settings change stream stopped, relying on TTL: %s", e)
+
+# --- Media Cache (file_id per tweet) ---
+async def get_cached_media(tweet_id: str) -> Optional[Dict[str, Any]]:
+    """إرجاع تخطيط الوسائط المرسلة سابقًا للتغريدة (file_ids) إن وُجد ولم تنتهِ صلاحيته."""
+    entry = _media_cache.get(tweet_id)
+    if entry is not None:
+        return entry
+    doc = await media_cache_collection.find_one(
+        {"_id": tweet_id, "expire_at": {"$gt": datetime.utcnow()}},
+        {"layout": 1, "text": 1}
     )
+    if not doc:
+        return None
+    entry = {"layout": doc["layout"], "text": doc.get("text")}
+    _media_cache.set(tweet_id, entry)
+    return entry
+
+def peek_cached_media(tweet_id: str) -> Optional[Dict[str, Any]]:
+    """قراءة من الكاش داخل الذاكرة فقط (بدون MongoDB) للقرارات السريعة مثل أولوية الجدولة."""
+    return _media_cache.get(tweet_id)
+
+async def set_cached_media(tweet_id: str, layout: list, text: Optional[str]):
+    """حفظ تخطيط الإرسال (file_ids + الكابشن) بعد أول إرسال ناجح."""
+    entry = {"layout": layout, "text": text}
+    _media_cache.set(tweet_id, entry)
+    now = datetime.utcnow()
+    await media_cache_collection.update_one(
+        {"_id": tweet_id},
+        {"$set": {**entry, "created_at": now, "expire_at": now + timedelta(seconds=config.MEDIA_CACHE_TTL)}},
+        upsert=True
+    )
+
+async def drop_cached_media(tweet_id: str):
+    """حذف مدخل الكاش (مثلاً عندما يرفض تيليجرام file_id قديم)."""
+    _media_cache.pop(tweet_id)
+    await media_cache_collection.delete_one({"_id": tweet_id})
@@ -0,0 +1,176 @@
+# extractor.py
+import asyncio
+import logging
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import config
+import fsio
+
+logger = logging.getLogger(__name__)
+
+# --- Structured extraction errors (بدل مطابقة نصوص stderr) ---
+NO_VIDEO = "no_video"        # التغريدة لا تحتوي فيديو/GIF
+UNAVAILABLE = "unavailable"  # محذوفة/محمية/تتطلب تسجيل دخول
+TIMEOUT = "timeout"
+FAILED = "failed"
+
+@dataclass
+class ExtractResult:
+    path: Optional[Path] = None
+    error: Optional[str] = None
+    detail: str = ""
+
+class _YtdlLogger:
+    """توجيه رسائل yt-dlp إلى logging بدل الطباعة على stderr."""
+    def debug(self, msg: str):
+        logger.debug(msg)
+
+    def info(self, msg: str):
+        logger.debug(msg)
+
+    def warning(self, msg: str):
+        logger.debug(msg)
+
+    def error(self, msg: str):
+        logger.debug(msg)
+
+# مجموعة خيوط دافئة: yt-dlp يُستورد مرة واحدة، ولكل خيط YoutubeDL خاص به يُعاد استخدامه
+# (YoutubeDL ليس آمنًا للاستخدام المتزامن من عدة خيوط).
+_executor = ThreadPoolExecutor(max_workers=config.YTDLP_CONCURRENCY, thread_name_prefix="yt-dlp")
+# خيط تجاوز المهلة يستمر حتى ينتهي: مقعده يُحرر عند انتهاء الخيط فعلًا لا عند المهلة،
+# حتى لا تنتظر مهمة جديدة في طابور الـ executor وتنتهي مهلتها قبل أن تبدأ
+_threads = asyncio.Semaphore(config.YTDLP_CONCURRENCY)
+_local = threading.local()
+
+def format_spec() -> str:
+    """
+    محدد الصيغة لـ yt-dlp. في وضع fit نختار أفضل نسخة يُقدَّر حجمها تحت ميزانية الإرسال المباشر
+    (yt-dlp يحسب filesize_approx من tbr × المدة)، ولا نلجأ لأفضل جودة (مسار Pyrogram) إلا إذا لم تناسب أي نسخة.
+    """
+    if config.FORMAT_MODE != "fit":
+        return "bv*+ba/best"
+    budget = config.DIRECT_SEND_BUDGET
+    # الفيديو المنفصل يُدمج مع الصوت؛ نترك هامشًا للصوت
+    video_budget = int(budget * 0.9)
+    return (f"b[filesize<={budget}]/b[filesize_approx<={budget}]"
+            f"/bv*[filesize<={video_budget}]+ba/bv*[filesize_approx<={video_budget}]+ba"
+            f"/bv*+ba/best")
+
+def _base_options() -> dict:
+    options = {
+        "quiet": True,
+        "no_warnings": True,
+        "noprogress": True,
+        "logger": _YtdlLogger(),
+        "format": format_spec(),
+        "merge_output_format": "mp4",
+        "retries": 5,
+        "fragment_retries": 5,
+        "http_headers": {"User-Agent": "Mozilla/5.0", "Accept-Language": "en-US,en;q=0.9"},
+        # اسم فريد لكل عملية تنزيل عبر job_token (يُمرر في extra_info)
+        "outtmpl": str(config.OUTPUT_DIR / "ytdlp-%(job_token)s.%(ext)s"),
+        # تغريدة بلا فيديو تعيد info بلا formats بدل رمي خطأ نصي
+        "ignore_no_formats_error": True,
+    }
+    if config.X_COOKIES:
+        options["cookiefile"] = str(config.X_COOKIES)
+    return options
+
+def _get_ydl():
+    ydl = getattr(_local, "ydl", None)
+    if ydl is None:
+        from yt_dlp import YoutubeDL
+        ydl = YoutubeDL(_base_options())
+        _local.ydl = ydl
+    return ydl
+
+def _classify_error(exc: Exception) -> ExtractResult:
+    from yt_dlp.utils import DownloadError, ExtractorError
+    original = exc
+    if isinstance(exc, DownloadError) and exc.exc_info and exc.exc_info[1] is not None:
+        original = exc.exc_info[1]
+    if isinstance(original, ExtractorError) and original.expected:
+        return ExtractResult(error=UNAVAILABLE, detail=str(original))
+    return ExtractResult(error=FAILED, detail=str(original))
+
+def _download_sync(url: str, token: str) -> ExtractResult:
+    ydl = _get_ydl()
+    try:
+        info = ydl.extract_info(url, download=False, process=False)
+        if info and info.get("_type") in ("playlist", "multi_video"):
+            # تغريدة بعدة فيديوهات: نأخذ الأول (نفس سلوك الأمر السابق)
+            entries = list(info.get("entries") or [])
+            info = entries[0] if entries else None
+        if not info or (info.get("_type", "video") == "video" and not info.get("formats") and not info.get("url")):
+            return ExtractResult(error=NO_VIDEO)
+        result = ydl.process_ie_result(info, download=True, extra_info={"job_token": token})
+    except Exception as e:
+        return _classify_error(e)
+
+    downloads = (result or {}).get("requested_downloads") or []
+    filepath = downloads[0].get("filepath") if downloads else None
+    if not filepath or not Path(filepath).exists():
+        return ExtractResult(error=NO_VIDEO)
+    return ExtractResult(path=Path(filepath))
+
+async def _submit(fn, *args) -> asyncio.Future:
+    """تشغيل fn في خيط yt-dlp بعد توفر خيط فارغ."""
+    await _threads.acquire()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    except BaseException:
+        _threads.release()
+        raise
+    future.add_done_callback(lambda _: _threads.release())
+    return future
+
+def _discard_late_result(future: asyncio.Future):
+    """بعد انتهاء المهلة يستمر الخيط؛ نحذف ناتجه المتأخر حتى لا يتراكم في OUTPUT_DIR (الحذف في خيوط I/O)."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if result.path:
+        fsio.unlink_later(result.path)
+
+async def download_video(tweet_id: str, out_dir: Path, timeout: float = 180) -> ExtractResult:
+    """
+    تنزيل فيديو التغريدة عبر yt-dlp داخل العملية (executor) وإرجاع نتيجة منظمة.
+    يجرب x.com ثم twitter.com فقط عند الأخطاء غير المتوقعة.
+    """
+    output_path = out_dir / f"{tweet_id}.mp4"
+    result = ExtractResult(error=FAILED)
+    for url in (f"https://x.com/i/status/{tweet_id}", f"https://twitter.com/i/status/{tweet_id}"):
+        future = await _submit(_download_sync, url, uuid.uuid4().hex)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            future.add_done_callback(_discard_late_result)
+            logger.warning("yt-dlp timed out for %s", url)
+            result = ExtractResult(error=TIMEOUT)
+            continue
+        if result.path:
+            await fsio.mkdir(out_dir)
+            await fsio.run(shutil.move, str(result.path), str(output_path))
+            return ExtractResult(path=output_path)
+        if result.error in (NO_VIDEO, UNAVAILABLE):
+            break
+
+    if result.error not in (NO_VIDEO, None):
+        logger.warning("yt-dlp failed for tweet %s: %s %s", tweet_id, result.error, result.detail)
+    return result
+
+async def warm_up():
+    """استيراد yt-dlp وتجهيز YoutubeDL مسبقًا حتى لا يدفع أول طلب التكلفة."""
+    try:
+        await (await _submit(_get_ydl))
+    except Exception as e:
+        logger.warning("yt-dlp warm-up failed: %s", e)
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
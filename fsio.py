@@ -0,0 +1,107 @@
+# fsio.py
+import asyncio
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, Set
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# خيوط مخصصة للقرص: قرص بطيء لا يحجز حلقة الأحداث ولا مجموعة الخيوط الافتراضية (to_thread)
+_executor = ThreadPoolExecutor(max_workers=config.IO_THREADS, thread_name_prefix="fsio")
+_cleanups: Set[asyncio.Task] = set()
+
+async def run(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """تنفيذ عملية قرص متزامنة في خيوط I/O."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+async def mkdir(path: Path):
+    await run(path.mkdir, parents=True, exist_ok=True)
+
+async def exists(path: Path) -> bool:
+    return await run(path.exists)
+
+async def file_size(path: Path) -> int:
+    return (await run(path.stat)).st_size
+
+async def total_size(paths) -> int:
+    return await run(lambda: sum(path.stat().st_size for path in paths))
+
+# --- Writes ---
+def _open(path: Path, size: Optional[int]) -> int:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if size:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # أنظمة ملفات بلا fallocate: ملف متفرق بنفس الحجم
+            os.ftruncate(fd, size)
+    return fd
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+@asynccontextmanager
+async def open_for_write(path: Path, size: Optional[int] = None) -> AsyncIterator[int]:
+    """فتح ملف للكتابة (إنشاء/تفريغ) في خيوط I/O، مع حجز size بايت مسبقًا إن أُعطي."""
+    fd = await run(_open, path, size)
+    try:
+        yield fd
+    finally:
+        await run(os.close, fd)
+
+class FileWriter:
+    """
+    كتابة مجمعة عند إزاحة محددة: القطع الصغيرة من الشبكة تتراكم في الذاكرة
+    وتُكتب بدفعات IO_WRITE_BUFFER في خيوط I/O بدل write لكل قطعة على حلقة الأحداث.
+    offset يتقدم فقط بما كُتب فعلًا (يُستخدم لاستئناف النطاقات).
+    """
+    def __init__(self, fd: int, offset: int = 0):
+        self.fd = fd
+        self.offset = offset
+        self._buffer = bytearray()
+
+    @property
+    def position(self) -> int:
+        """موضع نهاية البيانات المستلمة (المكتوبة + المعلقة في الذاكرة)."""
+        return self.offset + len(self._buffer)
+
+    async def write(self, chunk: bytes):
+        self._buffer += chunk
+        if len(self._buffer) >= config.IO_WRITE_BUFFER:
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        data, self._buffer = bytes(self._buffer), bytearray()
+        await run(_pwrite_all, self.fd, data, self.offset)
+        self.offset += len(data)
+
+# --- Deferred cleanup ---
+def _later(fn: Callable[..., Any], *args, **kwargs):
+    task = asyncio.get_running_loop().create_task(run(fn, *args, **kwargs))
+    _cleanups.add(task)
+    task.add_done_callback(_cleanups.discard)
+
+def remove_later(path: Path):
+    """حذف مجلد في الخلفية: المستهلك لا ينتظر rmtree (قد يطول على قرص بطيء)."""
+    _later(shutil.rmtree, path, ignore_errors=True)
+
+def unlink_later(path: Path):
+    """حذف ملف في الخلفية (من callbacks متزامنة على حلقة الأحداث)."""
+    _later(path.unlink, missing_ok=True)
+
+async def drain(timeout: float):
+    """انتظار عمليات الحذف المؤجلة عند الإيقاف."""
+    if _cleanups:
+        await asyncio.wait(set(_cleanups), timeout=timeout)
@@ -1,19 +1,113 @@
+import asyncio
+
 from aiogram import Router, types
 from aiogram.filters import Command
-from utils import AdminFilter
-from db import get_users_count
+from utils import AdminFilter, state_summary
+from db import get_usage_stats, get_users_count
+from handlers.twitter import chat_states
+import metrics
 
 router = Router()
 # تطبيق الفلتر على مستوى الراوتر بأكمله
 # هذا يعني أن كل الأوامر هنا لا يمكن استدعاؤها إلا من قبل الأدمن
 router.message.filter(AdminFilter())
 
+def _send_paths_summary() -> str:
+    """ملخص مسارات إرسال الوسائط: كم مرة نجح الإرسال بالرابط مقابل الرجوع للتنزيل."""
+    totals = {}
+    for (name, labels), value in metrics.counters().items():
+        if name == "media_items_sent_total":
+            path = dict(labels).get("path")
+            totals[path] = totals.get(path, 0) + value
+    sent = sum(totals.values())
+    if not sent:
+        return "لا توجد وسائط مرسلة بعد"
+    url_share = totals.get("url", 0) / sent * 100
+    return (f"بالرابط: {int(totals.get('url', 0))} ({url_share:.0f}%) | "
+            f"relay: {int(totals.get('relay', 0))} | قرص: {int(totals.get('disk', 0))} | "
+            f"Pyrogram: {int(totals.get('pyrogram', 0))}")
+
+def _metadata_cache_summary() -> str:
+    hits = int(metrics.counter_value("metadata_cache_total", result="hit"))
+    misses = int(metrics.counter_value("metadata_cache_total", result="miss"))
+    coalesced = int(metrics.counter_value("metadata_cache_total", result="coalesced"))
+    return f"إصابات: {hits} | طلبات جديدة: {misses} | مدموجة: {coalesced}"
+
+def _format_seconds(value) -> str:
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return ">300s"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:g}s"
+
+def _stages_summary() -> str:
+    """زمن كل مرحلة (p50/p95 تقريبية من الهيستوغرام)."""
+    rows = metrics.stage_summary()
+    if not rows:
+        return "لا توجد قياسات بعد"
+    return "\n".join(
+        f"• `{stage}`: {count} | p50 {_format_seconds(p50)} | p95 {_format_seconds(p95)}"
+        for stage, count, p50, p95, _ in rows
+    )
+
+def _gauges_summary(values: dict) -> str:
+    output_mb = values.get("output_dir_bytes", 0) / (1024 * 1024)
+    return (f"الطابور: {int(values.get('queue_depth', 0))} | عمال نشطون: {int(values.get('active_workers', 0))} | "
+            f"تنزيلات جارية: {int(values.get('inflight_downloads', 0))} | OUTPUT_DIR: {output_mb:.1f}MB")
+
+def _loop_lag_summary() -> str:
+    """تأخر حلقة الأحداث من العينات الأخيرة (عمل متزامن يؤخر كل المحادثات)."""
+    lag = metrics.loop_lag_summary()
+    if lag is None:
+        return "لا توجد قياسات بعد"
+    p50, p99, worst = lag
+    return f"p50 {p50 * 1000:.1f}ms | p99 {p99 * 1000:.1f}ms | الأقصى {worst * 1000:.1f}ms"
+
+def _format_bytes(value) -> str:
+    value = float(value or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TB"
+
+def _usage_summary(counters: dict) -> str:
+    """ملخص من العدادات المجمعة في MongoDB (كل العمليات، منذ البداية أو اليوم)."""
+    requested = int(counters.get("tweets_requested", 0))
+    if not requested:
+        return "لا يوجد"
+    hit_rate = counters.get("cache_hits", 0) / requested * 100
+    return (f"تغريدات: {int(counters.get('tweets_served', 0))}/{requested} | وسائط: {int(counters.get('media_items', 0))} | "
+            f"من الكاش: {hit_rate:.0f}% | بيانات: {_format_bytes(counters.get('bytes_moved'))}")
+
 @router.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     """إرسال إحصائيات البوت للمالك"""
-    total_users = await get_users_count()
+    total_users, usage = await asyncio.gather(get_users_count(), get_usage_stats())
+    gauge_values = await metrics.gauges()
     stats_text = (
         f"📊 **إحصائيات البوت**\n\n"
-        f"👤 **إجمالي المستخدمين:** {total_users}"
+        f"👤 **إجمالي المستخدمين:** {total_users} (جدد اليوم: {int(usage['today'].get('new_users', 0))})\n"
+        f"📈 **الاستخدام اليوم:** {_usage_summary(usage['today'])}\n"
+        f"📦 **الاستخدام الكلي:** {_usage_summary(usage['total'])}\n"
+        f"🔗 **مسارات الإرسال:** {_send_paths_summary()}\n"
+        f"🗂 **كاش بيانات التغريدات:** {_metadata_cache_summary()}\n"
+        f"⚙️ **الحالة الآن:** {_gauges_summary(gauge_values)}\n"
+        f"🐢 **تأخر حلقة الأحداث:** {_loop_lag_summary()}\n\n"
+        f"⏱ **زمن المراحل:**\n{_stages_summary()}"
     )
     await message.reply(stats_text, parse_mode="Markdown")
+
+@router.message(Command("memory"))
+async def cmd_memory(message: types.Message):
+    """الحالة داخل العملية: عدد العناصر والحجم التقريبي لكل بنية (حالة المحادثات، الطوابير، الكاش)."""
+    rows = state_summary()
+    lines = "\n".join(f"• `{name}`: {entries} عنصر | ~{_format_bytes(size)}" for name, entries, size in rows)
+    memory_text = (
+        f"🧠 **الذاكرة**\n\n"
+        f"💾 **RSS:** {_format_bytes(metrics.process_rss())}\n"
+        f"💬 **حالة المحادثات:** {len(chat_states)} (قيد المعالجة: {chat_states.active})\n\n"
+        f"{lines}\n\n"
+        f"المجموع التقريبي: ~{_format_bytes(sum(size for _, _, size in rows))}"
+    )
+    await message.reply(memory_text, parse_mode="Markdown")
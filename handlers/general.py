@@ -38,9 +38,10 @@ async def cmd_help(message: types.Message):
     await message.reply(WELCOME_MESSAGE)
 
 # --- Full Interactive Settings Menu ---
-async def build_settings_keyboard(user_id: int):
+async def build_settings_keyboard(user_id: int, settings: dict | None = None):
     """بناء لوحة مفاتيح الإعدادات بناءً على حالة المستخدم الحالية"""
-    settings = await get_user_settings(user_id)
+    if settings is None:
+        settings = await get_user_settings(user_id)
     builder = InlineKeyboardBuilder()
     
     send_text_status = "✅ تفعيل" if settings.get("send_text") else "❌ تعطيل"
@@ -73,9 +74,9 @@ async def handle_settings_toggle(callback: types.CallbackQuery, callback_data: S
     current_value = current_settings.get(setting_to_toggle, False)
     new_value = not current_value
     
-    await update_user_setting(user_id, setting_to_toggle, new_value)
+    new_settings = await update_user_setting(user_id, setting_to_toggle, new_value)
     
-    new_keyboard = await build_settings_keyboard(user_id)
+    new_keyboard = await build_settings_keyboard(user_id, new_settings)
     try:
         await callback.message.edit_reply_markup(reply_markup=new_keyboard)
     except Exception as e:
@@ -0,0 +1,139 @@
+# handlers/inline.py
+import asyncio
+import logging
+from typing import List, Optional
+
+from aiogram import Router, types
+from aiogram.enums import ParseMode
+from aiogram.types import (InlineQueryResultArticle, InlineQueryResultCachedDocument,
+                           InlineQueryResultCachedMpeg4Gif, InlineQueryResultCachedPhoto,
+                           InlineQueryResultCachedVideo, InlineQueryResultMpeg4Gif,
+                           InlineQueryResultPhoto, InlineQueryResultVideo, InputTextMessageContent)
+
+import config
+import metrics
+from db import get_cached_media
+from handlers.twitter import (LINK_PREFILTER_RE, estimated_video_size, extract_tweet_ids,
+                              format_caption, scrape_media)
+from utils import SingleFlight, TTLCache, track_state
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# النتائج الجاهزة لكل مجموعة تغريدات (نفس الروابط بصيغ مختلفة تشترك في نفس المدخل)
+_results_cache = TTLCache(config.INLINE_CACHE_SIZE, config.INLINE_CACHE_TTL)
+_results_flight = SingleFlight()
+track_state("inline_results_cache", lambda: _results_cache)
+
+# --- Results from known file_ids (media cache) ---
+def _cached_results(tweet_id: str, layout: List[dict]) -> Optional[list]:
+    """نتائج من file_ids سبق إرسالها؛ None إذا تعذّر تمثيل خطوة ما (مثل نسخة من القناة)."""
+    results, title = [], f"تغريدة {tweet_id}"
+    for step in layout:
+        caption = {"caption": step.get("caption"), "parse_mode": step.get("parse_mode")}
+        if step["type"] == "album":
+            results += [InlineQueryResultCachedPhoto(id=f"c{tweet_id}_{len(results)}", photo_file_id=file_id,
+                                                     **(caption if i == 0 else {}))
+                        for i, file_id in enumerate(step["file_ids"])]
+        elif step["type"] == "video" and step.get("media") == "video":
+            results.append(InlineQueryResultCachedVideo(id=f"c{tweet_id}_{len(results)}", video_file_id=step["file_id"],
+                                                        title=title, **caption))
+        elif step["type"] == "video" and step.get("media") == "animation":
+            results.append(InlineQueryResultCachedMpeg4Gif(id=f"c{tweet_id}_{len(results)}", mpeg4_file_id=step["file_id"],
+                                                           **caption))
+        elif step["type"] == "video" and step.get("media") == "document":
+            results.append(InlineQueryResultCachedDocument(id=f"c{tweet_id}_{len(results)}", document_file_id=step["file_id"],
+                                                           title=title, **caption))
+        else:
+            # copy من القناة أو مدخل قديم بلا نوع: نرجع لروابط twimg
+            return None
+    return results
+
+# --- Results from media URLs (vxtwitter) ---
+def _url_results(tweet_id: str, tweet_data: dict) -> list:
+    """نتائج تشير لروابط twimg مباشرة (تيليجرام يجلبها بنفسه)."""
+    results = []
+    caption = format_caption(tweet_data)
+    tweet_url = tweet_data.get("tweetURL") or f"https://x.com/i/status/{tweet_id}"
+    for item in tweet_data.get("media_extended") or []:
+        url, thumb = item.get("url"), item.get("thumbnail_url") or item.get("url")
+        result_id = f"u{tweet_id}_{len(results)}"
+        if not url:
+            continue
+        if item.get("type") == "image":
+            results.append(InlineQueryResultPhoto(id=result_id, photo_url=url, thumbnail_url=thumb,
+                                                  caption=caption, parse_mode=ParseMode.MARKDOWN_V2))
+            continue
+        if item.get("type") not in ("video", "gif") or not item.get("thumbnail_url"):
+            continue
+        size = estimated_video_size(item)
+        if size is not None and size > config.URL_VIDEO_MAX:
+            # أكبر من حد الجلب بالرابط: رابط التغريدة بدل الفيديو
+            results.append(InlineQueryResultArticle(
+                id=result_id, title="فيديو كبير 🎬", description="أرسل الرابط للبوت مباشرة لتنزيله",
+                thumbnail_url=thumb, input_message_content=InputTextMessageContent(message_text=tweet_url)))
+        elif item["type"] == "gif":
+            results.append(InlineQueryResultMpeg4Gif(id=result_id, mpeg4_url=url, thumbnail_url=thumb,
+                                                     caption=caption, parse_mode=ParseMode.MARKDOWN_V2))
+        else:
+            results.append(InlineQueryResultVideo(id=result_id, video_url=url, mime_type="video/mp4",
+                                                  thumbnail_url=thumb, title=f"فيديو من @{tweet_data.get('user_screen_name', 'x')}",
+                                                  caption=caption, parse_mode=ParseMode.MARKDOWN_V2))
+    return results
+
+async def _tweet_results(tweet_id: str) -> list:
+    try:
+        entry = await get_cached_media(tweet_id)
+    except Exception as e:
+        logger.warning("Media cache lookup failed for %s: %s", tweet_id, e)
+        entry = None
+    if entry:
+        results = _cached_results(tweet_id, entry["layout"])
+        if results is not None:
+            metrics.inc("inline_results_total", len(results), source="file_id")
+            return results
+    tweet_data = await scrape_media(tweet_id)
+    if not tweet_data:
+        return []
+    results = _url_results(tweet_id, tweet_data)
+    metrics.inc("inline_results_total", len(results), source="url")
+    return results
+
+async def _build_results(tweet_ids: tuple) -> list:
+    per_tweet = await asyncio.gather(*(_tweet_results(tweet_id) for tweet_id in tweet_ids))
+    # حد تيليجرام: 50 نتيجة لكل رد
+    results = [result for results in per_tweet for result in results][:50]
+    _results_cache.set(tweet_ids, results)
+    return results
+
+async def _query_results(text: str) -> list:
+    tweet_ids = await extract_tweet_ids(text)
+    if not tweet_ids:
+        return []
+    key = tuple(tweet_ids[:config.INLINE_MAX_TWEETS])
+    results = _results_cache.get(key)
+    if results is None:
+        # البناء يكمل في الخلفية بعد المهلة (SingleFlight) ليخدم الاستعلام التالي من الكاش
+        results, _ = await _results_flight.do(key, lambda: _build_results(key))
+    return results
+
+def has_inline_tweet_link(query: types.InlineQuery) -> bool:
+    return bool(LINK_PREFILTER_RE.search(query.query))
+
+@router.inline_query(has_inline_tweet_link)
+async def handle_inline_query(query: types.InlineQuery):
+    """
+    @bot <رابط تغريدة>: نتائج صور/فيديو من file_ids المعروفة أو روابط twimg مباشرة.
+    لا تنزيل ولا yt-dlp ولا OUTPUT_DIR، والرد دائمًا ضمن INLINE_TIMEOUT.
+    """
+    with metrics.timer("inline"):
+        try:
+            results = await asyncio.wait_for(_query_results(query.query), config.INLINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.info("Inline query timed out: %s", query.query)
+            results = []
+        except Exception as e:
+            logger.warning("Inline query failed for %s: %s", query.query, e)
+            results = []
+        # النتائج الفارغة لا تُخزن طويلًا عند تيليجرام حتى يُعاد المحاولة
+        await query.answer(results, cache_time=config.INLINE_CACHE_TTL if results else 5, is_personal=False)
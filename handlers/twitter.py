@@ -1,7 +1,9 @@
 # handlers/twitter.py
 import asyncio
+import copy
 import re
-import shutil
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from contextvars import ContextVar
 import uuid
 from pathlib import Path
 from typing import List, Dict, Optional
@@ -12,41 +14,37 @@ import logging
 import aiohttp
 from aiogram import Bot, Router, F, types
 from aiogram.enums import ParseMode
-from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
 from aiogram.types import (FSInputFile, InputMediaPhoto, Message,
-                           ReactionTypeEmoji, InlineKeyboardMarkup, InlineKeyboardButton)
+                           ReactionTypeEmoji, ReplyParameters, InlineKeyboardMarkup, InlineKeyboardButton)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from pyrogram import Client as PyroClient
-from pyrogram.errors import FloodWait
 
 import config
-from db import get_user_settings
-from utils import TweetActionCallback
+import extractor
+import fsio
+import metrics
+import ranged
+from artifacts import Artifact, ArtifactRegistry
+from extractor import ExtractResult
+from db import get_user_settings, get_cached_media, peek_cached_media, set_cached_media, drop_cached_media, record_usage
+from ratelimit import EDIT_DROPPED, progress_edit
+from relay import open_relay
+from scheduler import FairScheduler, ytdlp_slots, download_slots, upload_slots, prefetch_slots
+from userbot import get_userbot, pyro_upload_slots
+from utils import ChatStateStore, SingleFlight, TTLCache, TweetActionCallback, track_state
+from videoprep import VideoInfo, info_from_item, prepare_video
 
 router = Router()
-chat_queues: Dict[int, asyncio.Queue] = {}
-active_workers: set[int] = set()
-download_semaphore = asyncio.Semaphore(4)
 
 # --- Logging ---
 logger = logging.getLogger(__name__)
 
-# --- Rate limit & debounce state ---
-# عدد التعديلات المسموحة لكل محادثة: تعديل واحد كل 3 ثوانٍ (قابل للضبط).
-EDIT_MIN_INTERVAL_SECONDS = 3
-# تخزين آخر وقت تحرير لكل محادثة (ديبونس بسيط)
-_LAST_EDIT_AT: Dict[int, float] = {}
-# عشان ما نعدل بنفس النص حرفيًا عدة مرات
-_LAST_PROGRESS_TEXT: Dict[int, str] = {}
-
-# لو حاب تستخدم Token Bucket حقيقي، فعّل aiolimiter أدناه:
-try:
-    from aiolimiter import AsyncLimiter
-    _HAS_AIOLIMITER = True
-except Exception:
-    _HAS_AIOLIMITER = False
-from collections import defaultdict
-_chat_limiters = defaultdict(lambda: AsyncLimiter(1, EDIT_MIN_INTERVAL_SECONDS)) if _HAS_AIOLIMITER else None
+# --- Per-chat state ---
+# حدود الإرسال (عامة ولكل محادثة) و RetryAfter تُدار مركزيًا في ratelimit.SendRateLimiter
+# هنا فقط آخر نص تقدم لكل محادثة (عشان ما نعدل بنفس النص حرفيًا عدة مرات)، مع إزاحة المحادثات الخاملة
+chat_states = ChatStateStore(config.CHAT_STATE_MAX, config.CHAT_STATE_TTL)
+track_state("chat_states", lambda: chat_states)
+metrics.register_gauge("chat_states", lambda: len(chat_states))
 
 # --- Session Manager (reuse a single aiohttp session) ---
 _session: Optional[aiohttp.ClientSession] = None
@@ -65,7 +63,10 @@ def _get_session() -> aiohttp.ClientSession:
     if _session and not _session.closed:
         return _session
     timeout = aiohttp.ClientTimeout(total=120, connect=30, sock_read=120)
-    _session = aiohttp.ClientSession(timeout=timeout, headers=_default_headers())
+    # مجمع اتصالات لكل مضيف مع كاش DNS و keep-alive (النطاقات المتوازية تعيد استخدام نفس الاتصالات)
+    connector = aiohttp.TCPConnector(limit=config.HTTP_POOL_SIZE, limit_per_host=config.HTTP_POOL_PER_HOST,
+                                     ttl_dns_cache=config.HTTP_DNS_TTL, keepalive_timeout=config.HTTP_KEEPALIVE)
+    _session = aiohttp.ClientSession(timeout=timeout, headers=_default_headers(), connector=connector)
     return _session
 
 async def _close_session():
@@ -74,32 +75,80 @@ async def _close_session():
         await _session.close()
     _session = None
 
-# --- Helper Functions (No changes here, مع تعديلات داخلية طفيفة) ---
-async def extract_tweet_ids(text: str) -> Optional[List[str]]:
-    # PATCH: دعم mobile.twitter.com + موازاة فك t.co
-    url_pattern = r'https?://(?:(?:www\.)?(?:twitter|x|mobile\.twitter)\.com/\S+/status/\d+|t\.co/\S+)'
-    urls = re.findall(url_pattern, text)
-    if not urls: return None
+# --- Link extraction (precompiled) ---
+# PATCH: دعم mobile.twitter.com، والرابط قد يأتي بدون https:// من كيانات تيليجرام.
+# (?<![\w.-]) يمنع مطابقة نطاقات مثل lot.co أو notx.com
+_TWEET_URL_RE = re.compile(
+    r'(?<![\w.-])(?:https?://)?(?:(?:(?:www|mobile)\.)?(?:twitter|x)\.com/\S+?/status(?:es)?/(\d+)|t\.co/([A-Za-z0-9]+))',
+    re.IGNORECASE,
+)
+_STATUS_ID_RE = re.compile(r'/status(?:es)?/(\d+)')
+# فحص مبدئي رخيص قبل أي معالجة: نطاق تويتر/إكس/t.co متبوع بـ "/"
+LINK_PREFILTER_RE = re.compile(r'(?<![\w.-])(?:(?:www\.|mobile\.)?(?:twitter|x)\.com|t\.co)/', re.IGNORECASE)
 
+# t.co -> tweet_id (الروابط المختصرة لا تتغير، فلا حاجة لـ TTL؛ "" = ليست تغريدة)
+_tco_cache = TTLCache(config.TCO_CACHE_SIZE)
+_tco_flight = SingleFlight()
+
+def message_link_candidates(message: Message) -> List[str]:
+    """الروابط من كيانات الرسالة (url و text_link)؛ وإلا النص نفسه ليُفحص بالتعبير النمطي."""
+    text = message.text or message.caption or ""
+    entities = message.entities or message.caption_entities or []
+    urls = []
+    for entity in entities:
+        if entity.type == "url":
+            urls.append(entity.extract_from(text))
+        elif entity.type == "text_link" and entity.url:
+            urls.append(entity.url)
+    return urls or [text]
+
+def has_tweet_link(message: Message) -> bool:
+    """فلتر الراوتر: يطابق روابط تويتر/إكس/t.co فعلية فقط (لا t.com ولا lot.co)."""
+    return any(LINK_PREFILTER_RE.search(candidate) for candidate in message_link_candidates(message))
+
+async def _resolve_tco_uncached(short_id: str) -> str:
     session = _get_session()
+    url = f"https://t.co/{short_id}"
+    # نقرأ ترويسة Location فقط بدون تتبع التحويل (لا نُنزّل صفحة الهدف)
+    for _ in range(3):
+        async with session.get(url, allow_redirects=False) as response:
+            location = response.headers.get("Location", "")
+            if response.content_length is not None and response.content_length <= 4096:
+                await response.read()  # جسم صغير: نقرأه ليبقى الاتصال قابلًا لإعادة الاستخدام
+        match = _STATUS_ID_RE.search(location)
+        if match:
+            return match.group(1)
+        if not location.startswith("https://t.co/"):
+            return ""
+        url = location
+    return ""
 
-    async def resolve(url: str) -> Optional[str]:
-        current_tweet_id = None
-        if 't.co/' in url:
-            try:
-                # PATCH: استخدم GET بدل HEAD لأن بعض النواقل تمنع HEAD
-                async with session.get(url, allow_redirects=True) as response:
-                    match = re.search(r'/status/(\d+)', str(response.url))
-                    if match: current_tweet_id = match.group(1)
-            except Exception as e:
-                logger.warning("Could not resolve %s: %s", url, e)
-                return None
-        else:
-            match = re.search(r'/status/(\d+)', url)
-            if match: current_tweet_id = match.group(1)
-        return current_tweet_id
+async def _resolve_tco(short_id: str) -> Optional[str]:
+    cached = _tco_cache.get(short_id)
+    if cached is not None:
+        return cached or None
+    try:
+        tweet_id, _ = await _tco_flight.do(short_id, lambda: _resolve_tco_uncached(short_id))
+    except Exception as e:
+        logger.warning("Could not resolve t.co/%s: %s", short_id, e)
+        return None
+    _tco_cache.set(short_id, tweet_id)
+    return tweet_id or None
+
+async def extract_tweet_ids(text: str, candidates: Optional[List[str]] = None) -> Optional[List[str]]:
+    """
+    استخراج معرفات التغريدات بالترتيب وبدون تكرار.
+    candidates: روابط جاهزة من كيانات الرسالة (message_link_candidates)، وإلا يُفحص text.
+    """
+    matches = [m for candidate in (candidates or [text]) for m in _TWEET_URL_RE.finditer(candidate)]
+    if not matches: return None
+
+    async def resolve(match: re.Match) -> Optional[str]:
+        status_id, short_id = match.groups()
+        return status_id or await _resolve_tco(short_id)
 
-    ids = await asyncio.gather(*(resolve(u) for u in urls))
+    # PATCH: موازاة فك t.co
+    ids = await asyncio.gather(*(resolve(m) for m in matches))
     ordered_unique_ids, seen_ids = [], set()
     for tid in ids:
         if tid and tid not in seen_ids:
@@ -139,20 +188,29 @@ def _escape_markdown_v2(text: str) -> str:
     special = r'_\*\[\]\(\)~`>#+\-=|{}\.!'
     return re.sub(f'([{re.escape(special)}])', r'\\\1', text)
 
-async def ytdlp_download_tweet_video(tweet_id: str, out_dir: Path) -> Optional[Path]:
+async def ytdlp_download_tweet_video(tweet_id: str, out_dir: Path) -> ExtractResult:
+    """تنزيل فيديو التغريدة: داخل العملية افتراضيًا، أو عبر أمر yt-dlp عند YTDLP_MODE=subprocess."""
+    if config.YTDLP_MODE == "inprocess":
+        return await extractor.download_video(tweet_id, out_dir)
+    return await _ytdlp_subprocess(tweet_id, out_dir)
+
+async def _ytdlp_subprocess(tweet_id: str, out_dir: Path) -> ExtractResult:
+    import shlex
     import shutil as _shutil
-    if _shutil.which('yt-dlp') is None:
+    ytdlp_cmd = shlex.split(config.YTDLP_BIN)
+    if not ytdlp_cmd or _shutil.which(ytdlp_cmd[0]) is None:
         logger.warning("yt-dlp not found in PATH")
-        return None
+        return ExtractResult(error=extractor.FAILED, detail="yt-dlp not found")
 
     base_urls = [
         f"https://x.com/i/status/{tweet_id}",
         f"https://twitter.com/i/status/{tweet_id}",
     ]
+    await fsio.mkdir(out_dir)
     output_path = out_dir / f"{tweet_id}.mp4"
     common = [
-        'yt-dlp', '--quiet',
-        '-f', 'bv*+ba/best',
+        *ytdlp_cmd, '--quiet',
+        '-f', extractor.format_spec(),
         '--merge-output-format', 'mp4',
         '--retries', '5', '--fragment-retries', '5',
         '--add-header', 'User-Agent: Mozilla/5.0',
@@ -160,14 +218,15 @@ async def ytdlp_download_tweet_video(tweet_id: str, out_dir: Path) -> Optional[P
         '--no-warnings',
         '-o', str(output_path),
     ]
+    if config.X_COOKIES:
+        common += ['--cookies', str(config.X_COOKIES)]
 
     last_err = ""
     for url in base_urls:
-        if output_path.exists():
-            try:
-                output_path.unlink()
-            except Exception:
-                pass
+        try:
+            await fsio.run(output_path.unlink, missing_ok=True)
+        except Exception:
+            pass
         cmd = [*common, url]
         try:
             process = await asyncio.create_subprocess_exec(
@@ -178,26 +237,56 @@ async def ytdlp_download_tweet_video(tweet_id: str, out_dir: Path) -> Optional[P
             except asyncio.TimeoutError:
                 process.kill()
                 logger.warning("yt-dlp timed out for %s", url)
+                last_err = extractor.TIMEOUT
                 continue
         except Exception as e:
             logger.error("yt-dlp exec failed for %s: %s", url, e)
             continue
 
         err = stderr.decode(errors="ignore")
-        if process.returncode == 0 and output_path.exists():
-            return output_path
+        if process.returncode == 0 and await fsio.exists(output_path):
+            return ExtractResult(path=output_path)
         last_err = err
         if "JSONDecodeError" in err or "Failed to parse JSON" in err:
             continue
         if "No video could be found" in err:
-            break
+            return ExtractResult(error=extractor.NO_VIDEO)
 
-    if last_err and "No video could be found" not in last_err:
+    if last_err:
         logger.warning("yt-dlp failed for tweet %s: %s", tweet_id, last_err)
-    return None
+    return ExtractResult(error=extractor.TIMEOUT if last_err == extractor.TIMEOUT else extractor.FAILED, detail=last_err)
 
-async def scrape_media(tweet_id: str) -> Optional[dict]:
-    api_url = f"https://api.vxtwitter.com/i/status/{tweet_id}"
+# --- Tweet metadata cache (vxtwitter) ---
+_metadata_cache = TTLCache(config.METADATA_CACHE_SIZE, config.METADATA_CACHE_TTL)
+_metadata_flight = SingleFlight()
+# نتيجة سلبية مخزنة (تغريدة غير موجودة/بدون بيانات) تختلف عن "غير موجود في الكاش"
+_NO_DATA = object()
+
+def _pick_variant(item: dict) -> Optional[dict]:
+    """
+    اختيار نسخة mp4: أعلى bitrate يُقدَّر حجمها (bitrate × المدة) تحت ميزانية الإرسال المباشر،
+    وإلا أعلى bitrate متاح (سيذهب لمسار الملفات الكبيرة).
+    """
+    variants = sorted(
+        (v for v in item["variants"] if v.get("url") and str(v.get("content_type","")).endswith("mp4")),
+        key=lambda v: v.get("bitrate", 0),
+        reverse=True
+    )
+    if not variants:
+        return None
+    duration_ms = item.get("duration_millis")
+    if config.FORMAT_MODE == "fit" and duration_ms:
+        for variant in variants:
+            if variant.get("bitrate", 0) * duration_ms / 1000 / 8 <= config.DIRECT_SEND_BUDGET:
+                return variant
+    return variants[0]
+
+async def _fetch_tweet_data(tweet_id: str) -> Optional[dict]:
+    with metrics.timer("scrape"):
+        return await _fetch_tweet_data_uncached(tweet_id)
+
+async def _fetch_tweet_data_uncached(tweet_id: str) -> Optional[dict]:
+    api_url = f"{config.VXTWITTER_API_BASE}/i/status/{tweet_id}"
     try:
         session = _get_session()
         async with session.get(api_url) as response:
@@ -209,83 +298,169 @@ async def scrape_media(tweet_id: str) -> Optional[dict]:
                     media_items = []
                 for m in media_items:
                     if m.get("type") in ("video", "gif") and isinstance(m.get("variants"), list):
-                        best = max(
-                            (v for v in m["variants"] if v.get("url") and str(v.get("content_type","")).endswith("mp4")),
-                            key=lambda v: v.get("bitrate", 0),
-                            default=None
-                        )
+                        best = _pick_variant(m)
                         if best: m["url"] = best["url"]
                 data.setdefault("tweetURL", f"https://x.com/i/status/{tweet_id}")
                 data.setdefault("id", tweet_id)
+                _metadata_cache.set(tweet_id, data)
                 return data
+            # استجابة سلبية (404/محذوفة...): تُخزن لمدة أقصر
+            _metadata_cache.set(tweet_id, _NO_DATA, ttl=config.METADATA_NEGATIVE_TTL)
             return None
     except Exception as e:
+        # أخطاء الشبكة مؤقتة فلا تُخزن
         logger.warning("vxtwitter scrape failed for %s: %s", tweet_id, e)
         return None
 
+async def scrape_media(tweet_id: str) -> Optional[dict]:
+    """
+    بيانات التغريدة من vxtwitter عبر كاش TTL محدود، مع دمج الطلبات المتزامنة لنفس التغريدة.
+    تُعاد نسخة مستقلة حتى لا يعدّل المستدعي النسخة المخزنة.
+    """
+    cached = _metadata_cache.get(tweet_id)
+    if cached is not None:
+        metrics.inc("metadata_cache_total", result="hit")
+        return None if cached is _NO_DATA else copy.deepcopy(cached)
+    data, shared = await _metadata_flight.do(tweet_id, lambda: _fetch_tweet_data(tweet_id))
+    metrics.inc("metadata_cache_total", result="coalesced" if shared else "miss")
+    return copy.deepcopy(data) if data is not None else None
+
+async def _fetch_media(media_url: str, out_dir: Path) -> Optional[Path]:
+    """تنزيل رابط واحد إلى مجلد التغريدة المشترك؛ يعيد المسار أو None عند الفشل."""
+    await fsio.mkdir(out_dir)
+    # PATCH: جهّز مسار فريد لكل عنصر
+    path = _unique_media_path(out_dir, media_url)
+    return path if await download_media(_get_session(), media_url, path) else None
+
 async def download_media(session: aiohttp.ClientSession, media_url: str, file_path: Path) -> bool:
     # PATCH: retries + backoff + استنتاج الامتداد من Content-Type عند اللزوم
-    async with download_semaphore:
-        backoffs = [0, 1, 2, 4]
-        last_exc = None
-        for delay in backoffs:
-            if delay:
-                await asyncio.sleep(delay)
-            try:
-                async with session.get(media_url, timeout=aiohttp.ClientTimeout(total=180)) as response:
-                    if response.status == 200:
-                        # استنتج الامتداد إذا كان المسار بلا امتداد
-                        if not file_path.suffix:
-                            ctype = response.headers.get("Content-Type", "")
-                            guessed = mimetypes.guess_extension(ctype.split(";")[0].strip()) or ""
-                            if guessed:
-                                try:
-                                    file_path = file_path.with_suffix(guessed)
-                                except Exception:
-                                    pass
-                        with open(file_path, "wb") as f:
-                            async for chunk in response.content.iter_chunked(8192):
-                                f.write(chunk)
+    async with download_slots:
+        metrics.gauge_add("inflight_downloads", 1)
+        try:
+            with metrics.timer("download"):
+                return await _download_with_retries(session, media_url, file_path)
+        finally:
+            metrics.gauge_add("inflight_downloads", -1)
+
+async def _stream_to_file(response: aiohttp.ClientResponse, file_path: Path):
+    # الكتابة بدفعات كبيرة في خيوط I/O (لا write لكل قطعة على حلقة الأحداث)
+    async with fsio.open_for_write(file_path) as fd:
+        writer = fsio.FileWriter(fd)
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            await writer.write(chunk)
+        await writer.flush()
+
+async def _download_with_retries(session: aiohttp.ClientSession, media_url: str, file_path: Path) -> bool:
+    backoffs = [0, 1, 2, 4]
+    last_exc = None
+    # الطلب الأول يطلب الجزء الأول فقط: 206 يعني أن الخادم يدعم النطاقات (ونعرف الحجم من Content-Range)
+    ranged_download = config.DOWNLOAD_CONNECTIONS > 1
+    timeout = aiohttp.ClientTimeout(total=180)
+    for delay in backoffs:
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            headers = {"Range": f"bytes=0-{config.DOWNLOAD_PART_SIZE - 1}"} if ranged_download else None
+            ranged_failed = False
+            async with session.get(media_url, headers=headers, timeout=timeout) as response:
+                if response.status in (200, 206):
+                    # استنتج الامتداد إذا كان المسار بلا امتداد
+                    if not file_path.suffix:
+                        ctype = response.headers.get("Content-Type", "")
+                        guessed = mimetypes.guess_extension(ctype.split(";")[0].strip()) or ""
+                        if guessed:
+                            try:
+                                file_path = file_path.with_suffix(guessed)
+                            except Exception:
+                                pass
+                    probed = ranged.probe_range(response)
+                    if probed and probed[0] + 1 < probed[1]:
+                        # ملف أكبر من جزء واحد: بقية النطاقات بالتوازي، وكل نطاق يعيد المحاولة بمفرده
+                        try:
+                            if await ranged.download(session, media_url, file_path, response, *probed,
+                                                     config.DOWNLOAD_PART_SIZE, config.DOWNLOAD_CONNECTIONS, timeout):
+                                return True
+                        except Exception as e:
+                            logger.warning("Ranged download failed for %s: %s", media_url, e)
+                        # الملف المحجوز مسبقًا فيه ثغرات: يُحذف ونعيد التنزيل كاملًا بتدفق واحد فورًا
+                        await fsio.run(file_path.unlink, missing_ok=True)
+                        ranged_download, ranged_failed = False, True
+                    elif response.status == 206 and not probed:
+                        # 206 بلا حجم معروف: نعيد الطلب كاملًا بدون Range
+                        ranged_download = False
+                        raise aiohttp.ClientPayloadError("Content-Range without total size")
+                    else:
+                        await _stream_to_file(response, file_path)
                         return True
-            except Exception as e:
-                last_exc = e
-                continue
-        if last_exc:
-            logger.warning("download_media failed for %s: %s", media_url, last_exc)
+            if ranged_failed:
+                async with session.get(media_url, timeout=timeout) as response:
+                    response.raise_for_status()
+                    await _stream_to_file(response, file_path)
+                return True
+        except Exception as e:
+            last_exc = e
+            continue
+    if last_exc:
+        logger.warning("download_media failed for %s: %s", media_url, last_exc)
     return False
 
-async def send_large_file_pyro(file_path: Path, caption: Optional[str] = None, parse_mode: str = "Markdown", markup: Optional[InlineKeyboardMarkup] = None):
-    app = PyroClient("user_bot", api_id=config.API_ID, api_hash=config.API_HASH, session_string=config.PYRO_SESSION_STRING, in_memory=True)
+def _pyro_parse_mode(parse_mode: Optional[str]):
+    from pyrogram.enums import ParseMode as PyroParseMode
+    # PATCH: عند تمرير "MarkdownV2" نخليها بدون parse لتفادي تعارض V2
+    if parse_mode and parse_mode.lower() in ("markdownv2", "markdown_v2"):
+        return None
+    if parse_mode and parse_mode.lower() == "markdown":
+        return PyroParseMode.MARKDOWN
+    return PyroParseMode.HTML
+
+async def send_large_file_pyro(file_path: Path, caption: Optional[str] = None, parse_mode: str = "Markdown",
+                               markup: Optional[InlineKeyboardMarkup] = None, info: Optional[VideoInfo] = None):
+    """
+    رفع فيديو كبير إلى القناة عبر عميل Pyrogram المشترك (بدون handshake لكل ملف).
+    يعيد رسالة القناة (لنسخها للمستخدم) أو None عند الفشل.
+    """
     try:
-        await app.start()
-        from pyrogram.enums import ParseMode as PyroParseMode
-        # PATCH: عند تمرير "MarkdownV2" نخليها بدون parse لتفادي تعارض V2
-        if parse_mode and parse_mode.lower() in ("markdownv2", "markdown_v2"):
-            pyro_parse_mode = None
-        elif parse_mode and parse_mode.lower() == "markdown":
-            pyro_parse_mode = PyroParseMode.MARKDOWN
-        else:
-            pyro_parse_mode = PyroParseMode.HTML
-        await app.send_video(config.CHANNEL_ID, str(file_path), caption=caption, parse_mode=pyro_parse_mode, reply_markup=markup)
-        await app.stop()
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        try:
-            # إعادة الإرسال بعد الانتظار
-            await app.send_video(config.CHANNEL_ID, str(file_path), caption=caption, parse_mode=pyro_parse_mode, reply_markup=markup)
-        finally:
-            try:
-                await app.stop()
-            except Exception:
-                pass
+        # get_userbot يحمّل pyrogram (في خيط) عند أول استخدام، ثم نستورد أنواعه هنا
+        await get_userbot()
     except Exception as e:
         logger.error("Pyrogram failed: %s", e)
-        # PATCH: is_connected خاصية وليست awaitable
-        try:
-            if getattr(app, "is_connected", False):
-                await app.stop()
-        except Exception:
-            pass
+        return None
+    from pyrogram.errors import FloodWait
+    pyro_parse_mode = _pyro_parse_mode(parse_mode)
+    async with pyro_upload_slots:
+        for attempt in range(2):
+            try:
+                app = await get_userbot()
+                with metrics.timer("pyrogram_upload"):
+                    return await app.send_video(config.CHANNEL_ID, str(file_path), caption=caption, parse_mode=pyro_parse_mode,
+                                                reply_markup=markup, **(info or VideoInfo()).pyrogram_kwargs())
+            except FloodWait as e:
+                if attempt:
+                    logger.error("Pyrogram flood wait persisted for %s", file_path.name)
+                    return None
+                # إعادة الإرسال بعد الانتظار
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.error("Pyrogram failed: %s", e)
+                return None
+    return None
+
+async def deliver_large_video(message: Message, file_path: Path, caption: str, markup: Optional[InlineKeyboardMarkup],
+                              info: Optional[VideoInfo] = None, artifact: Optional[Artifact] = None) -> Optional[tuple]:
+    """
+    رفع الفيديو للقناة ثم نسخه للمستخدم عبر copy_message ليصله الفيديو نفسه.
+    مع artifact يُرفع الملف للقناة مرة واحدة وتنسخه كل الطلبات المتزامنة.
+    يعيد (خطوة التخطيط للكاش، معرف الرسالة المنسوخة) أو None عند الفشل.
+    """
+    upload = lambda: send_large_file_pyro(file_path, caption, "MarkdownV2", markup, info)
+    channel_msg = await (artifact.once(("channel", file_path), upload) if artifact else upload())
+    if channel_msg is None:
+        await message.reply("❌ تعذّر رفع الفيديو الكبير، حاول لاحقًا.")
+        return None
+    copied = await message.bot.copy_message(chat_id=message.chat.id, from_chat_id=config.CHANNEL_ID,
+                                            message_id=channel_msg.id, reply_to_message_id=message.message_id,
+                                            reply_markup=markup)
+    return {"type": "copy", "from_chat_id": config.CHANNEL_ID, "message_id": channel_msg.id}, copied.message_id
 
 # --- دالة تضمن ظهور الكيبورد دائمًا (لا تطنيش) ---
 async def ensure_reply_markup(bot: Bot, base_message: Message, reply_markup: InlineKeyboardMarkup):
@@ -294,20 +469,12 @@ async def ensure_reply_markup(bot: Bot, base_message: Message, reply_markup: Inl
     يرسل رسالة جديدة مع نفس الكيبورد ويُكمل بهدوء (بدون رمي استثناء).
     """
     try:
-        try:
-            await bot.edit_message_reply_markup(
-                chat_id=base_message.chat.id,
-                message_id=base_message.message_id,
-                reply_markup=reply_markup
-            )
-        except TelegramRetryAfter as e:
-            # احترام flood control من تيليجرام
-            await asyncio.sleep(e.retry_after)
-            await bot.edit_message_reply_markup(
-                chat_id=base_message.chat.id,
-                message_id=base_message.message_id,
-                reply_markup=reply_markup
-            )
+        # flood control يُعالج في SendRateLimiter
+        await bot.edit_message_reply_markup(
+            chat_id=base_message.chat.id,
+            message_id=base_message.message_id,
+            reply_markup=reply_markup
+        )
     except TelegramBadRequest as e:
         msg = (e.message or "").lower()
         if "message is not modified" in msg:
@@ -337,39 +504,365 @@ def create_inline_keyboard(tweet_data: dict, user_msg_id: int) -> Optional[Inlin
     # إلغاء الأزرار نهائياً
     return None
 
-async def send_tweet_text_reply(original_message: Message, last_media_message: Message, tweet_data: dict):
+async def send_tweet_text_reply(original_message: Message, reply_to_message_id: int, tweet_data: dict):
+    """نص التغريدة كرد على آخر رسالة وسائط (قد تكون نسخة copy_message، لذا نستخدم معرفها فقط)."""
     tweet_text = tweet_data.get("text")
     if tweet_text:
         # <<< تطبيق الإصلاح هنا قبل الإرسال (MarkdownV2) >>>
         safe_text = escape_markdown(tweet_text)
-        await last_media_message.reply(f"📝 *نص التغريدة:*\n\n{safe_text}", parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True)
+        await original_message.bot.send_message(
+            original_message.chat.id,
+            f"📝 *نص التغريدة:*\n\n{safe_text}",
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True,
+            reply_parameters=ReplyParameters(message_id=reply_to_message_id, allow_sending_without_reply=True),
+        )
 
-async def process_single_tweet(message: Message, tweet_id: str, settings: Dict):
-    temp_dir = config.OUTPUT_DIR / str(uuid.uuid4())
-    temp_dir.mkdir()
+# --- Media cache (file_id) helpers ---
+def _sent_file_id(sent: Message) -> Optional[str]:
+    """استخراج file_id من رسالة أرسلها البوت (فيديو/GIF/مستند/صورة)."""
+    media = sent.video or sent.animation or sent.document
+    if media:
+        return media.file_id
+    if sent.photo:
+        return sent.photo[-1].file_id
+    return None
+
+def _sent_media_type(sent: Message) -> Optional[str]:
+    """نوع الوسائط كما حفظها تيليجرام (الـ file_id صالح فقط لنفس النوع، مثلاً في نتائج inline)."""
+    for media_type in ("video", "animation", "document"):
+        if getattr(sent, media_type):
+            return media_type
+    return "photo" if sent.photo else None
+
+def _caption_kwargs(caption: Optional[str], parse_mode: Optional[str]) -> Dict:
+    # parse_mode=None يعني الإبقاء على الافتراضي المضبوط في البوت
+    kwargs = {"caption": caption}
+    if parse_mode:
+        kwargs["parse_mode"] = parse_mode
+    return kwargs
+
+# --- Usage tracking (حدث استخدام لكل تغريدة يُكتب عبر write-behind) ---
+_usage: ContextVar[Optional[Dict]] = ContextVar("usage", default=None)
+
+def _track_usage(path: str, items: int = 0, nbytes: int = 0):
+    """إضافة ما أُرسل للتغريدة الجارية (المسار، عدد العناصر، البايتات التي مرّت عبر البوت)."""
+    usage = _usage.get()
+    if usage is None:
+        return
+    usage["items"] += items
+    usage["bytes"] += nbytes
+    if path not in usage["paths"]:
+        usage["paths"].append(path)
+
+async def _remember_layout(tweet_id: str, layout: List[Dict], text: Optional[str]):
+    """حفظ التخطيط في الكاش؛ فشل الكاش لا يجب أن يُفشل الإرسال."""
+    if not layout or not all(step.get("file_id") or step.get("message_id")
+                             or step.get("file_ids") and all(step["file_ids"]) for step in layout):
+        return
+    try:
+        await set_cached_media(tweet_id, layout, text)
+    except Exception as e:
+        logger.warning("Could not cache media for tweet %s: %s", tweet_id, e)
+
+async def send_from_cache(message: Message, tweet_id: str, entry: Dict, settings: Dict) -> bool:
+    """
+    إعادة إرسال تغريدة سبق إرسالها عبر file_id بدون تنزيل أو رفع.
+    يعيد False إذا رفض تيليجرام أحد المعرفات (يُحذف المدخل ويُكمل المسار العادي).
+    """
     bot: Bot = message.bot
-    last_sent_message: Optional[Message] = None
-    
+    keyboard = create_inline_keyboard({"tweetURL": f"https://x.com/i/status/{tweet_id}", "id": tweet_id}, user_msg_id=message.message_id)
+    last_sent_id: Optional[int] = None
+    try:
+        for step in entry["layout"]:
+            if step["type"] == "album":
+                media_group = [
+                    InputMediaPhoto(media=file_id, **_caption_kwargs(step.get("caption") if i == 0 else None, step.get("parse_mode")))
+                    for i, file_id in enumerate(step["file_ids"])
+                ]
+                sent_messages = await message.reply_media_group(media_group)
+                last_sent_id = sent_messages[-1].message_id
+                _track_usage("file_id", items=len(sent_messages))
+                if keyboard:
+                    await ensure_reply_markup(bot, sent_messages[-1], keyboard)
+            elif step["type"] == "video":
+                sent = await message.reply_video(
+                    step["file_id"], reply_markup=keyboard,
+                    **_caption_kwargs(step.get("caption"), step.get("parse_mode"))
+                )
+                last_sent_id = sent.message_id
+                _track_usage("file_id", items=1)
+            elif step["type"] == "copy":
+                copied = await bot.copy_message(chat_id=message.chat.id, from_chat_id=step["from_chat_id"],
+                                                message_id=step["message_id"], reply_to_message_id=message.message_id,
+                                                reply_markup=keyboard)
+                last_sent_id = copied.message_id
+                _track_usage("file_id", items=1)
+    except TelegramBadRequest as e:
+        logger.warning("Cached file_id rejected for tweet %s: %s", tweet_id, e)
+        await drop_cached_media(tweet_id)
+        if last_sent_id is not None:
+            # أُرسل جزء بالفعل؛ لا نكرر الإرسال الكامل
+            return True
+        return False
+
+    if last_sent_id and settings.get("send_text"):
+        text = entry.get("text")
+        if text is None:
+            tweet_data = await scrape_media(tweet_id)
+            text = tweet_data.get("text") if tweet_data else None
+        if text:
+            await send_tweet_text_reply(message, last_sent_id, {"text": text})
+    return True
+
+# --- Media sending steps (ألبوم صور أو فيديو واحد) ---
+def _media_steps(media_items: List[Dict]) -> List[tuple]:
+    """تقسيم العناصر إلى خطوات إرسال: ألبومات صور (5 لكل ألبوم) ثم فيديو لكل رسالة."""
+    photos = [item for item in media_items if item.get("type") == "image"]
+    videos = [item for item in media_items if item.get("type") in ("video", "gif")]
+    steps = [("album", photos[i:i + 5]) for i in range(0, len(photos), 5)]
+    steps += [("video", [item]) for item in videos]
+    return steps
+
+async def _send_inputs(message: Message, kind: str, inputs: list, caption: Optional[str],
+                       keyboard: Optional[InlineKeyboardMarkup], upload: bool = True,
+                       video: Optional[VideoInfo] = None) -> List[Message]:
+    # upload=False عند الإرسال بالرابط: تيليجرام هو من يجلب الملف، فلا نحجز خانة رفع
+    slot = upload_slots if upload else nullcontext()
+    stage = "upload" if upload else "url_send"
+    if kind == "album":
+        media_group = [
+            InputMediaPhoto(
+                media=f,
+                caption=caption if i == 0 else None,
+                parse_mode=ParseMode.MARKDOWN_V2
+            ) for i, f in enumerate(inputs)
+        ]
+        async with slot:
+            with metrics.timer(stage):
+                return await message.reply_media_group(media_group)
+    async with slot:
+        with metrics.timer(stage):
+            sent = await message.reply_video(inputs[0], caption=caption, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=keyboard,
+                                             **(video or VideoInfo()).bot_kwargs())
+    return [sent]
+
+def estimated_video_size(item: Dict) -> Optional[int]:
+    """تقدير حجم الفيديو من bitrate النسخة المختارة ومدة المقطع (vxtwitter لا يعطي الحجم)."""
+    duration_ms = item.get("duration_millis")
+    variant = next((v for v in item.get("variants") or [] if v.get("url") == item.get("url")), None)
+    if not duration_ms or not variant or not variant.get("bitrate"):
+        return None
+    return int(variant["bitrate"] * duration_ms / 1000 / 8)
+
+def _url_eligible(kind: str, items: List[Dict]) -> bool:
+    """الصور دائمًا؛ الفيديو فقط إن كان تقديره تحت حد الجلب بالرابط في تيليجرام."""
+    if kind == "album":
+        return True
+    size = estimated_video_size(items[0])
+    return size is not None and size <= config.URL_VIDEO_MAX
+
+async def _send_step_url(message: Message, kind: str, items: List[Dict], caption: Optional[str],
+                         keyboard: Optional[InlineKeyboardMarkup]) -> Optional[List[Message]]:
+    """إرسال الخطوة بروابط twimg ليجلبها تيليجرام بنفسه؛ None عند رفض الرابط."""
+    try:
+        return await _send_inputs(message, kind, [item["url"] for item in items], caption, keyboard, upload=False,
+                                  video=info_from_item(items[0]) if kind == "video" else None)
+    except TelegramBadRequest as e:
+        logger.info("Telegram rejected URL for %s, falling back: %s", items[0]["url"], e)
+        metrics.inc("media_url_rejected_total", len(items), kind=kind)
+        return None
+
+async def _send_step_relay(message: Message, kind: str, items: List[Dict], caption: Optional[str],
+                           keyboard: Optional[InlineKeyboardMarkup]) -> Optional[List[Message]]:
+    """إرسال الخطوة بتمرير البايتات مباشرة من twimg إلى تيليجرام؛ None يعني الرجوع لمسار القرص."""
+    session = _get_session()
+    async with AsyncExitStack() as stack:
+        inputs = []
+        for item in items:
+            input_file = await open_relay(stack, session, item["url"])
+            if input_file is None:
+                return None
+            inputs.append(input_file)
+        try:
+            sent = await _send_inputs(message, kind, inputs, caption, keyboard,
+                                      video=info_from_item(items[0]) if kind == "video" else None)
+            _track_usage("relay", nbytes=sum(getattr(f, "bytes_read", None) or len(getattr(f, "data", b"")) for f in inputs))
+            return sent
+        except (TelegramBadRequest, TelegramRetryAfter, TelegramNetworkError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Relay send failed for %s, falling back to disk: %s", items[0]["url"], e)
+            return None
+
+async def _send_step_disk(message: Message, tweet_id: str, kind: str, items: List[Dict], caption: Optional[str],
+                          keyboard: Optional[InlineKeyboardMarkup], artifact: Artifact) -> tuple[List[Message], Optional[Dict], Optional[int], bool]:
+    """
+    المسار الاحتياطي: تنزيل إلى مجلد التغريدة المشترك ثم الرفع (والفيديو الكبير عبر Pyrogram).
+    كل رابط يُنزل مرة واحدة مهما تعددت الطلبات المتزامنة على نفس التغريدة.
+    يعيد (الرسائل المرسلة، خطوة copy للفيديو الكبير، معرف آخر رسالة، هل اكتملت العناصر).
+    """
+    # نزّل بالتوازي مع retries
+    paths = await asyncio.gather(*(artifact.once(("media", item["url"]), lambda url=item["url"]: _fetch_media(url, artifact.dir))
+                                   for item in items))
+    paths = [path for path in paths if path]
+    complete = len(paths) == len(items)
+    if not paths:
+        return [], None, None, False
+    _track_usage("disk", nbytes=await fsio.total_size(paths))
+
+    # faststart يعدل الملف نفسه: مرة واحدة وقبل أي رفع
+    video = await artifact.once(("prepare", paths[0]), lambda: prepare_video(paths[0])) if kind == "video" else None
+    if kind == "video" and await fsio.file_size(paths[0]) > config.MAX_FILE_SIZE:
+        caption_plain = _trim_caption(f"🐦 فيديو من تويتر: https://x.com/i/status/{tweet_id}")
+        delivered = await deliver_large_video(message, paths[0], caption_plain, keyboard, video, artifact)
+        if not delivered:
+            return [], None, None, False
+        copy_step, copied_id = delivered
+        return [], copy_step, copied_id, complete
+
+    sent = await _send_inputs(message, kind, [FSInputFile(p) for p in paths], caption, keyboard, video=video)
+    return sent, None, sent[-1].message_id, complete
+
+def _layout_step(kind: str, sent: List[Message], caption: Optional[str]) -> Dict:
+    if kind == "album":
+        return {"type": "album", "file_ids": [_sent_file_id(m) for m in sent],
+                "caption": caption, "parse_mode": ParseMode.MARKDOWN_V2.value}
+    return {"type": "video", "file_id": _sent_file_id(sent[0]), "media": _sent_media_type(sent[0]),
+            "caption": caption, "parse_mode": ParseMode.MARKDOWN_V2.value}
+
+async def send_media_items(message: Message, tweet_id: str, media_items: List[Dict], caption: str,
+                           keyboard: Optional[InlineKeyboardMarkup], artifact: Artifact) -> tuple[Optional[int], List[Dict], bool]:
+    """
+    إرسال وسائط التغريدة خطوة بخطوة: بالرابط أولًا (يجلبه تيليجرام)، ثم relay (بدون قرص)، ثم القرص عند الحاجة.
+    يعيد (معرف آخر رسالة، تخطيط الكاش، هل أُرسلت كل العناصر).
+    """
+    last_sent_id: Optional[int] = None
+    layout: List[Dict] = []
+    complete = True
+    for index, (kind, items) in enumerate(_media_steps(media_items)):
+        step_caption = caption if kind == "video" or index == 0 else None
+        sent, path = None, "url"
+        if config.URL_PASSTHROUGH and _url_eligible(kind, items):
+            sent = await _send_step_url(message, kind, items, step_caption, keyboard)
+        if sent is None and config.RELAY_MODE:
+            sent, path = await _send_step_relay(message, kind, items, step_caption, keyboard), "relay"
+        if sent is None:
+            path = "disk"
+            sent, copy_step, copied_id, step_complete = await _send_step_disk(message, tweet_id, kind, items, step_caption, keyboard, artifact)
+            complete = complete and step_complete
+            if copy_step:
+                metrics.inc("media_items_sent_total", len(items), kind=kind, path="pyrogram")
+                _track_usage("pyrogram", items=len(items))
+                layout.append(copy_step)
+                last_sent_id = copied_id
+                continue
+        if not sent:
+            continue
+        metrics.inc("media_items_sent_total", len(sent), kind=kind, path=path)
+        _track_usage(path, items=len(sent))
+        last_sent_id = sent[-1].message_id
+        layout.append(_layout_step(kind, sent, step_caption))
+        if kind == "album" and keyboard:
+            # PATCH: ضمان ظهور الكيبورد حتى لو فشل التعديل
+            await ensure_reply_markup(message.bot, sent[-1], keyboard)
+    return last_sent_id, layout, complete
+
+# --- Tweet classification (probe-first) ---
+# تغريدات أكّد yt-dlp أنها بلا فيديو (نتيجة سلبية مخزنة)
+_no_video_cache = TTLCache(config.METADATA_CACHE_SIZE, config.NO_VIDEO_CACHE_TTL)
+
+def classify_tweet(tweet_data: Optional[dict]) -> str:
+    """video / photo / text حسب media_extended، أو unknown إذا تعذّر جلب البيانات."""
+    if not tweet_data:
+        return "unknown"
+    types_ = {item.get("type") for item in tweet_data.get("media_extended") or []}
+    if types_ & {"video", "gif"}:
+        return "video"
+    if "image" in types_:
+        return "photo"
+    return "text"
+
+def _should_run_ytdlp(tweet_id: str, kind: str) -> bool:
+    # unknown: الـ API فشل، نجرب yt-dlp كما في السابق إلا إذا عرفنا مسبقًا أنها بلا فيديو
+    return kind == "video" or (kind == "unknown" and tweet_id not in _no_video_cache)
+
+async def _extract_video(tweet_id: str, out_dir: Path) -> tuple[Optional[Path], Optional[VideoInfo]]:
+    """yt-dlp ثم تجهيز الفيديو (faststart يعدل الملف نفسه، فيسبق أي رفع)."""
+    async with ytdlp_slots:
+        with metrics.timer("ytdlp"):
+            result = await ytdlp_download_tweet_video(tweet_id, out_dir)
+    if result.error == extractor.NO_VIDEO:
+        _no_video_cache.set(tweet_id, True)
+    if not result.path:
+        return None, None
+    # الأبعاد والمدة والصورة المصغرة قبل الرفع
+    return result.path, await prepare_video(result.path)
+
+# الملفات المحلية الجارية لكل تغريدة (مشتركة بين المحادثات، تُحذف مع آخر مستهلك)
+_artifacts = ArtifactRegistry(config.OUTPUT_DIR)
+metrics.register_gauge("artifacts_active", lambda: len(_artifacts))
+
+async def process_single_tweet(message: Message, tweet_id: str, settings: Dict):
+    usage = {"paths": [], "items": 0, "bytes": 0}
+    token = _usage.set(usage)
+    try:
+        await _process_single_tweet(message, tweet_id, settings)
+    finally:
+        _usage.reset(token)
+        record_usage(message.from_user.id if message.from_user else None, message.chat.id, tweet_id,
+                     usage["paths"], usage["items"], usage["bytes"])
+
+async def _process_single_tweet(message: Message, tweet_id: str, settings: Dict):
     try:
-        video_path = await ytdlp_download_tweet_video(tweet_id, temp_dir)
+        cached = await get_cached_media(tweet_id)
+    except Exception as e:
+        logger.warning("Media cache lookup failed for %s: %s", tweet_id, e)
+        cached = None
+    if cached and await send_from_cache(message, tweet_id, cached, settings):
+        return
+
+    last_sent_id: Optional[int] = None
+    # تخطيط الإرسال (file_ids) لحفظه في الكاش بعد النجاح
+    layout: List[Dict] = []
+    
+    # مجلد التغريدة مشترك مع الطلبات المتزامنة عليها (يُحذف مع آخر مستهلك)،
+    # ويُنشأ فقط عند الحاجة (yt-dlp أو مسار القرص الاحتياطي)
+    async with _artifacts.use(tweet_id) as artifact:
+        # تصنيف مبدئي من بيانات vxtwitter (مخزنة) لتفادي تشغيل yt-dlp على تغريدات الصور والنصوص
+        tweet_data = await scrape_media(tweet_id)
+        video_path = info = None
+        if _should_run_ytdlp(tweet_id, classify_tweet(tweet_data)):
+            # تشغيل واحد لكل التغريدة حتى لو طلبتها عدة محادثات في نفس الوقت
+            video_path, info = await artifact.once("ytdlp", lambda: _extract_video(tweet_id, artifact.dir))
         if video_path:
             tweet_url = f"https://x.com/i/status/{tweet_id}"
             # PATCH: لتفادي اختلافات Markdown بين البوت و Pyrogram، نخلي الكابتشن بسيط بدون تنسيق
             caption_plain = _trim_caption(f"🐦 فيديو من تويتر: {tweet_url}")
             keyboard = create_inline_keyboard({"tweetURL": tweet_url, "id": tweet_id}, user_msg_id=message.message_id)
-            if video_path.stat().st_size > config.MAX_FILE_SIZE:
-                await send_large_file_pyro(video_path, caption_plain, "MarkdownV2", keyboard)
-                last_sent_message = await message.reply("✅ تم رفع الفيديو بنجاح للقناة.", reply_markup=keyboard)
+            video_size = await fsio.file_size(video_path)
+            if video_size > config.MAX_FILE_SIZE:
+                delivered = await deliver_large_video(message, video_path, caption_plain, keyboard, info, artifact)
+                if not delivered:
+                    return
+                step, last_sent_id = delivered
+                layout.append(step)
+                _track_usage("pyrogram", items=1, nbytes=video_size)
             else:
-                last_sent_message = await message.reply_video(FSInputFile(video_path), caption=caption_plain, reply_markup=keyboard)
+                async with upload_slots:
+                    with metrics.timer("upload"):
+                        sent = await message.reply_video(FSInputFile(video_path), caption=caption_plain, reply_markup=keyboard,
+                                                         **info.bot_kwargs())
+                last_sent_id = sent.message_id
+                _track_usage("ytdlp", items=1, nbytes=video_size)
+                layout.append({"type": "video", "file_id": _sent_file_id(sent), "media": _sent_media_type(sent),
+                               "caption": caption_plain, "parse_mode": None})
             
-            # Since yt-dlp doesn't reliably fetch text, we will fetch it now if needed.
-            if settings.get("send_text"):
-                tweet_data = await scrape_media(tweet_id)
-                if tweet_data: await send_tweet_text_reply(message, last_sent_message, tweet_data)
+            # yt-dlp doesn't reliably fetch text; use the metadata fetched above.
+            tweet_text = (tweet_data.get("text") or "") if tweet_data else None
+            if tweet_data and settings.get("send_text"):
+                await send_tweet_text_reply(message, last_sent_id, tweet_data)
+            await _remember_layout(tweet_id, layout, tweet_text)
             return
 
-        tweet_data = await scrape_media(tweet_id)
         if not tweet_data or not tweet_data.get("media_extended"):
             await message.reply(f"لم أتمكن من العثور على وسائط للتغريدة:\nhttps://x.com/i/status/{tweet_id}")
             return
@@ -377,187 +870,279 @@ async def process_single_tweet(message: Message, tweet_id: str, settings: Dict):
         caption = format_caption(tweet_data)
         keyboard = create_inline_keyboard(tweet_data, user_msg_id=message.message_id)
 
-        media_items = tweet_data.get("media_extended", [])
-        session = _get_session()
-
-        # PATCH: جهّز مسارات فريدة لكل عنصر واربطها بالعنصر نفسه
-        download_plan = []
-        for item in media_items:
-            url = item.get('url')
-            if not url:
-                continue
-            target_path = _unique_media_path(temp_dir, url)
-            item['_local_path'] = target_path  # اربط المسار بالعُنصر
-            download_plan.append((url, target_path))
-
-        # نزّل بالتوازي مع retries
-        tasks = [download_media(session, url, path) for url, path in download_plan]
-        results = await asyncio.gather(*tasks)
-
-        photos, videos = [], []
-        for item, ok in zip(media_items, results):
-            if not ok:
-                continue
-            path = item['_local_path']
-            mtype = item.get('type')
-            if mtype == 'image':
-                photos.append(path)
-            elif mtype in ('video', 'gif'):
-                videos.append(path)
-        
-        if photos:
-            photo_groups = [photos[i:i + 5] for i in range(0, len(photos), 5)]
-            for i, group in enumerate(photo_groups):
-                media_group = [
-                    InputMediaPhoto(
-                        media=FSInputFile(p),
-                        caption=caption if i == 0 else None,
-                        parse_mode=ParseMode.MARKDOWN_V2
-                    ) for p in group
-                ]
-                if not media_group: continue
-                sent_messages = await message.reply_media_group(media_group)
-                last_sent_message = sent_messages[-1]
-                if keyboard:
-                    # PATCH: ضمان ظهور الكيبورد حتى لو فشل التعديل
-                    await ensure_reply_markup(bot, last_sent_message, keyboard)
-        
-        for video_path in videos:
-            # سنستخدم نفس caption_plain لتفادي مشاكل V2 على الفيديوهات الفردية؟ هنا نحن عبر Bot API، فيعمل V2.
-            # لكن caption من format_caption فيه تنسيق V2، استخدمه هنا.
-            if video_path.stat().st_size > config.MAX_FILE_SIZE:
-                caption_plain = _trim_caption(f"🐦 فيديو من تويتر: https://x.com/i/status/{tweet_id}")
-                await send_large_file_pyro(video_path, caption_plain, "MarkdownV2", keyboard)
-                last_sent_message = await message.reply("✅ تم رفع الفيديو بنجاح للقناة.", reply_markup=keyboard)
-            else:
-                last_sent_message = await message.reply_video(FSInputFile(video_path), caption=caption, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=keyboard)
+        media_items = [item for item in tweet_data.get("media_extended", []) if item.get("url")]
+        last_sent_id, layout, complete = await send_media_items(message, tweet_id, media_items, caption, keyboard, artifact)
 
-        if last_sent_message and settings.get("send_text"):
-            await send_tweet_text_reply(message, last_sent_message, tweet_data)
+        if last_sent_id and settings.get("send_text"):
+            await send_tweet_text_reply(message, last_sent_id, tweet_data)
 
-    finally:
-        if temp_dir.exists(): shutil.rmtree(temp_dir, ignore_errors=True)
+        # لا نخزن إلا إذا أُرسلت كل العناصر بنجاح
+        if complete and len(media_items) == len(tweet_data.get("media_extended", [])):
+            await _remember_layout(tweet_id, layout, tweet_data.get("text") or "")
 
 # --- Safe edit wrappers (CRUCIAL) ---
-def _should_edit_now(chat_id: int) -> bool:
-    """ديبونس: لا نسمح بأكثر من تعديل كل EDIT_MIN_INTERVAL_SECONDS للمحادثة."""
-    import time
-    now = time.monotonic()
-    last = _LAST_EDIT_AT.get(chat_id, 0.0)
-    if now - last >= EDIT_MIN_INTERVAL_SECONDS:
-        _LAST_EDIT_AT[chat_id] = now
-        return True
-    return False
-
-async def _rate_gate(chat_id: int):
-    """بوابة محدِّد المعدل. تستخدم aiolimiter إن وجد، وإلا تعتمد على الديبونس فقط."""
-    if _HAS_AIOLIMITER and _chat_limiters is not None:
-        async with _chat_limiters[chat_id]:
-            return
-    # بدون aiolimiter، ننتظر حتى يسمح الديبونس بتعديل جديد
-    while not _should_edit_now(chat_id):
-        await asyncio.sleep(0.3)
-
-async def safe_edit_text(progress_msg: Message, text: str, *, parse_mode: ParseMode, source_msg_for_fallback: Optional[Message] = None) -> Message:
+async def safe_edit_text(progress_msg: Message, text: str, *, parse_mode: ParseMode, source_msg_for_fallback: Optional[Message] = None,
+                         final: bool = False) -> Message:
     """
     يحرر نص الرسالة بأمان:
-    - يحترم محدد المعدل (rate gate)
-    - يحترم TelegramRetryAfter
+    - حدود المعدل و TelegramRetryAfter في SendRateLimiter (التعديل المتأخر يُسقط ولا يعطل الوسائط)
+    - final: الحالة النهائية (اكتمال/خطأ) لا تُسقط أبدًا
     - يتعامل مع 'message is not modified' بإنشاء رسالة جديدة عند الحاجة
     يعيد مؤشر Message (قد يتغير لو أنشأنا رسالة بديلة).
     """
-    chat_id = progress_msg.chat.id
+    state = chat_states.get(progress_msg.chat.id)
     # اختصار: لا تعدّل لو النص السابق مطابق
-    if _LAST_PROGRESS_TEXT.get(chat_id) == text:
+    if state.progress_text == text:
         return progress_msg
-    await _rate_gate(chat_id)
     try:
-        await progress_msg.edit_text(text, parse_mode=parse_mode)
-        _LAST_PROGRESS_TEXT[chat_id] = text
+        with progress_edit(not final):
+            result = await progress_msg.edit_text(text, parse_mode=parse_mode)
+        # التعديل المُسقط لم يصل: لا يُسجل كنص حالي حتى لا يُتخطى تعديل لاحق بنفس النص
+        if result is not EDIT_DROPPED:
+            state.progress_text = text
         return progress_msg
-    except TelegramRetryAfter as e:
-        await asyncio.sleep(e.retry_after)
-        try:
-            await progress_msg.edit_text(text, parse_mode=parse_mode)
-            _LAST_PROGRESS_TEXT[chat_id] = text
-            return progress_msg
-        except TelegramBadRequest as e2:
-            # fallback لنص مطابق/رسالة غير قابلة للتحرير
-            if "message is not modified" in (e2.message or "").lower():
-                _LAST_PROGRESS_TEXT[chat_id] = text
-                return progress_msg
-            # لو فشل التحرير (تم حذفه/قديم)، ننشئ رسالة جديدة لو توفر مصدر
-            if source_msg_for_fallback is not None:
-                new_msg = await source_msg_for_fallback.reply(text, parse_mode=parse_mode)
-                _LAST_PROGRESS_TEXT[chat_id] = text
-                return new_msg
-            raise
     except TelegramBadRequest as e:
         if "message is not modified" in (e.message or "").lower():
-            _LAST_PROGRESS_TEXT[chat_id] = text
+            state.progress_text = text
             return progress_msg
         # fallback: رسالة جديدة عند تعذّر التحرير (مثلاً الرسالة أصبحت قديمة جداً)
         if source_msg_for_fallback is not None:
             new_msg = await source_msg_for_fallback.reply(text, parse_mode=parse_mode)
-            _LAST_PROGRESS_TEXT[chat_id] = text
+            state.progress_text = text
             return new_msg
         raise
 
 # --- Queue and Handler Logic with Fixes ---
-async def process_chat_queue(chat_id: int, bot: Bot):
-    queue = chat_queues.get(chat_id)
-    if not queue: active_workers.discard(chat_id); return
-    while not queue.empty():
-        message, tweet_ids, progress_msg = await queue.get()
-        settings = await get_user_settings(message.from_user.id)
+# مهام خلفية قصيرة (حذف رسالة التقدم بعد مهلة) حتى لا يبقى العامل محجوزًا أثناء الانتظار
+_background_tasks: set[asyncio.Task] = set()
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def _finish_job(message: Message, progress_msg: Message, settings: Dict):
+    await asyncio.sleep(5)
+    try:
+        await progress_msg.delete()
+    except Exception:
+        pass
+    if settings.get("delete_original"):
+        try: await message.delete()
+        except Exception: pass
+
+# --- Lookahead (تجهيز الروابط التالية في نفس الرسالة) ---
+async def _prefetch_tweet(tweet_id: str, release: asyncio.Event):
+    """
+    تجهيز تغريدة قادمة بدون أي إرسال: كاش file_ids، بيانات vxtwitter، وفيديو yt-dlp في مجلدها المشترك.
+    يبقى مرجع المجلد محجوزًا حتى release، أي حتى ينتهي process_single_tweet من نفس التغريدة ويستلم الملف.
+    yt-dlp هنا يستخدم السعة الخاملة فقط: طابور ytdlp_slots (FIFO) لا يُملأ بروابط تخمينية
+    قبل الروابط الحالية لمحادثات أخرى (عدالة FairScheduler).
+    """
+    async with _artifacts.use(tweet_id) as artifact:
+        try:
+            result = "ok"
+            if not await get_cached_media(tweet_id):
+                tweet_data = await scrape_media(tweet_id)
+                if _should_run_ytdlp(tweet_id, classify_tweet(tweet_data)):
+                    if prefetch_slots.locked() or ytdlp_slots.locked():
+                        # لا مقعد خامل: التغريدة تُستخرج في دورها كالمعتاد
+                        result = "skipped"
+                    else:
+                        async with prefetch_slots:
+                            await artifact.once("ytdlp", lambda: _extract_video(tweet_id, artifact.dir))
+            metrics.inc("prefetch_total", result=result)
+        except Exception as e:
+            # نفس الخطأ سيظهر (ويُسجل) عند معالجة التغريدة في دورها
+            metrics.inc("prefetch_total", result="error")
+            logger.debug("Prefetch failed for %s: %s", tweet_id, e)
+        await release.wait()
+
+class _Lookahead:
+    """
+    نافذة محدودة من التجهيز المسبق لروابط الرسالة: أثناء معالجة الرابط N تُجهز N+1..N+k.
+    الإرسال نفسه يبقى تسلسليًا، فتصل النتائج بترتيب الروابط مهما انتهى التجهيز.
+    """
+    def __init__(self, tweet_ids: List[str], size: int):
+        self._tweet_ids = tweet_ids
+        self._size = size
+        self._pending: Dict[int, tuple[asyncio.Task, asyncio.Event]] = {}
+
+    def advance(self, index: int):
+        """بدء تجهيز ما بعد index (0-based) ضمن النافذة."""
+        for ahead in range(index + 1, min(index + 1 + self._size, len(self._tweet_ids))):
+            if ahead not in self._pending:
+                release = asyncio.Event()
+                self._pending[ahead] = (_spawn(_prefetch_tweet(self._tweet_ids[ahead], release)), release)
+
+    def done(self, index: int):
+        """انتهى الرابط index: تحرير مرجع التجهيز (المجلد يُحذف إن لم يبق مستهلك)."""
+        entry = self._pending.pop(index, None)
+        if entry:
+            entry[1].set()
+
+    def close(self):
+        # إلغاء ما لم يصله الدور (خطأ أو إيقاف)
+        for task, _release in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+
+async def process_message_job(job: tuple):
+    """
+    معالجة رسالة واحدة (عدة روابط) بالترتيب؛ يستدعيها عمال FairScheduler.
+    الروابط التالية (حتى MESSAGE_LOOKAHEAD) تُجهز في الخلفية أثناء رفع الحالي.
+    """
+    message, tweet_ids, progress_msg = job
+    settings = await get_user_settings(message.from_user.id)
+    total = len(tweet_ids)
+    lookahead = _Lookahead(tweet_ids, config.MESSAGE_LOOKAHEAD)
+    # المحادثة مثبتة طوال المهمة: حالتها لا تُزاح أثناء المعالجة
+    with chat_states.pin(message.chat.id):
         try:
-            total = len(tweet_ids)
             for i, tweet_id in enumerate(tweet_ids, 1):
+                lookahead.advance(i - 1)
                 try:
                     progress_text = (f"⏳ جاري معالجة الرابط *{escape_markdown(str(i))}* "
                                      f"من *{escape_markdown(str(total))}*")
                     # تحرير آمن يحترم Flood Control + ديبونس + fallback
-                    progress_msg = await safe_edit_text(
-                        progress_msg,
-                        progress_text,
-                        parse_mode=ParseMode.MARKDOWN_V2,
-                        source_msg_for_fallback=message
-                    )
+                    with metrics.timer("progress_edit"):
+                        progress_msg = await safe_edit_text(
+                            progress_msg,
+                            progress_text,
+                            parse_mode=ParseMode.MARKDOWN_V2,
+                            source_msg_for_fallback=message
+                        )
                     await process_single_tweet(message, tweet_id, settings)
                 except Exception as e: 
                     logger.error("Error processing tweet %s: %s", tweet_id, e)
-            done_text = f"✅ اكتملت معالجة *{escape_markdown(str(total))}* روابط\\!"
+                lookahead.done(i - 1)
+        finally:
+            lookahead.close()
+        done_text = f"✅ اكتملت معالجة *{escape_markdown(str(total))}* روابط\\!"
+        with metrics.timer("progress_edit"):
             progress_msg = await safe_edit_text(
                 progress_msg,
                 done_text,
                 parse_mode=ParseMode.MARKDOWN_V2,
-                source_msg_for_fallback=message
+                source_msg_for_fallback=message,
+                final=True
             )
-            await asyncio.sleep(5); 
+        _spawn(_finish_job(message, progress_msg, settings))
+
+def _encode_job(job: tuple) -> dict:
+    """تحويل المهمة لمستند JSON لحفظها في طابور Mongo."""
+    message, tweet_ids, progress_msg = job
+    return {
+        "message": message.model_dump(mode="json", exclude_none=True, by_alias=True),
+        "tweet_ids": tweet_ids,
+        "progress": progress_msg.model_dump(mode="json", exclude_none=True, by_alias=True),
+    }
+
+def _decode_job(doc: dict, bot: Bot) -> tuple:
+    return (
+        Message.model_validate(doc["message"], context={"bot": bot}),
+        doc["tweet_ids"],
+        Message.model_validate(doc["progress"], context={"bot": bot}),
+    )
+
+def _create_scheduler():
+    if config.QUEUE_BACKEND == "mongo":
+        from jobqueue import MongoJobQueue
+        return MongoJobQueue(process_message_job, workers=config.WORKERS, encode=_encode_job, decode=_decode_job)
+    return FairScheduler(process_message_job, workers=config.WORKERS)
+
+scheduler = _create_scheduler()
+if isinstance(scheduler, FairScheduler):
+    track_state("chat_queues", lambda: scheduler.queues)
+track_state("tco_cache", lambda: _tco_cache)
+track_state("metadata_cache", lambda: _metadata_cache)
+track_state("no_video_cache", lambda: _no_video_cache)
+metrics.register_gauge("queue_depth", lambda: scheduler.pending)
+metrics.register_gauge("active_workers", lambda: scheduler.active)
+metrics.register_gauge("output_dir_bytes", lambda: metrics.dir_size(config.OUTPUT_DIR), blocking=True)
+
+async def shutdown(timeout: float):
+    """إغلاق نظيف: إنهاء المهام الجارية والمنتظرة (حتى timeout)، ثم المهام الخلفية، ثم جلسة aiohttp."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    await scheduler.drain(timeout)
+    if _background_tasks:
+        _, pending = await asyncio.wait(set(_background_tasks), timeout=max(0.0, deadline - loop.time()))
+        for task in pending:
+            task.cancel()
+    await _close_session()
+
+async def _is_light_job(tweet_ids: List[str]) -> bool:
+    """
+    مهمة خفيفة = كل تغريداتها صور/نص فقط، حسب كاش file_id أو بيانات vxtwitter.
+    ما ليس في الكاش يُجلب قبل الجدولة بمهلة CLASSIFY_TIMEOUT: scrape_media مشترك ومخزن فالعامل يجد نفس النتيجة،
+    وما لم يصل في المهلة يُعامل كثقيل (الجلب نفسه يستمر في الخلفية ولا يُلغى).
+    """
+    unknown = [tweet_id for tweet_id in tweet_ids
+               if not peek_cached_media(tweet_id) and _metadata_cache.get(tweet_id) is None]
+    if unknown and config.CLASSIFY_TIMEOUT > 0:
+        with metrics.timer("classify"):
             try:
-                await progress_msg.delete()
-            except Exception:
-                pass
-            if settings.get("delete_original"):
-                try: await message.delete()
-                except Exception: pass
+                await asyncio.wait_for(asyncio.gather(*(scrape_media(tweet_id) for tweet_id in unknown)),
+                                       config.CLASSIFY_TIMEOUT)
+            except asyncio.TimeoutError:
+                metrics.inc("classify_timeouts_total")
+    for tweet_id in tweet_ids:
+        entry = peek_cached_media(tweet_id)
+        if entry:
+            if any(step["type"] != "album" for step in entry["layout"]):
+                return False
+            continue
+        data = _metadata_cache.get(tweet_id)
+        if data is None or data is _NO_DATA or classify_tweet(data) not in ("photo", "text"):
+            return False
+    return True
+
+class _ArrivalOrder:
+    """
+    دخول طابور المحادثة بترتيب وصول رسائلها: الاستخراج والتصنيف (انتظار الشبكة) يتمان بالتوازي،
+    وكل رسالة تنتظر سابقتها في نفس المحادثة قبل submit فقط.
+    """
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Future] = {}
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int):
+        # التسجيل يتم عند الدخول قبل أي await، أي بترتيب وصول التحديثات
+        previous = self._tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[chat_id] = done
+
+        async def wait_turn():
+            if previous is not None:
+                await asyncio.shield(previous)
+        try:
+            yield wait_turn
         finally:
-            queue.task_done()
-    active_workers.discard(chat_id)
+            if not done.done():
+                done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+
+_arrival = _ArrivalOrder()
+track_state("arrival_order", lambda: _arrival._tails)
 
-@router.message(F.text & (F.text.contains("twitter.com") | F.text.contains("x.com") | F.text.contains("t.co")))
+@router.message(F.text, has_tweet_link)
 async def handle_twitter_links(message: types.Message, bot: Bot):
-    tweet_ids = await extract_tweet_ids(message.text)
-    if not tweet_ids: return
-    progress_msg = await message.reply(f"تم استلام *{len(tweet_ids)}* روابط", parse_mode=ParseMode.MARKDOWN_V2)
     chat_id = message.chat.id
-    if chat_id not in chat_queues: chat_queues[chat_id] = asyncio.Queue()
-    await chat_queues[chat_id].put((message, tweet_ids, progress_msg))
+    async with _arrival.slot(chat_id) as wait_turn:
+        with metrics.timer("resolve"):
+            tweet_ids = await extract_tweet_ids(message.text, message_link_candidates(message))
+        if not tweet_ids: return
+        progress_msg = await message.reply(f"تم استلام *{len(tweet_ids)}* روابط", parse_mode=ParseMode.MARKDOWN_V2)
+        # التصنيف بعد رد الاستلام: المستخدم لا ينتظر جلب البيانات
+        light = await _is_light_job(tweet_ids)
+        metrics.inc("jobs_submitted_total", kind="light" if light else "heavy")
+        await wait_turn()
+        await scheduler.submit(chat_id, (message, tweet_ids, progress_msg), light=light)
     try: await bot.set_message_reaction(chat_id, message.message_id, reaction=[ReactionTypeEmoji(emoji='👨‍💻')])
     except Exception: pass
-    if chat_id not in active_workers:
-        active_workers.add(chat_id)
-        asyncio.create_task(process_chat_queue(chat_id, bot))
 
 @router.callback_query(TweetActionCallback.filter(F.action == "delete"))
 async def handle_delete_media(callback: types.CallbackQuery, callback_data: TweetActionCallback):
@@ -0,0 +1,240 @@
+# jobqueue.py
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import config
+from db import jobs_collection, job_locks_collection
+
+logger = logging.getLogger(__name__)
+
+class MongoJobQueue:
+    """
+    طابور مهام مشترك في MongoDB بين عدة عمليات أو خوادم (بديل FairScheduler بنفس الواجهة):
+    - المهمة تُحفظ عند الاستلام، فلا تضيع إذا توقفت العملية.
+    - العامل يحجز المحادثة (job_locks) ثم أقدم مهمة فيها بعقد إيجار (lease) يُجدَّد بنبضات (heartbeat)،
+      فتبقى مهمة واحدة لكل محادثة في نفس الوقت وبترتيب الوصول.
+    - عند انتهاء الإيجار (توقف العامل) تعود المهمة لأي عامل آخر، أو لنفس العقدة بعد إعادة تشغيلها.
+    - المهام الخفيفة تُقدَّم على الثقيلة مع ضمان عدم تجويع الثقيلة.
+    """
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], workers: int,
+                 encode: Callable[[Any], dict], decode: Callable[[dict, Any], Any], heavy_every: int = 3):
+        self._handler = handler
+        self._encode = encode
+        self._decode = decode
+        self._workers_count = workers
+        self._heavy_every = heavy_every
+        self._light_streak = 0
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._accepting = True
+        self._workers: List[asyncio.Task] = []
+        self._monitor: Optional[asyncio.Task] = None
+        # محادثات محجوزة من عمال هذه العملية (القفل في Mongo لا يميز بين عمال نفس العملية)
+        self._local_chats: set[int] = set()
+        self._pending = 0
+
+    # --- Public API ---
+    def start(self, bot=None):
+        """تشغيل العمال؛ bot يُستخدم لإعادة بناء الرسائل من المهام المحفوظة."""
+        if bot is not None:
+            self._bot = bot
+        if self._workers:
+            return
+        self._accepting = True
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self._workers_count)]
+        self._monitor = asyncio.create_task(self._refresh_pending())
+        logger.info("Mongo job queue started as %s", self._owner)
+
+    async def stop(self):
+        self._accepting = False
+        tasks = [*self._workers, *([self._monitor] if self._monitor else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._monitor = [], None
+        try:
+            await job_locks_collection.delete_many({"owner": self._owner})
+        except Exception as e:
+            logger.warning("Releasing chat locks failed: %s", e)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        إيقاف حجز مهام جديدة وانتظار المهام الجارية حتى timeout.
+        المهام المنتظرة تبقى في Mongo لعقدة أخرى أو لإعادة التشغيل؛ المقطوعة تعود للطابور.
+        """
+        self._accepting = False
+        drained = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                drained = False
+                logger.warning("Job queue drain timed out with %d running jobs", self.active)
+        await self.stop()
+        return drained
+
+    async def submit(self, chat_id: int, payload: Any, light: bool = False):
+        if self._bot is None:
+            raise RuntimeError("MongoJobQueue.start(bot) must be called before submit")
+        self.start()
+        await jobs_collection.insert_one({
+            "chat_id": chat_id,
+            "light": light,
+            "status": "queued",
+            "payload": self._encode(payload),
+            "attempts": 0,
+            "owner": None,
+            "lease_until": None,
+            "created_at": datetime.utcnow(),
+        })
+        self._pending += 1
+        self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        """تقدير عدد المهام المنتظرة في كل العقد (يُحدَّث كل JOB_POLL_INTERVAL)."""
+        return self._pending
+
+    @property
+    def active(self) -> int:
+        return len(self._local_chats)
+
+    # --- Claiming ---
+    @staticmethod
+    def _claimable(now: datetime) -> dict:
+        # منتظرة، أو جارية انتهى إيجارها (عامل توقف)
+        return {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]}
+
+    async def _lock_chat(self, chat_id: int, now: datetime, lease_until: datetime) -> bool:
+        """حجز المحادثة: ينجح إذا لم يكن لها قفل أو انتهى إيجاره."""
+        try:
+            await job_locks_collection.update_one(
+                {"_id": chat_id, "lease_until": {"$lt": now}},
+                {"$set": {"owner": self._owner, "lease_until": lease_until}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            # القفل موجود وساري: محادثة يعالجها عامل آخر
+            return False
+
+    async def _unlock_chat(self, chat_id: int):
+        self._local_chats.discard(chat_id)
+        if not self._local_chats:
+            self._idle.set()
+        try:
+            await job_locks_collection.delete_one({"_id": chat_id, "owner": self._owner})
+        except Exception as e:
+            logger.warning("Releasing chat lock %s failed: %s", chat_id, e)
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=config.JOB_LEASE_SECONDS)
+        claimable = self._claimable(now)
+        prefer_heavy = self._light_streak >= self._heavy_every
+        cursor = jobs_collection.find(claimable, {"chat_id": 1}) \
+            .sort([("light", 1 if prefer_heavy else -1), ("_id", 1)]).limit(config.JOB_CLAIM_BATCH)
+        seen: set[int] = set()
+        async for candidate in cursor:
+            chat_id = candidate["chat_id"]
+            if chat_id in seen or chat_id in self._local_chats:
+                continue
+            seen.add(chat_id)
+            self._local_chats.add(chat_id)
+            self._idle.clear()
+            if not await self._lock_chat(chat_id, now, lease_until):
+                self._local_chats.discard(chat_id)
+                if not self._local_chats:
+                    self._idle.set()
+                continue
+            # أقدم مهمة في المحادثة (قد تكون غير المرشحة إذا كانت هناك مهمة أقدم مقطوعة)
+            job = await jobs_collection.find_one_and_update(
+                {"chat_id": chat_id, **claimable},
+                {"$set": {"status": "running", "owner": self._owner, "lease_until": lease_until},
+                 "$inc": {"attempts": 1}},
+                sort=[("_id", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if job is None:
+                await self._unlock_chat(chat_id)
+                continue
+            self._light_streak = self._light_streak + 1 if job.get("light") else 0
+            return job
+        return None
+
+    # --- Execution ---
+    async def _heartbeat(self, job_id, chat_id: int):
+        while True:
+            await asyncio.sleep(config.JOB_LEASE_SECONDS / 3)
+            lease_until = datetime.utcnow() + timedelta(seconds=config.JOB_LEASE_SECONDS)
+            try:
+                await jobs_collection.update_one({"_id": job_id, "owner": self._owner}, {"$set": {"lease_until": lease_until}})
+                await job_locks_collection.update_one({"_id": chat_id, "owner": self._owner}, {"$set": {"lease_until": lease_until}})
+            except Exception as e:
+                logger.warning("Heartbeat for job %s failed: %s", job_id, e)
+
+    async def _run(self, job: dict):
+        chat_id = job["chat_id"]
+        heartbeat = asyncio.create_task(self._heartbeat(job["_id"], chat_id))
+        try:
+            if job["attempts"] > config.JOB_MAX_ATTEMPTS:
+                # مهمة أوقفت العامل أكثر من مرة: لا نعيدها بلا نهاية
+                logger.error("Job %s on chat %s exceeded %d attempts, giving up", job["_id"], chat_id, config.JOB_MAX_ATTEMPTS)
+                await jobs_collection.update_one({"_id": job["_id"]}, {"$set": {
+                    "status": "failed", "expire_at": datetime.utcnow() + timedelta(days=1)}})
+                return
+            try:
+                await self._handler(self._decode(job["payload"], self._bot))
+            except asyncio.CancelledError:
+                # إيقاف العقدة أثناء المهمة: تعود للطابور فورًا (لا تُحتسب كمحاولة)
+                await jobs_collection.update_one(
+                    {"_id": job["_id"], "owner": self._owner},
+                    {"$set": {"status": "queued", "owner": None, "lease_until": None}, "$inc": {"attempts": -1}},
+                )
+                raise
+            except Exception as e:
+                logger.error("Job %s failed on chat %s: %s", job["_id"], chat_id, e)
+            await jobs_collection.delete_one({"_id": job["_id"], "owner": self._owner})
+        finally:
+            heartbeat.cancel()
+            await self._unlock_chat(chat_id)
+
+    async def _worker(self, index: int):
+        while self._accepting:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Worker %d could not claim a job: %s", index, e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), config.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _refresh_pending(self):
+        while True:
+            try:
+                self._pending = await jobs_collection.count_documents({"status": "queued"})
+            except Exception as e:
+                logger.debug("Pending jobs count failed: %s", e)
+            await asyncio.sleep(config.JOB_POLL_INTERVAL)
@@ -1,32 +1,178 @@
 # main.py
 import asyncio
 import logging
+import signal
 import sys
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 import config
-from handlers import general, admin, twitter
+import extractor
+import fsio
+import metrics
+import userbot
+from db import close_db, ensure_indexes, init_db, watch_settings_changes, write_behind
+from ratelimit import SendRateLimiter, send_scheduler
+from handlers import general, admin, inline, twitter
+from utils import UpdateLimiter
 
-async def main():
-    # Logging
-    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    
-    # Bot and Dispatcher setup
-    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-    dp = Dispatcher()
+def create_bot() -> Bot:
+    """البوت مع خادم Bot API المحدد في TELEGRAM_API_BASE (إن وُجد)."""
+    session = None
+    if config.TELEGRAM_API_BASE:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_BASE))
+    bot = Bot(token=config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
+    # كل الإرسالات والتعديلات تمر بمجدول واحد يحترم حدود تيليجرام ويعالج RetryAfter
+    bot.session.middleware(SendRateLimiter(send_scheduler, config.SEND_MAX_RETRIES))
+    return bot
+
+async def _mark_first_update(handler, event, data):
+    """قياس زمن البدء حتى أول تحديث مكتمل المعالجة (startup_seconds{stage="first_update"})."""
+    try:
+        return await handler(event, data)
+    finally:
+        metrics.mark_startup("first_update")
 
-    # Include routers
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher بكل الراوترات (يُستخدم أيضًا في bench/loadtest.py)."""
+    dp = Dispatcher()
+    # حد التحديثات المتزامنة (متاح لاحقًا عبر dp["update_limiter"] لانتظارها عند الإيقاف)
+    dp["update_limiter"] = UpdateLimiter(config.UPDATE_CONCURRENCY)
+    dp.update.outer_middleware(dp["update_limiter"])
+    dp.update.outer_middleware(_mark_first_update)
     dp.include_router(general.router)
     dp.include_router(admin.router)
     dp.include_router(twitter.router)
+    dp.include_router(inline.router)
+    return dp
 
-    # Start polling
-    await bot.delete_webhook(drop_pending_updates=True)
+async def run_polling(bot: Bot, dp: Dispatcher):
+    await bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
     print("Bot is starting polling...")
-    await dp.start_polling(bot)
+    # الجلسة تبقى مفتوحة بعد توقف الاستقبال حتى ننهي العمل الجاري
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), close_bot_session=False)
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """خادم aiohttp يستقبل التحديثات؛ يتوقف عن الاستقبال عند SIGINT/SIGTERM."""
+    app = web.Application()
+    # handle_in_background: نرد على تيليجرام فورًا والمعالجة تتم في مهمة (محدودة بـ UpdateLimiter)
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=config.WEBHOOK_SECRET, handle_in_background=True)
+    # المسار فقط بدل register(): register يغلق جلسة البوت عند إيقاف التطبيق، وإغلاقها يتم في main بعد إنهاء العمل الجاري
+    app.router.add_route("POST", config.WEBHOOK_PATH, handler.handle)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await bot.set_webhook(
+            f"{config.WEBHOOK_URL}{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET,
+            drop_pending_updates=config.DROP_PENDING_UPDATES,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        )
+        print(f"Bot is serving webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}...")
+        await stop.wait()
+    finally:
+        # لا نحذف الـ webhook: تيليجرام يحتفظ بالتحديثات حتى نعود
+        # نتوقف عن الاستقبال فقط؛ إنهاء المهام الجارية وإغلاق الجلسات في main
+        await site.stop()
+        await runner.cleanup()
+
+async def run_worker():
+    """عقدة عمال فقط (QUEUE_BACKEND=mongo): تعالج الطابور المشترك بدون استقبال تحديثات."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print("Bot is running as a queue worker...")
+    await stop.wait()
+
+async def startup(bot: Bot) -> Optional[web.AppRunner]:
+    """
+    تهيئة ما يحتاج حلقة الأحداث أو القرص أو الشبكة (بدل تنفيذه عند الاستيراد).
+    التبعيات الثقيلة (pyrogram، yt-dlp) تُحمّل لاحقًا في on_ready بعد بدء الاستقبال.
+    """
+    await fsio.mkdir(config.OUTPUT_DIR)
+    # عمل متزامن يحجز حلقة الأحداث يظهر كتأخر (event_loop_lag_seconds)
+    if config.LOOP_LAG_INTERVAL:
+        asyncio.create_task(metrics.monitor_loop_lag(config.LOOP_LAG_INTERVAL))
+
+    # Mongo client + indexes (TTL for media cache, job queue, usage events)
+    init_db()
+    await ensure_indexes()
+    # Batched user upserts / usage events (bulk_write on size or time)
+    write_behind.start()
+
+    # Multi-process setups: invalidate cached settings from a change stream
+    if config.SETTINGS_CHANGE_STREAM:
+        asyncio.create_task(watch_settings_changes())
+
+    # Local Prometheus endpoint (/metrics)
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_http_server(config.METRICS_HOST, config.METRICS_PORT)
+
+    # Shared Mongo queue: start workers now to resume jobs left by stopped nodes
+    if config.QUEUE_BACKEND == "mongo":
+        twitter.scheduler.start(bot)
+    return metrics_runner
+
+async def on_ready():
+    """البوت جاهز لاستقبال التحديثات: نسجل زمن البدء ثم نسخّن التبعيات الثقيلة في الخلفية."""
+    metrics.mark_startup("ready")
+    # Shared Pyrogram client for large uploads (import + handshake, reused by all uploads)
+    asyncio.create_task(userbot.warm_up())
+    # Warm yt-dlp (import + YoutubeDL) so the first tweet doesn't pay for it
+    if config.YTDLP_MODE == "inprocess":
+        asyncio.create_task(extractor.warm_up())
+
+async def main():
+    # Logging
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    metrics.mark_startup("imports")
+    config.validate()
+
+    # Bot and Dispatcher setup
+    bot = create_bot()
+    dp = create_dispatcher()
+    dp.startup.register(on_ready)
+    metrics_runner = await startup(bot)
+
+    try:
+        if config.BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        elif config.BOT_MODE == "worker":
+            await on_ready()
+            await run_worker()
+        else:
+            await run_polling(bot, dp)
+    finally:
+        # إنهاء التحديثات والمهام الجارية قبل إغلاق الجلسات والاتصالات
+        await dp["update_limiter"].drain(config.SHUTDOWN_GRACE)
+        await twitter.shutdown(config.SHUTDOWN_GRACE)
+        # حذف مجلدات التغريدات المؤجل (fsio.remove_later)
+        await fsio.drain(config.SHUTDOWN_GRACE)
+        await bot.session.close()
+        await userbot.stop_userbot()
+        extractor.shutdown()
+        await write_behind.stop()
+        close_db()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,239 @@
+# metrics.py
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "xbot_"
+# حدود الهيستوغرام بالثواني (من عشرات الملي ثانية حتى رفع فيديو كبير)
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# --- In-process counters ---
+# المفتاح: (اسم العداد، الوسوم مرتبة) مثل ("media_items_sent_total", (("path", "url"),))
+_counters: Dict[Tuple[str, tuple], float] = defaultdict(float)
+_gauges: Dict[Tuple[str, tuple], float] = defaultdict(float)
+_gauge_callbacks: Dict[str, Callable[[], float]] = {}
+# مقاييس تقرأ القرص: تُحسب في خيط، والبقية على حلقة الأحداث لأنها تقرأ حالة تملكها الحلقة
+_blocking_gauges: Set[str] = set()
+_histograms: Dict[Tuple[str, tuple], "_Histogram"] = {}
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    _counters[_key(name, labels)] += value
+
+def counter_value(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+def counters() -> Dict[Tuple[str, tuple], float]:
+    return dict(_counters)
+
+# --- Gauges ---
+def gauge_add(name: str, value: float, **labels):
+    """تعديل مقياس لحظي (مثل عدد التنزيلات الجارية)."""
+    _gauges[_key(name, labels)] += value
+
+def register_gauge(name: str, callback: Callable[[], float], blocking: bool = False):
+    """مقياس يُحسب عند القراءة (مثل طول الطابور)؛ blocking للمقاييس التي تقرأ القرص (حجم OUTPUT_DIR)."""
+    _gauge_callbacks[name] = callback
+    if blocking:
+        _blocking_gauges.add(name)
+
+async def _callback_values() -> Dict[str, float]:
+    values = {}
+    for name, callback in _gauge_callbacks.items():
+        try:
+            values[name] = float(await asyncio.to_thread(callback) if name in _blocking_gauges else callback())
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", name, e)
+    return values
+
+async def gauges() -> Dict[str, float]:
+    values = {name + _format_labels(labels): value for (name, labels), value in _gauges.items()}
+    values.update(await _callback_values())
+    return values
+
+# --- Histograms ---
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """تقدير تقريبي: الحد الأعلى للخانة التي يقع فيها الترتيب المطلوب."""
+        if not self.count:
+            return None
+        rank, cumulative = q * self.count, 0
+        for bound, n in zip((*BUCKETS, float("inf")), self.buckets):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = _Histogram()
+    hist.observe(value)
+
+@contextmanager
+def timer(stage: str):
+    """قياس زمن مرحلة في خط المعالجة ضمن stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+def stage_summary() -> List[Tuple[str, int, Optional[float], Optional[float], float]]:
+    """(المرحلة، العدد، p50، p95، المتوسط) لكل مرحلة مقاسة."""
+    rows = []
+    for (name, labels), hist in sorted(_histograms.items()):
+        if name != "stage_seconds":
+            continue
+        stage = dict(labels)["stage"]
+        mean = hist.sum / hist.count if hist.count else 0.0
+        rows.append((stage, hist.count, hist.quantile(0.5), hist.quantile(0.95), mean))
+    return rows
+
+# --- Startup timing ---
+_IMPORTED_AT = time.monotonic()
+_startup: Dict[str, float] = {}
+
+def process_uptime() -> float:
+    """الثواني منذ إطلاق العملية (من /proc في لينكس، وإلا منذ استيراد metrics)."""
+    try:
+        with open("/proc/self/stat") as f:
+            # الحقل 22 (starttime) بعد اسم العملية المحاط بأقواس
+            start_ticks = float(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED_AT
+
+def mark_startup(stage: str):
+    """تسجيل زمن الوصول لمرحلة بدء التشغيل (مرة واحدة لكل مرحلة) في startup_seconds{stage=...}."""
+    if stage in _startup:
+        return
+    _startup[stage] = process_uptime()
+    gauge_add("startup_seconds", _startup[stage], stage=stage)
+    logger.info("Startup: %s after %.3fs", stage, _startup[stage])
+
+def startup_timings() -> Dict[str, float]:
+    return dict(_startup)
+
+# --- Event loop lag ---
+# آخر العينات (تكفي لـ p99 تقريبي على بضع دقائق)
+_loop_lag: deque = deque(maxlen=1200)
+
+async def monitor_loop_lag(interval: float):
+    """
+    تأخر حلقة الأحداث: الفرق بين موعد الاستيقاظ المتوقع والفعلي.
+    أي عمل متزامن (قرص، تحليل JSON كبير...) يؤخر كل المحادثات بنفس القدر ويظهر هنا.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        _loop_lag.append(lag)
+        observe("event_loop_lag_seconds", lag)
+
+def loop_lag_summary() -> Optional[Tuple[float, float, float]]:
+    """(p50، p99، الأقصى) بالثواني من العينات الأخيرة، أو None قبل أول قياس."""
+    if not _loop_lag:
+        return None
+    samples = sorted(_loop_lag)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))], samples[-1]
+
+register_gauge("event_loop_lag_p99_seconds", lambda: (loop_lag_summary() or (0, 0, 0))[1])
+
+# --- Helpers ---
+def process_rss() -> int:
+    """الذاكرة المقيمة الحالية بالبايت (من /proc في لينكس، وإلا 0)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+register_gauge("process_rss_bytes", process_rss)
+
+def dir_size(path: Path) -> int:
+    """حجم المجلد بالبايت (يُستدعى خارج حلقة الأحداث)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+# --- Prometheus exposition ---
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = (*labels, *extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render_prometheus(callback_values: Dict[str, float]) -> str:
+    lines = []
+    seen_types = set()
+
+    def type_line(name: str, kind: str):
+        if name not in seen_types:
+            seen_types.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        type_line(name, "counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        type_line(name, "gauge")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for name, value in sorted(callback_values.items()):
+        type_line(name, "gauge")
+        lines.append(f"{PREFIX}{name} {value}")
+    for (name, labels), hist in sorted(_histograms.items()):
+        type_line(name, "histogram")
+        cumulative = 0
+        for bound, n in zip((*BUCKETS, "+Inf"), hist.buckets):
+            cumulative += n
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {hist.sum}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+async def start_http_server(host: str, port: int):
+    """خادم محلي يعرض /metrics بصيغة Prometheus. يعيد runner لإيقافه عند الإغلاق."""
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        # على حلقة الأحداث (العدادات تتغير عليها)؛ فقط المقاييس التي تقرأ القرص تُحسب في خيط
+        body = render_prometheus(await _callback_values())
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return runner
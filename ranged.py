@@ -0,0 +1,101 @@
+# ranged.py
+import asyncio
+import logging
+import re
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+import fsio
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+_CHUNK = 64 * 1024
+_BACKOFFS = (0, 1, 2, 4)
+
+def probe_range(response: aiohttp.ClientResponse) -> Optional[tuple[int, int]]:
+    """
+    (نهاية الجزء الأول، الحجم الكلي) من رد 206 على طلب bytes=0-...،
+    أو None إذا تجاهل الخادم Range (رد 200 بالملف كاملًا) أو لم يذكر الحجم.
+    """
+    if response.status != 206:
+        return None
+    match = _CONTENT_RANGE_RE.fullmatch(response.headers.get("Content-Range", ""))
+    if not match or int(match.group(1)) != 0:
+        return None
+    return int(match.group(2)), int(match.group(3))
+
+class _Part:
+    """نطاق [start, end] (شامل)؛ start يتقدم مع كل كتابة فتُستأنف المحاولة من حيث توقفت."""
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+
+    @property
+    def done(self) -> bool:
+        return self.start > self.end
+
+async def _write_body(response: aiohttp.ClientResponse, fd: int, part: _Part):
+    writer = fsio.FileWriter(fd, part.start)
+    try:
+        async for chunk in response.content.iter_chunked(_CHUNK):
+            await writer.write(chunk[:part.end - writer.position + 1])
+            if writer.position > part.end:
+                break
+    finally:
+        # ما وصل قبل انقطاع الاتصال صالح: يُكتب ويُستأنف النطاق بعده
+        await writer.flush()
+        part.start = writer.offset
+
+async def _fetch_part(session: aiohttp.ClientSession, url: str, fd: int, part: _Part, timeout: aiohttp.ClientTimeout) -> bool:
+    last_exc = None
+    for delay in _BACKOFFS:
+        if delay:
+            await asyncio.sleep(delay)
+            metrics.inc("download_range_retries_total")
+        try:
+            async with session.get(url, headers={"Range": f"bytes={part.start}-{part.end}"}, timeout=timeout) as response:
+                if response.status != 206:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                      message="Range not honoured")
+                await _write_body(response, fd, part)
+            if part.done:
+                return True
+        except Exception as e:
+            last_exc = e
+    logger.warning("Range %s-%s failed for %s: %s", part.start, part.end, url, last_exc)
+    return False
+
+async def download(session: aiohttp.ClientSession, url: str, path: Path, probe: aiohttp.ClientResponse,
+                   first_end: int, total: int, part_size: int, connections: int, timeout: aiohttp.ClientTimeout) -> bool:
+    """
+    تنزيل ملف كبير بعدة نطاقات متوازية إلى ملف محجوز مسبقًا بحجمه الكامل.
+    probe هو رد الطلب الأول (bytes=0-...) ويُكمل كأول نطاق؛ أي نطاق يفشل يُعاد وحده من آخر بايت كُتب،
+    بدل إعادة الملف كله من البداية.
+    """
+    parts = [_Part(0, first_end)] + [_Part(start, min(start + part_size, total) - 1)
+                                     for start in range(first_end + 1, total, part_size)]
+    slots = asyncio.Semaphore(connections)
+
+    async def first() -> bool:
+        async with slots:
+            try:
+                await _write_body(probe, fd, parts[0])
+            except Exception as e:
+                logger.debug("First range interrupted for %s: %s", url, e)
+            return parts[0].done or await _fetch_part(session, url, fd, parts[0], timeout)
+
+    async def rest(part: _Part) -> bool:
+        async with slots:
+            return await _fetch_part(session, url, fd, part, timeout)
+
+    async with fsio.open_for_write(path, total) as fd:
+        # first أولًا: يحجز أول مقعد لأن اتصاله مفتوح بالفعل
+        results = await asyncio.gather(first(), *(rest(part) for part in parts[1:]))
+    metrics.inc("download_ranged_total", result="ok" if all(results) else "failed")
+    return all(results)
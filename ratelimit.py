@@ -0,0 +1,283 @@
+# ratelimit.py
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Dict, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+import config
+import metrics
+from relay import StreamInputFile
+from utils import track_state
+
+logger = logging.getLogger(__name__)
+
+# أولويات الإرسال (الأصغر أولًا): الوسائط قبل النصوص، وتعديلات التقدم في الأخير
+PRIORITY_MEDIA = 0
+PRIORITY_TEXT = 1
+PRIORITY_EDIT = 2
+
+_MEDIA_METHODS = {"SendPhoto", "SendVideo", "SendAnimation", "SendDocument", "SendAudio", "SendVoice",
+                  "SendVideoNote", "SendSticker", "SendMediaGroup", "CopyMessage", "CopyMessages",
+                  "ForwardMessage", "ForwardMessages"}
+_TEXT_METHODS = {"SendMessage", "EditMessageText", "EditMessageCaption", "EditMessageReplyMarkup", "EditMessageMedia"}
+# تعديلات تجميلية (رسائل التقدم داخل progress_edit فقط): تُسقط بدل الانتظار إذا تأخرت أو جاء تعديل أحدث لنفس الرسالة.
+# أي EditMessageText آخر (تعديلات يراها المستخدم) يُجدول كنص عادي ويعيد Message دائمًا.
+_EDIT_METHODS = {"EditMessageText"}
+# ما يعيده الطلب بدل نتيجة تيليجرام عندما يُسقط تعديل التقدم: المستدعي لا يعتبره مطبقًا
+EDIT_DROPPED = object()
+_progress_edit: ContextVar[bool] = ContextVar("progress_edit", default=False)
+_FILE_FIELDS = ("photo", "video", "animation", "document", "audio", "voice", "video_note", "sticker", "thumbnail")
+
+def _priority(method: TelegramMethod) -> Optional[int]:
+    """أولوية الطلب، أو None للطلبات التي لا تخضع لحدود الإرسال (حذف، callback، getMe...)."""
+    name = type(method).__name__
+    if name in _MEDIA_METHODS:
+        return PRIORITY_MEDIA
+    if name in _EDIT_METHODS and _progress_edit.get():
+        return PRIORITY_EDIT
+    if name in _TEXT_METHODS:
+        return PRIORITY_TEXT
+    return None
+
+@contextmanager
+def progress_edit(enabled: bool = True):
+    """تعديلات النص داخل السياق (تحديثات التقدم) قابلة للإسقاط وتعيد EDIT_DROPPED عندها."""
+    token = _progress_edit.set(enabled)
+    try:
+        yield
+    finally:
+        _progress_edit.reset(token)
+
+def _media_items(method: TelegramMethod) -> list:
+    # media قائمة في الألبوم (SendMediaGroup) وعنصر واحد في EditMessageMedia
+    media = getattr(method, "media", None)
+    if media is None:
+        return []
+    return media if isinstance(media, list) else [media]
+
+def _replayable(method: TelegramMethod) -> bool:
+    """False إذا كان الطلب يرفع StreamInputFile: جسمه استُهلك في المحاولة الأولى فلا يُعاد إرساله."""
+    files = [getattr(method, field, None) for field in _FILE_FIELDS]
+    for item in _media_items(method):
+        files += [getattr(item, "media", None), getattr(item, "thumbnail", None)]
+    return not any(isinstance(f, StreamInputFile) for f in files)
+
+class TokenBucket:
+    """دلو توكنات بسيط: rate توكن/ثانية حتى capacity، مع إيقاف مؤقت عند RetryAfter."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float, reserve: float = 0.0) -> float:
+        """الثواني حتى يتوفر توكن مع إبقاء reserve توكنات لطلبات أهم."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.blocked_until - now)
+        missing = 1 + reserve - self.tokens
+        if missing > 0:
+            wait = max(wait, missing / self.rate)
+        return wait
+
+    def take(self, cost: float = 1):
+        # الألبوم قد يتجاوز السعة: يمر ويُسدَّد الدين من التوكنات القادمة
+        self.tokens -= cost
+
+    def block(self, seconds: float, now: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "chat_id", "cost", "future", "edit_key")
+
+    def __init__(self, priority: int, seq: int, chat_id: Union[int, str], cost: int, future: asyncio.Future,
+                 edit_key: Optional[tuple]):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.cost = cost
+        self.future = future
+        self.edit_key = edit_key
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class SendScheduler:
+    """
+    جدولة كل الإرسالات نحو تيليجرام بحدوده المعلنة:
+    - حد عام global_rate رسالة/ثانية للبوت كله.
+    - حد لكل محادثة: group_per_minute في المجموعات والقنوات، و private_rate/ثانية في الخاص (مع burst).
+    الطلب الجاهز الأعلى أولوية يُمرر أولًا، ومحادثة مقيدة لا تعطل باقي المحادثات.
+    تعديلات التقدم لا تستهلك آخر توكن للمحادثة (يبقى للوسائط) وتُسقط بعد edit_max_wait.
+    """
+    def __init__(self, global_rate: float, group_per_minute: float, private_rate: float, burst: float, edit_max_wait: float):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._group_rate = group_per_minute / 60
+        self._private_rate = private_rate
+        self._burst = burst
+        self._edit_max_wait = edit_max_wait
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._waiters: List[_Waiter] = []
+        # آخر تعديل تقدم منتظر لكل رسالة (chat_id, message_id)
+        self._edits: Dict[tuple, _Waiter] = {}
+        self._seq = count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.future.done())
+
+    def _bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # معرفات المجموعات والقنوات سالبة (أو @username للقنوات)
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self._private_rate if is_private else self._group_rate, self._burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def block(self, chat_id: Union[int, str], seconds: float):
+        """إيقاف المحادثة حتى ينتهي RetryAfter الذي أعاده تيليجرام."""
+        self._bucket(chat_id).block(seconds, time.monotonic())
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def acquire(self, chat_id: Union[int, str], priority: int, cost: int = 1, edit_key: Optional[tuple] = None) -> bool:
+        """
+        انتظار دور الطلب؛ False يعني أن تعديل التقدم أُسقط (أحدث منه أو تجاوز edit_max_wait).
+        edit_key يُمرر لكل تعديل نص: أي تعديل (تقدم أو نهائي) يلغي تعديل التقدم المنتظر لنفس الرسالة،
+        وتعديلات التقدم وحدها تُسجل فتُلغى لاحقًا.
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        if edit_key is not None:
+            previous = self._edits.pop(edit_key, None)
+            if previous is not None:
+                self._drop(previous, "superseded")
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq), chat_id, cost, loop.create_future(), edit_key)
+        expiry = None
+        if priority == PRIORITY_EDIT:
+            if edit_key is not None:
+                self._edits[edit_key] = waiter
+            # المهلة بمؤقت مستقل عن _grant: تحت الضغط (الحد العام ممتلئ والوسائط تسبقها) قد لا يصل إليها المسح أبدًا
+            expiry = loop.call_later(self._edit_max_wait, self._drop, waiter, "stale")
+        self._waiters.append(waiter)
+        self._wakeup.set()
+        try:
+            with metrics.timer("send_wait"):
+                return await waiter.future
+        finally:
+            if expiry is not None:
+                expiry.cancel()
+            if edit_key is not None and self._edits.get(edit_key) is waiter:
+                del self._edits[edit_key]
+
+    def _drop(self, waiter: _Waiter, reason: str):
+        if not waiter.future.done():
+            waiter.future.set_result(False)
+            metrics.inc("send_dropped_total", reason=reason)
+
+    def _grant(self, now: float) -> Optional[float]:
+        """
+        تمرير أول طلب جاهز حسب الأولوية. يعيد 0 إذا مُرر طلب،
+        أو الثواني حتى أقرب طلب قد يصبح جاهزًا، أو None إذا لا يوجد منتظرون.
+        """
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        if not self._waiters:
+            return None
+        global_wait = self._global.delay(now)
+        if global_wait > 0:
+            return global_wait
+        soonest = float("inf")
+        for waiter in sorted(self._waiters):
+            bucket = self._bucket(waiter.chat_id)
+            reserve = 1.0 if waiter.priority == PRIORITY_EDIT and bucket.capacity >= 2 else 0.0
+            wait = bucket.delay(now, reserve)
+            if wait == 0:
+                bucket.take(waiter.cost)
+                self._global.take(waiter.cost)
+                waiter.future.set_result(True)
+                return 0.0
+            soonest = min(soonest, wait)
+        return soonest if soonest != float("inf") else None
+
+    def _prune(self, now: float):
+        # دلاء المحادثات الخاملة (ممتلئة وغير موقوفة) لا تحمل أي حالة مفيدة
+        busy = {waiter.chat_id for waiter in self._waiters}
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if chat_id not in busy and bucket.idle(now)]:
+            del self._chats[chat_id]
+        self._last_prune = now
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            if now - self._last_prune > 60:
+                self._prune(now)
+            wait = self._grant(now)
+            if wait == 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+send_scheduler = SendScheduler(config.SEND_GLOBAL_RATE, config.SEND_GROUP_PER_MINUTE, config.SEND_PRIVATE_RATE,
+                               config.SEND_CHAT_BURST, config.SEND_EDIT_MAX_WAIT)
+metrics.register_gauge("send_queue_depth", lambda: send_scheduler.pending)
+# دلاء المحادثات الخاملة تُحذف في _prune
+track_state("send_buckets", lambda: send_scheduler._chats)
+
+class SendRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware لجلسة البوت: كل طلب إرسال/تعديل يمر عبر SendScheduler،
+    و TelegramRetryAfter يُعالج هنا مركزيًا (إيقاف المحادثة ثم إعادة المحاولة)
+    بدل انتظار كل دالة بمفردها.
+    """
+    def __init__(self, scheduler: SendScheduler, max_retries: int = 3):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]):
+        priority = _priority(method)
+        chat_id = getattr(method, "chat_id", None)
+        if priority is None or chat_id is None:
+            return await make_request(bot, method)
+        message_id = getattr(method, "message_id", None)
+        # أي تعديل نص يلغي تعديل التقدم المنتظر لنفس الرسالة حتى لا يُطبق بعده
+        edit_key = (chat_id, message_id) if type(method).__name__ in _EDIT_METHODS and message_id is not None else None
+        # تيليجرام يحتسب كل عنصر في الألبوم كرسالة
+        cost = len(method.media) if isinstance(getattr(method, "media", None), list) else 1
+        for attempt in range(self.max_retries + 1):
+            if not await self.scheduler.acquire(chat_id, priority, cost, edit_key):
+                # تعديل تقدم أُسقط: يحل محله تعديل أحدث أو يكون قد فات وقته
+                return EDIT_DROPPED
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.inc("send_retry_after_total", method=type(method).__name__)
+                self.scheduler.block(chat_id, e.retry_after)
+                if priority == PRIORITY_EDIT:
+                    return EDIT_DROPPED
+                if attempt == self.max_retries or not _replayable(method):
+                    # البث المباشر لا يُعاد: المستدعي يرجع لمسار القرص (والمحادثة موقوفة حتى انتهاء المهلة)
+                    raise
+                logger.info("Flood control on chat %s, retrying %s in %ss", chat_id, type(method).__name__, e.retry_after)
@@ -0,0 +1,76 @@
+# relay.py
+import logging
+import mimetypes
+import uuid
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import AsyncGenerator, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, InputFile
+
+import config
+from scheduler import download_slots
+
+logger = logging.getLogger(__name__)
+
+class StreamInputFile(InputFile):
+    """
+    يمرر جسم استجابة aiohttp مفتوحة مباشرة إلى رفع Bot API (multipart) بدون المرور بالقرص.
+    الاستجابة يجب أن تبقى مفتوحة حتى ينتهي الإرسال (تُدار عبر AsyncExitStack).
+    """
+    def __init__(self, response: aiohttp.ClientResponse, filename: str, chunk_size: int = 256 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self._response = response
+        # ما مرّ فعليًا عبر البوت (لإحصاءات الاستخدام)
+        self.bytes_read = 0
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        async for chunk in self._response.content.iter_chunked(self.chunk_size):
+            self.bytes_read += len(chunk)
+            yield chunk
+
+def _relay_filename(media_url: str, response: aiohttp.ClientResponse) -> str:
+    name = Path(urlparse(media_url).path).name
+    if '.' in name:
+        return name
+    ctype = response.headers.get("Content-Type", "").split(";")[0].strip()
+    return f"{uuid.uuid4().hex}{mimetypes.guess_extension(ctype) or ''}"
+
+async def _read_capped(response: aiohttp.ClientResponse, limit: int) -> Optional[bytes]:
+    chunks, total = [], 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        total += len(chunk)
+        if total > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def open_relay(stack: AsyncExitStack, session: aiohttp.ClientSession, media_url: str,
+                     max_size: int = config.MAX_FILE_SIZE) -> Optional[InputFile]:
+    """
+    فتح رابط الوسائط وإرجاع InputFile جاهز للرفع بدون قرص:
+    - حتى RELAY_BUFFER_MAX: BufferedInputFile في الذاكرة (الاتصال يُغلق فورًا).
+    - حتى max_size مع Content-Length معروف: StreamInputFile (الاتصال يبقى مفتوحًا ضمن stack).
+    - غير ذلك (أكبر/حجم غير معروف/فشل): None ليُستخدم مسار القرص.
+    """
+    try:
+        response = await stack.enter_async_context(
+            session.get(media_url, timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60))
+        )
+        if response.status != 200:
+            return None
+        filename = _relay_filename(media_url, response)
+        length = response.content_length
+        if length is None or length <= config.RELAY_BUFFER_MAX:
+            async with download_slots:
+                data = await _read_capped(response, config.RELAY_BUFFER_MAX)
+            return BufferedInputFile(data, filename=filename) if data is not None else None
+        if length <= max_size:
+            return StreamInputFile(response, filename=filename)
+        return None
+    except Exception as e:
+        logger.warning("Relay open failed for %s: %s", media_url, e)
+        return None
@@ -0,0 +1,129 @@
+# scheduler.py
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Stage concurrency limits (مشتركة بين كل العمال) ---
+ytdlp_slots = asyncio.Semaphore(config.YTDLP_CONCURRENCY)
+download_slots = asyncio.Semaphore(config.DOWNLOAD_CONCURRENCY)
+upload_slots = asyncio.Semaphore(config.UPLOAD_CONCURRENCY)
+ffmpeg_slots = asyncio.Semaphore(config.FFMPEG_CONCURRENCY)
+# yt-dlp التخميني (MESSAGE_LOOKAHEAD) من سعة ytdlp_slots نفسها، لكن بميزانية لا تبلغ كل المقاعد
+prefetch_slots = asyncio.Semaphore(max(0, min(config.PREFETCH_YTDLP_SLOTS, config.YTDLP_CONCURRENCY - 1)))
+
+class FairScheduler:
+    """
+    مجموعة عمال ثابتة العدد تخدم المحادثات بالتناوب (round-robin):
+    - مهمة واحدة فقط لكل محادثة في نفس الوقت، بنفس ترتيب الوصول.
+    - المحادثة التي لديها مهام كثيرة تعود لآخر الدور بعد كل مهمة، فلا تحجب غيرها.
+    - المهام الخفيفة (صور فقط) تُقدَّم على الثقيلة (فيديو)، مع ضمان عدم تجويع الثقيلة.
+    """
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], workers: int, heavy_every: int = 3):
+        self._handler = handler
+        self._workers_count = workers
+        self._heavy_every = heavy_every
+        self._queues: Dict[int, Deque[tuple[Any, bool]]] = {}
+        self._busy: set[int] = set()
+        self._ready_light: Deque[int] = deque()
+        self._ready_heavy: Deque[int] = deque()
+        self._light_streak = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    # --- Public API ---
+    def start(self):
+        if self._workers:
+            return
+        self._cond = asyncio.Condition()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self._workers_count)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        انتظار انتهاء كل المهام (الجارية والمنتظرة) حتى timeout ثم إيقاف العمال.
+        يعيد False إذا انتهت المهلة وبقيت مهام لم تُنفذ.
+        """
+        drained = True
+        if self._idle is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                drained = False
+                logger.warning("Scheduler drain timed out: %d queued, %d running", self.pending, self.active)
+        await self.stop()
+        return drained
+
+    async def submit(self, chat_id: int, payload: Any, light: bool = False):
+        """إضافة مهمة لطابور المحادثة (يبدأ العمال تلقائيًا عند أول استدعاء)."""
+        self.start()
+        async with self._cond:
+            queue = self._queues.setdefault(chat_id, deque())
+            queue.append((payload, light))
+            self._idle.clear()
+            if len(queue) == 1 and chat_id not in self._busy:
+                self._mark_ready(chat_id)
+                self._cond.notify()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def active(self) -> int:
+        return len(self._busy)
+
+    @property
+    def queues(self) -> Dict[int, Deque[tuple[Any, bool]]]:
+        """طوابير المحادثات الحالية (للقراءة فقط)؛ طابور المحادثة يُحذف عند فراغه."""
+        return self._queues
+
+    # --- Internals ---
+    def _mark_ready(self, chat_id: int):
+        _, light = self._queues[chat_id][0]
+        (self._ready_light if light else self._ready_heavy).append(chat_id)
+
+    def _pick(self) -> int:
+        take_heavy = self._ready_heavy and (not self._ready_light or self._light_streak >= self._heavy_every)
+        if take_heavy:
+            self._light_streak = 0
+            return self._ready_heavy.popleft()
+        self._light_streak += 1
+        return self._ready_light.popleft()
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._cond:
+                while not (self._ready_light or self._ready_heavy):
+                    await self._cond.wait()
+                chat_id = self._pick()
+                payload, _ = self._queues[chat_id].popleft()
+                self._busy.add(chat_id)
+            try:
+                await self._handler(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Worker %d failed on chat %s: %s", index, chat_id, e)
+            finally:
+                async with self._cond:
+                    self._busy.discard(chat_id)
+                    if self._queues.get(chat_id):
+                        self._mark_ready(chat_id)
+                        self._cond.notify()
+                    else:
+                        self._queues.pop(chat_id, None)
+                    if not self._queues and not self._busy:
+                        self._idle.set()
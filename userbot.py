@@ -0,0 +1,66 @@
+# userbot.py
+import asyncio
+import importlib
+import logging
+from typing import TYPE_CHECKING, Optional
+
+import config
+
+if TYPE_CHECKING:
+    from pyrogram import Client as PyroClient
+
+logger = logging.getLogger(__name__)
+
+# --- Shared Pyrogram client (للفيديوهات الأكبر من حد Bot API) ---
+# عميل واحد يبدأ مع البوت ويُعاد استخدامه لكل الرفعات بدل handshake لكل ملف.
+# pyrogram يُستورد عند أول استخدام فقط (استيراده يكلّف قرابة ثانية عند بدء التشغيل)
+_client: Optional["PyroClient"] = None
+_client_lock = asyncio.Lock()
+# حد أقصى للرفعات المتزامنة عبر MTProto
+pyro_upload_slots = asyncio.Semaphore(config.PYRO_MAX_CONCURRENT_UPLOADS)
+
+async def start_userbot() -> "PyroClient":
+    """تشغيل العميل المشترك (آمن للاستدعاء المتكرر)."""
+    global _client
+    async with _client_lock:
+        if _client is not None and _client.is_connected:
+            return _client
+        # الاستيراد في خيط حتى لا يوقف حلقة الأحداث
+        pyrogram = await asyncio.to_thread(importlib.import_module, "pyrogram")
+        client = pyrogram.Client(
+            "user_bot",
+            api_id=config.API_ID,
+            api_hash=config.API_HASH,
+            session_string=config.PYRO_SESSION_STRING,
+            in_memory=True,
+        )
+        await client.start()
+        _client = client
+        logger.info("Pyrogram client started")
+        return _client
+
+async def get_userbot() -> "PyroClient":
+    """إرجاع العميل المشترك، مع تشغيله عند الحاجة (مثلاً بعد انقطاع)."""
+    if _client is not None and _client.is_connected:
+        return _client
+    return await start_userbot()
+
+async def warm_up():
+    """تشغيل العميل في الخلفية بعد بدء الاستقبال، حتى لا تنتظره أول رفعة كبيرة."""
+    try:
+        await start_userbot()
+    except Exception as e:
+        logger.warning("Pyrogram client failed to start, will retry on first large upload: %s", e)
+
+async def stop_userbot():
+    """إيقاف نظيف للعميل عند إغلاق البوت."""
+    global _client
+    async with _client_lock:
+        if _client is None:
+            return
+        try:
+            if _client.is_connected:
+                await _client.stop()
+        except Exception as e:
+            logger.warning("Pyrogram stop failed: %s", e)
+        _client = None
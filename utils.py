@@ -1,7 +1,15 @@
 # utils.py
+import asyncio
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
 from aiogram.filters import Filter
 from aiogram.filters.callback_data import CallbackData
-from aiogram.types import Message
+from aiogram.types import Message, TelegramObject
 import config
 
 class AdminFilter(Filter):
@@ -18,3 +26,218 @@ class TweetActionCallback(CallbackData, prefix="tweet"):
     action: str
     tweet_id: str
     user_msg_id: int
+
+# --- In-process caches ---
+class TTLCache:
+    """
+    كاش LRU محدود الحجم مع مدة صلاحية لكل عنصر.
+    ttl=None يعني أن العناصر لا تنتهي إلا بالإزاحة (LRU).
+    """
+    __slots__ = ("maxsize", "ttl", "_data")
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[Optional[float], Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+_MISSING = object()
+
+# --- Per-chat state ---
+class ChatState:
+    """حالة المحادثة داخل العملية (__slots__ لأن عددها يصل لعشرات الآلاف)."""
+    __slots__ = ("progress_text", "touched_at", "active")
+
+    def __init__(self):
+        # آخر نص تقدم أُرسل (لتفادي تعديل بنفس النص)
+        self.progress_text: Optional[str] = None
+        self.touched_at = time.monotonic()
+        # عدد المهام الجارية للمحادثة الآن (لا تُزاح ما دام > 0)
+        self.active = 0
+
+class ChatStateStore:
+    """
+    حالة كل محادثة مع إزاحة المحادثات الخاملة: بعد ttl من آخر استخدام، أو الأقدم استخدامًا (LRU) عند تجاوز maxsize.
+    المحادثات المثبتة بـ pin (عامل يعالجها الآن) لا تُزاح مهما كانت قديمة.
+    """
+    __slots__ = ("maxsize", "ttl", "_states")
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._states: "OrderedDict[Hashable, ChatState]" = OrderedDict()
+
+    def get(self, chat_id: Hashable) -> ChatState:
+        """حالة المحادثة (تُنشأ عند الحاجة) وتحديث آخر استخدام."""
+        state = self._states.get(chat_id)
+        if state is None:
+            state = self._states[chat_id] = ChatState()
+            self._evict(keep=chat_id)
+        else:
+            self._states.move_to_end(chat_id)
+        state.touched_at = time.monotonic()
+        return state
+
+    @contextmanager
+    def pin(self, chat_id: Hashable) -> Iterator[ChatState]:
+        """تثبيت المحادثة طوال معالجة مهمة لها."""
+        state = self.get(chat_id)
+        state.active += 1
+        try:
+            yield state
+        finally:
+            state.active -= 1
+            if self._states.get(chat_id) is state:
+                self.get(chat_id)
+
+    def _evict(self, keep: Hashable):
+        now = time.monotonic()
+        excess = len(self._states) - self.maxsize
+        evicted = []
+        # الترتيب من الأقدم استخدامًا: نتوقف عند أول محادثة غير مثبتة وما زالت حية
+        # keep (المحادثة المضافة للتو) لا تُزاح: إن كانت البقية مثبتة نتجاوز maxsize مؤقتًا
+        for chat_id, state in self._states.items():
+            if state.active or chat_id == keep:
+                continue
+            if excess <= 0 and now - state.touched_at < self.ttl:
+                break
+            evicted.append(chat_id)
+            excess -= 1
+        for chat_id in evicted:
+            del self._states[chat_id]
+
+    @property
+    def active(self) -> int:
+        return sum(1 for state in self._states.values() if state.active)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+# --- In-process state accounting (/memory) ---
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+def approx_size(obj: Any) -> int:
+    """
+    حجم تقريبي بالبايت: sys.getsizeof مع محتوى الحاويات والكائنات ذات __slots__.
+    الكائنات الأخرى (رسائل تيليجرام، المهام...) تُحسب سطحيًا فقط حتى لا نتبع مراجعها لكائنات مشتركة.
+    """
+    seen, total, stack = set(), 0, [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+        elif not hasattr(item, "__dict__"):
+            stack.extend(getattr(item, name) for cls in type(item).__mro__
+                         for name in getattr(cls, "__slots__", ()) if hasattr(item, name))
+    return total
+
+_tracked_state: Dict[str, Callable[[], Any]] = {}
+
+def track_state(name: str, source: Callable[[], Any]):
+    """تسجيل بنية داخل العملية (كاش، طوابير المحادثات...) لتظهر في /memory بعدد عناصرها وحجمها."""
+    _tracked_state[name] = source
+
+def state_summary() -> List[Tuple[str, int, int]]:
+    """(الاسم، عدد العناصر، الحجم التقريبي بالبايت) لكل بنية مسجلة."""
+    rows = []
+    for name, source in _tracked_state.items():
+        obj = source()
+        rows.append((name, len(obj), approx_size(obj)))
+    return rows
+
+class SingleFlight:
+    """
+    دمج الاستدعاءات المتزامنة لنفس المفتاح في طلب واحد ("singleflight"):
+    أول مستدعٍ يبدأ العمل، والبقية ينتظرون نفس النتيجة (أو نفس الاستثناء).
+    """
+    __slots__ = ("_inflight",)
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """يعيد (النتيجة، هل كانت مشتركة مع طلب جارٍ)."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield: إلغاء أحد المنتظرين لا يلغي الطلب المشترك
+        return await asyncio.shield(task), shared
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+class UpdateLimiter(BaseMiddleware):
+    """
+    Outer middleware على dp.update: يحد عدد التحديثات المعالجة في نفس الوقت،
+    ويتتبع الجاري منها حتى ينتظره الإغلاق (drain) قبل إغلاق الجلسات.
+    """
+    def __init__(self, limit: int):
+        self._slots = asyncio.Semaphore(limit)
+        self._inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        self._inflight += 1
+        self._idle.clear()
+        try:
+            async with self._slots:
+                return await handler(event, data)
+        finally:
+            self._inflight -= 1
+            if not self._inflight:
+                self._idle.set()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def drain(self, timeout: float) -> bool:
+        """انتظار انتهاء التحديثات الجارية؛ False عند انتهاء المهلة."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
@@ -0,0 +1,160 @@
+# videoprep.py
+import asyncio
+import json
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiogram.types import FSInputFile
+
+import config
+import fsio
+import metrics
+from scheduler import ffmpeg_slots
+
+logger = logging.getLogger(__name__)
+
+# حدود تيليجرام للصورة المصغرة: JPEG بأبعاد حتى 320 وحجم حتى 200KB
+THUMB_MAX_SIDE = 320
+THUMB_MAX_BYTES = 200 * 1024
+_FASTSTART_SUFFIXES = (".mp4", ".m4v", ".mov")
+
+@dataclass
+class VideoInfo:
+    """بيانات الفيديو التي تسمح للعميل بعرضه بأبعاده الصحيحة وتشغيله قبل اكتمال التنزيل."""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[int] = None
+    thumbnail: Optional[Path] = None
+
+    def _dimensions(self) -> Dict:
+        return {name: value for name in ("width", "height", "duration") if (value := getattr(self, name))}
+
+    def bot_kwargs(self) -> Dict:
+        """معاملات reply_video / send_video في Bot API."""
+        kwargs = {"supports_streaming": True, **self._dimensions()}
+        if self.thumbnail:
+            kwargs["thumbnail"] = FSInputFile(self.thumbnail)
+        return kwargs
+
+    def pyrogram_kwargs(self) -> Dict:
+        """معاملات Client.send_video في Pyrogram."""
+        kwargs = {"supports_streaming": True, **self._dimensions()}
+        if self.thumbnail:
+            kwargs["thumb"] = str(self.thumbnail)
+        return kwargs
+
+def info_from_item(item: Dict) -> VideoInfo:
+    """الأبعاد والمدة من بيانات vxtwitter (للإرسال بالرابط أو relay حيث لا يوجد ملف محلي)."""
+    size = item.get("size") or {}
+    duration_ms = item.get("duration_millis")
+    return VideoInfo(width=size.get("width"), height=size.get("height"),
+                     duration=round(duration_ms / 1000) if duration_ms else None)
+
+_tools_available: Optional[bool] = None
+
+def _available() -> bool:
+    global _tools_available
+    if _tools_available is None:
+        _tools_available = bool(config.VIDEO_PREP and shutil.which(config.FFMPEG_BIN) and shutil.which(config.FFPROBE_BIN))
+        if config.VIDEO_PREP and not _tools_available:
+            logger.warning("ffmpeg/ffprobe not found, videos will be sent without faststart/metadata")
+    return _tools_available
+
+def _needs_faststart(path: Path) -> bool:
+    """
+    فحص الـ atoms العليا في MP4: إذا جاء moov بعد mdat فالمشغل لا يبدأ قبل تنزيل الملف كاملًا.
+    (نسخ twimg عادةً جاهزة؛ الدمج المحلي قد لا يكون كذلك)
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, kind = int.from_bytes(header[:4], "big"), header[4:8]
+            if kind == b"moov":
+                return False
+            if kind == b"mdat":
+                return True
+            if size == 1:
+                size = int.from_bytes(f.read(8), "big")
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size >= 8:
+                f.seek(size - 8, os.SEEK_CUR)
+            else:
+                # size == 0 (حتى نهاية الملف) أو ملف تالف
+                return False
+
+async def _run(*args: str) -> tuple[int, bytes]:
+    proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), config.VIDEO_PREP_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode:
+        logger.debug("%s exited with %s: %s", args[0], proc.returncode, err.decode(errors="replace").strip())
+    return proc.returncode, out
+
+async def _faststart(path: Path) -> bool:
+    """نقل moov لبداية الملف بدون إعادة ترميز (-c copy)."""
+    tmp = path.with_name(f"{path.stem}.faststart{path.suffix}")
+    code, _ = await _run(config.FFMPEG_BIN, "-v", "error", "-y", "-i", str(path),
+                         "-map", "0", "-c", "copy", "-movflags", "+faststart", str(tmp))
+    if code or not await fsio.exists(tmp):
+        await fsio.run(tmp.unlink, missing_ok=True)
+        return False
+    await fsio.run(os.replace, tmp, path)
+    return True
+
+async def _probe(path: Path) -> VideoInfo:
+    code, out = await _run(config.FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+                           "-show_entries", "stream=width,height,duration:stream_tags=rotate:stream_side_data=rotation:format=duration",
+                           "-of", "json", str(path))
+    if code:
+        return VideoInfo()
+    data = json.loads(out or b"{}")
+    stream = (data.get("streams") or [{}])[0]
+    width, height = stream.get("width"), stream.get("height")
+    # فيديو الجوال العمودي يُخزن أفقيًا مع زاوية دوران
+    rotation = (stream.get("tags") or {}).get("rotate") or next(
+        (item["rotation"] for item in stream.get("side_data_list") or [] if "rotation" in item), 0)
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    duration = stream.get("duration") or (data.get("format") or {}).get("duration")
+    return VideoInfo(width=width, height=height, duration=round(float(duration)) if duration else None)
+
+async def _thumbnail(path: Path, duration: Optional[int]) -> Optional[Path]:
+    thumb = path.with_name(f"{path.stem}.thumb.jpg")
+    # إطار من الثانية الأولى (أو منتصف المقطع القصير) بدل الإطار الأسود غالبًا في البداية
+    seek = min(1.0, duration / 2) if duration else 0
+    scale = f"scale={THUMB_MAX_SIDE}:{THUMB_MAX_SIDE}:force_original_aspect_ratio=decrease"
+    code, _ = await _run(config.FFMPEG_BIN, "-v", "error", "-y", "-ss", f"{seek:g}", "-i", str(path),
+                         "-frames:v", "1", "-vf", scale, "-q:v", "5", str(thumb))
+    if code or not await fsio.exists(thumb) or await fsio.file_size(thumb) > THUMB_MAX_BYTES:
+        return None
+    return thumb
+
+async def prepare_video(path: Path) -> VideoInfo:
+    """
+    تجهيز فيديو منزّل قبل رفعه: faststart عند الحاجة، ثم الأبعاد والمدة وصورة مصغرة.
+    أي فشل (أو غياب ffmpeg) يعيد ما أمكن من البيانات؛ الإرسال يكمل دائمًا.
+    """
+    if not _available():
+        return VideoInfo()
+    info = VideoInfo()
+    async with ffmpeg_slots:
+        with metrics.timer("video_prep"):
+            try:
+                if path.suffix.lower() in _FASTSTART_SUFFIXES and await fsio.run(_needs_faststart, path):
+                    if await _faststart(path):
+                        metrics.inc("video_faststart_total")
+                info = await _probe(path)
+                info.thumbnail = await _thumbnail(path, info.duration)
+            except Exception as e:
+                logger.warning("Video preparation failed for %s: %s", path.name, e)
+    return info